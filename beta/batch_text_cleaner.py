@@ -6,6 +6,14 @@ Provides text cleaning utilities for batch processing.
 import re
 import unicodedata
 
+from parallel_batch import map_record_texts
+from tosppcrawler.extraction import extract_text
+
+# An opening or closing tag: "<p>", "</div >", "<a href=...>", "<br/>", with
+# the tag name right after "<" and then whitespace, "/" or ">"; comparisons in
+# plain text ("if x < b and c > d", "< section 3 >", "x<y") are not one
+HTML_TAG = re.compile(r'</?[a-zA-Z][a-zA-Z0-9-]*(\s[^<>]*)?/?>')
+
 def remove_html_tags(text):
     """
     Remove HTML tags using regex.
@@ -21,6 +29,13 @@ def remove_javascript(text):
     text = re.sub(r'window\..*?;', '', text)
     return text
 
+def extract_visible_text(text):
+    """
+    Extract visible text from HTML in a single DOM pass, dropping
+    script/style/noscript/template subtrees without regex scanning.
+    """
+    return extract_text(text)
+
 def remove_special_characters(text):
     """
     Remove special characters except basic punctuation.
@@ -38,22 +53,20 @@ def basic_text_cleaner(text):
     Apply a chain of basic text cleaning steps.
     """
     text = normalize_unicode(text)
-    text = remove_html_tags(text)
+    if HTML_TAG.search(text):
+        text = extract_visible_text(text)
     text = remove_javascript(text)
     text = remove_special_characters(text)
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-def clean_batch_texts(records):
+def clean_batch_texts(records, workers=None):
     """
-    Clean text field for a batch of records.
+    Clean text field for a batch of records, spread over `workers`
+    processes (all cores by default, see parallel_batch). Scripts calling
+    it need an `if __name__ == "__main__":` guard.
     """
-    cleaned = []
-    for record in records:
-        updated = record.copy()
-        updated['text'] = basic_text_cleaner(record.get('text', ''))
-        cleaned.append(updated)
-    return cleaned
+    return map_record_texts(basic_text_cleaner, records, workers)
 
 def simulate_batch_cleaning_run():
     """
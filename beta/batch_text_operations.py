@@ -4,95 +4,155 @@ Performs batch text operations across multiple records.
 """
 
 import re
+from functools import partial
 
-def convert_text_to_uppercase(records):
+from parallel_batch import map_record_texts, map_texts
+
+# Every operation takes `workers`: above one, the texts are spread over a
+# process pool (see parallel_batch). A single str method runs faster than
+# the text can be sent to another process, so one worker is the default.
+
+
+_SPECIAL_CHARACTERS = re.compile(r'[^A-Za-z0-9\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _strip_special_characters(text):
+    return _SPECIAL_CHARACTERS.sub('', text)
+
+
+def _normalize_whitespace(text):
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def _replace_keyword(old_word, new_word, text):
+    return text.replace(old_word, new_word)
+
+
+def _count_keyword(keyword, text):
+    return text.lower().split().count(keyword)
+
+
+def convert_text_to_uppercase(records, workers=1):
     """
     Convert text of each record to uppercase.
     """
-    updated_records = []
-    for record in records:
-        updated = record.copy()
-        updated['text'] = record.get('text', '').upper()
-        updated_records.append(updated)
-    return updated_records
+    return map_record_texts(str.upper, records, workers)
 
-def convert_text_to_lowercase(records):
+def convert_text_to_lowercase(records, workers=1):
     """
     Convert text of each record to lowercase.
     """
-    updated_records = []
-    for record in records:
-        updated = record.copy()
-        updated['text'] = record.get('text', '').lower()
-        updated_records.append(updated)
-    return updated_records
+    return map_record_texts(str.lower, records, workers)
 
-def convert_text_to_titlecase(records):
+def convert_text_to_titlecase(records, workers=1):
     """
     Convert text of each record to title case.
     """
-    updated_records = []
-    for record in records:
-        updated = record.copy()
-        updated['text'] = record.get('text', '').title()
-        updated_records.append(updated)
-    return updated_records
+    return map_record_texts(str.title, records, workers)
 
-def strip_special_characters(records):
+def strip_special_characters(records, workers=1):
     """
     Remove non-alphanumeric characters from text.
     """
-    updated_records = []
-    for record in records:
-        updated = record.copy()
-        clean_text = re.sub(r'[^A-Za-z0-9\s]', '', record.get('text', ''))
-        updated['text'] = clean_text
-        updated_records.append(updated)
-    return updated_records
+    return map_record_texts(_strip_special_characters, records, workers)
 
-def normalize_whitespace(records):
+def normalize_whitespace(records, workers=1):
     """
     Normalize whitespace: remove multiple spaces.
     """
-    updated_records = []
-    for record in records:
-        updated = record.copy()
-        normalized_text = re.sub(r'\s+', ' ', record.get('text', '')).strip()
-        updated['text'] = normalized_text
-        updated_records.append(updated)
-    return updated_records
+    return map_record_texts(_normalize_whitespace, records, workers)
+
+def bulk_replace_keyword(records, old_word, new_word, workers=1):
+    """
+    Replace a keyword with another in all records. In a chain:
+    TextOperationChain.replace_keyword.
+    """
+    return map_record_texts(partial(_replace_keyword, old_word, new_word), records, workers)
 
-def bulk_replace_keyword(records, old_word, new_word):
+def count_keyword_occurrences_batch(records, keyword, workers=1):
     """
-    Replace a keyword with another in all records.
+    Count how many times a keyword appears across all records. At the end
+    of a chain: TextOperationChain.count_keyword.
     """
-    updated_records = []
-    for record in records:
-        updated = record.copy()
-        replaced_text = record.get('text', '').replace(old_word, new_word)
-        updated['text'] = replaced_text
-        updated_records.append(updated)
-    return updated_records
+    texts = [record.get('text', '') for record in records]
+    return sum(map_texts(partial(_count_keyword, keyword.lower()), texts, workers))
 
-def count_keyword_occurrences_batch(records, keyword):
+class TextOperationChain:
     """
-    Count how many times a keyword appears across all records.
+    Text operations declared in sequence and fused into one transform per
+    record:
+
+        chain = TextOperationChain().strip_special_characters().normalize_whitespace().lowercase()
+        for record in chain.apply(records):
+            ...
+
+    apply() is lazy: each record is read, transformed by every step and
+    copied once when the next result is requested, so a chain over a
+    generator of records holds one record at a time instead of a full copy
+    of the corpus per step. Adding a step returns a new chain, and a chain
+    is picklable, so it can run in a process pool as a single function.
     """
-    total_count = 0
-    for record in records:
-        text = record.get('text', '').lower()
-        total_count += text.split().count(keyword.lower())
-    return total_count
+
+    def __init__(self, steps=()):
+        self.steps = tuple(steps)
+
+    def then(self, step):
+        """
+        Chain with a picklable text -> text function appended.
+        """
+        return TextOperationChain(self.steps + (step,))
+
+    def uppercase(self):
+        return self.then(str.upper)
+
+    def lowercase(self):
+        return self.then(str.lower)
+
+    def titlecase(self):
+        return self.then(str.title)
+
+    def strip_special_characters(self):
+        return self.then(_strip_special_characters)
+
+    def normalize_whitespace(self):
+        return self.then(_normalize_whitespace)
+
+    def replace_keyword(self, old_word, new_word):
+        return self.then(partial(_replace_keyword, old_word, new_word))
+
+    def __call__(self, text):
+        for step in self.steps:
+            text = step(text)
+        return text
+
+    def apply(self, records, workers=1):
+        """
+        Transformed copies of records, as an iterator. With more than one
+        worker the records are read at once and spread over a process pool.
+        """
+        if workers != 1:
+            return iter(map_record_texts(self, records, workers))
+        return (dict(record, text=self(record.get('text', ''))) for record in records)
+
+    def count_keyword(self, records, keyword, workers=1):
+        """
+        Times keyword appears as a word in the transformed texts, without
+        keeping the transformed records.
+        """
+        count = partial(_count_keyword, keyword.lower())
+        if workers != 1:
+            return sum(map_texts(self.then(count), [record.get('text', '') for record in records], workers))
+        return sum(count(self(record.get('text', ''))) for record in records)
+
 
 def apply_multiple_operations(records):
     """
     Apply a chain of operations: strip special characters, normalize, lower case.
     """
     print("\nApplying Batch Operations...")
-    stripped = strip_special_characters(records)
-    normalized = normalize_whitespace(stripped)
-    lowered = convert_text_to_lowercase(normalized)
-    return lowered
+    chain = TextOperationChain().strip_special_characters().normalize_whitespace().lowercase()
+    return list(chain.apply(records))
 
 def simulate_batch_operations_run():
     """
@@ -0,0 +1,111 @@
+"""
+clean_text_benchmark.py
+Times text_cleaner.clean_text and clean_output_text against the
+one-re.sub-per-rule cleaners they replaced, on the crawled pages in
+output.json repeated to a larger record count, and on unclosed braces,
+where the lazy {...} regex takes quadratic time. The outputs differ where
+strip_code_blocks matches blocks by nesting depth instead of stopping at
+the first closer.
+"""
+
+import json
+import re
+import time
+
+from text_cleaner import clean_output_text, clean_text
+
+RECORD_COUNT = 1000
+UNCLOSED_BRACES = "{ a" * 10000
+
+
+def legacy_clean_text(text):
+    """
+    text_cleaner.clean_text before its rules were compiled and fused.
+
+    Returns:
+        str: Cleaned text.
+    """
+    text = re.sub(r'window\..*?;', '', text)
+    text = re.sub(r'function\s*\(.*?\)\s*{.*?}', '', text, flags=re.DOTALL)
+    text = re.sub(r'\{.*?\}', '', text, flags=re.DOTALL)
+    text = re.sub(r'\[.*?\]', '', text, flags=re.DOTALL)
+    text = re.sub(r'\"[^\"]*\"\s*:\s*\"[^\"]*\"', '', text)
+    text = re.sub(r'\"[^\"]*\"\s*:\s*[^,]*,?', '', text)
+    text = re.sub(r'\"[^"]*\.(graphql|react|rendererRef)[^\"]*\"', '', text)
+    text = re.sub(r'\\"[^\\"]*\\.(graphql|react|rendererRef)[^\\"]*\\"', '', text)
+    text = re.sub(r'css[\]\}\"]+', '', text)
+    text = re.sub(r'[0-9]+', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\x00-\x7F]+', ' ', text)
+    return text.strip()
+
+
+def legacy_clean_output_text(text):
+    """
+    process_output.clean_text before it moved to text_cleaner.
+
+    Returns:
+        str: Cleaned text.
+    """
+    text = re.sub(r'\"[^"]*\.(graphql|react|rendererRef)[^\"]*\"', '', text)
+    text = re.sub(r'\\"[^\\"]*\\.(graphql|react|rendererRef)[^\\"]*\\"', '', text)
+    text = re.sub(r'css[\]\}\"]+', '', text)
+    text = re.sub(r'\{.*?\}', '', text, flags=re.DOTALL)
+    text = re.sub(r'\[.*?\]', '', text, flags=re.DOTALL)
+    text = re.sub(r'[0-9]+', '', text)
+    text = re.sub(r'[,\\\[\]\{\}\"]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\x00-\x7F]+', ' ', text)
+    return text.strip()
+
+
+def load_texts(path="output.json", count=RECORD_COUNT):
+    """
+    Page texts from path, cycled to `count` records.
+
+    Returns:
+        list: `count` strings.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        pages = json.load(f)
+    texts = [page.get("text") or "" for page in pages]
+    return [texts[i % len(texts)] for i in range(count)]
+
+
+def time_cleaner(cleaner, texts):
+    """
+    Cleans every text once.
+
+    Returns:
+        tuple: (seconds taken, list of cleaned texts)
+    """
+    started = time.perf_counter()
+    cleaned = [cleaner(text) for text in texts]
+    return time.perf_counter() - started, cleaned
+
+
+def run_benchmark():
+    texts = load_texts()
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 2 ** 20
+    print(f"{len(texts)} records, {megabytes:.1f} MB of text")
+
+    for name, legacy, current in (
+        ("clean_text", legacy_clean_text, clean_text),
+        ("clean_output_text", legacy_clean_output_text, clean_output_text),
+    ):
+        legacy_seconds, expected = time_cleaner(legacy, texts)
+        current_seconds, cleaned = time_cleaner(current, texts)
+        print(f"{name}:")
+        print(f"  one pass per rule  {legacy_seconds:.2f}s ({megabytes / legacy_seconds:.1f} MB/s)")
+        print(f"  compiled rules     {current_seconds:.2f}s ({megabytes / current_seconds:.1f} MB/s)")
+        changed = sum(1 for new, old in zip(cleaned, expected) if new != old)
+        print(f"  speedup {legacy_seconds / current_seconds:.1f}x, records with different output: {changed}")
+
+    print(f"{len(UNCLOSED_BRACES) // 1000} KB of unclosed braces:")
+    for name, cleaner in (("one pass per rule", legacy_clean_text), ("compiled rules", clean_text)):
+        seconds, _ = time_cleaner(cleaner, [UNCLOSED_BRACES])
+        print(f"  {name:18} {seconds * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    run_benchmark()
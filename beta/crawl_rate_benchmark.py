@@ -0,0 +1,157 @@
+"""
+crawl_rate_benchmark.py
+Benchmarks the adaptive per-domain throttle against local servers that
+simulate slow, overloaded and fast hosts.
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import scrapy
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+
+# address -> (seconds per response, parallel requests served before 503, pages)
+SIMULATED_HOSTS = {
+    "127.0.0.2": (1.0, 2, 20),
+    "127.0.0.3": (1.0, 2, 20),
+    "127.0.0.4": (0.02, 64, 400),
+    "127.0.0.5": (0.02, 64, 400),
+    "127.0.0.6": (0.05, 64, 400),
+}
+PORT = 8790
+
+
+def make_handler(latency, capacity):
+    """
+    Build a request handler that sleeps for `latency` and answers 503 once
+    more than `capacity` requests are in flight.
+    """
+    lock = threading.Lock()
+    active = [0]
+
+    class SimulatedHostHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            with lock:
+                active[0] += 1
+                overloaded = active[0] > capacity
+            try:
+                time.sleep(latency * (3 if overloaded else 1))
+                body = b"<html><body><p>Simulated policy page.</p></body></html>"
+                self.send_response(503 if overloaded else 200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with lock:
+                    active[0] -= 1
+
+        def log_message(self, format, *args):
+            pass
+
+    return SimulatedHostHandler
+
+
+def start_simulated_hosts():
+    """
+    Start one local server per simulated host.
+
+    Returns:
+        list: Running server instances.
+    """
+    servers = []
+    for address, (latency, capacity, _) in SIMULATED_HOSTS.items():
+        server = ThreadingHTTPServer((address, PORT), make_handler(latency, capacity))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+class BenchmarkSpider(scrapy.Spider):
+    name = "crawl_rate_benchmark"
+    custom_settings = {"ROBOTSTXT_OBEY": False, "RETRY_ENABLED": False}
+
+    def start_requests(self):
+        # Interleave hosts so no single host is queued up front
+        for page in range(max(pages for _, _, pages in SIMULATED_HOSTS.values())):
+            for address, (_, _, pages) in SIMULATED_HOSTS.items():
+                if page < pages:
+                    yield scrapy.Request(f"http://{address}:{PORT}/page/{page}", dont_filter=True)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = time.time()
+        self.hosts = {}
+
+    def parse(self, response):
+        # host -> [pages fetched, seconds until the last one arrived]
+        host = self.hosts.setdefault(response.url.split("/")[2], [0, 0.0])
+        host[0] += 1
+        host[1] = time.time() - self.started
+
+
+def benchmark_settings(adaptive):
+    """
+    Project settings with item pipelines and the recrawl caches switched off
+    so only the downloader is measured.
+    """
+    settings = get_project_settings()
+    settings.set("ITEM_PIPELINES", {})
+    settings.set("DOWNLOADER_MIDDLEWARES", {
+        "tosppcrawler.throttle.AdaptiveThrottleMiddleware": 560,
+    })
+    settings.set("ADAPTIVE_THROTTLE_ENABLED", adaptive)
+    settings.set("LOG_LEVEL", "ERROR")
+    if not adaptive:
+        settings.set("CONCURRENT_REQUESTS", 16)
+        settings.set("CONCURRENT_REQUESTS_PER_DOMAIN", 8)
+        settings.set("SCHEDULER_PRIORITY_QUEUE", "scrapy.pqueues.ScrapyPriorityQueue")
+    return settings
+
+
+def run_benchmark():
+    """
+    Crawl the simulated hosts with Scrapy's static limits and with the
+    adaptive throttle, and print throughput and throttle decisions.
+    """
+    install_reactor("twisted.internet.asyncioreactor.AsyncioSelectorReactor")
+    from twisted.internet import defer, reactor
+
+    servers = start_simulated_hosts()
+    results = {}
+
+    @defer.inlineCallbacks
+    def crawl_all():
+        for label, adaptive in (("static", False), ("adaptive", True)):
+            crawler = CrawlerRunner(benchmark_settings(adaptive)).create_crawler(BenchmarkSpider)
+            started = time.time()
+            yield crawler.crawl()
+            results[label] = (time.time() - started, crawler.stats.get_stats(), crawler.spider.hosts)
+        reactor.stop()
+
+    crawl_all()
+    reactor.run()
+
+    for server in servers:
+        server.shutdown()
+
+    total_pages = sum(pages for _, _, pages in SIMULATED_HOSTS.values())
+    for label, (elapsed, stats, hosts) in results.items():
+        ok = stats.get("downloader/response_status_count/200", 0)
+        unavailable = stats.get("downloader/response_status_count/503", 0)
+        print(f"\n{label}: {total_pages} pages in {elapsed:.2f}s "
+              f"({ok / elapsed:.1f} ok/s, {unavailable} x 503)")
+        for host, (pages, finished) in sorted(hosts.items()):
+            print(f"  {host}: {pages} pages ok, done after {finished:.2f}s")
+        for key in sorted(stats):
+            if key.startswith("adaptive_throttle/"):
+                print(f"  {key}: {stats[key]}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,125 @@
+"""
+parallel_batch.py
+Runs a per-text function over a batch of records in a process pool. Texts
+are sent in chunks sized by the amount of text rather than the number of
+records, so one chunk of long policies and one of short snippets keep a
+worker busy for about as long, and results come back in record order.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Largest chunk, in characters of text; cleaning time grows with it
+CHUNK_CHARS = 4 * 1024 * 1024
+# Smallest chunk worth shipping to another process
+MIN_CHUNK_CHARS = 64 * 1024
+# Chunks per worker, so a slow chunk does not leave the others idle
+CHUNKS_PER_WORKER = 4
+
+
+def chunk_texts(texts, chunk_chars):
+    """
+    Split texts into consecutive chunks of about chunk_chars characters.
+    A text longer than chunk_chars gets a chunk of its own.
+
+    Args:
+        texts (list): Strings to split.
+        chunk_chars (int): Target characters per chunk.
+
+    Returns:
+        list: Lists of strings, in order.
+    """
+    chunks = []
+    chunk = []
+    size = 0
+    for text in texts:
+        if chunk and size + len(text) > chunk_chars:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        chunk.append(text)
+        size += len(text)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _apply_to_chunk(function, texts):
+    # Runs in a worker process
+    return [function(text) for text in texts]
+
+
+def new_executor(workers=None):
+    """
+    Process pool for map_texts, to share one pool between several calls.
+    spawn rather than fork, as in the crawler's enrichment pipeline: workers
+    re-import __main__, so scripts need an `if __name__ == "__main__":`
+    guard.
+
+    Args:
+        workers (int): Worker processes, all cores by default.
+
+    Returns:
+        ProcessPoolExecutor: The pool; shut it down when done.
+    """
+    return ProcessPoolExecutor(workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn'))
+
+
+def map_texts(function, texts, workers=None, chunk_chars=CHUNK_CHARS, executor=None):
+    """
+    Apply function to every text in a process pool.
+
+    function must be picklable: a module-level function, a str method such
+    as str.lower, or a functools.partial of one. With one worker, or less
+    text than one small chunk, it runs in this process instead.
+
+    Args:
+        function (callable): Takes a string.
+        texts (list): Strings to process.
+        workers (int): Worker processes, all cores by default; with an
+            executor, the number of workers it has.
+        chunk_chars (int): Largest chunk, in characters.
+        executor (Executor): Pool to use instead of starting one.
+
+    Returns:
+        list: function(text) for every text, in order.
+    """
+    texts = list(texts)
+    workers = workers or os.cpu_count() or 1
+    total = sum(len(text) for text in texts)
+    if workers == 1 or total <= MIN_CHUNK_CHARS:
+        return [function(text) for text in texts]
+
+    target = max(MIN_CHUNK_CHARS, min(chunk_chars, total // (workers * CHUNKS_PER_WORKER) + 1))
+    chunks = chunk_texts(texts, target)
+    pool = executor or new_executor(workers)
+    try:
+        results = []
+        for chunk_results in pool.map(_apply_to_chunk, [function] * len(chunks), chunks):
+            results.extend(chunk_results)
+        return results
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+
+def map_record_texts(function, records, workers=None, chunk_chars=CHUNK_CHARS, executor=None):
+    """
+    Apply function to the 'text' field of every record in a process pool.
+    Only the texts travel to the workers; each record is copied once, here,
+    with its new text.
+
+    Args:
+        function (callable): Takes a string.
+        records (list): Dicts with a 'text' field.
+        workers (int): Worker processes, all cores by default.
+        chunk_chars (int): Largest chunk, in characters.
+        executor (Executor): Pool to use instead of starting one.
+
+    Returns:
+        list: Copies of the records with their text replaced, in order.
+    """
+    records = list(records)
+    texts = map_texts(function, [record.get('text', '') for record in records], workers, chunk_chars, executor)
+    return [dict(record, text=text) for record, text in zip(records, texts)]
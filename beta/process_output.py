@@ -1,25 +1,8 @@
 import json
 import nltk
 from collections import Counter
-import re
-
-def clean_text(text):
-    # Step 1: Remove known garbage patterns
-    text = re.sub(r'\"[^"]*\.(graphql|react|rendererRef)[^\"]*\"', '', text)  # remove .graphql, .react, .rendererRef
-    text = re.sub(r'\\"[^\\"]*\\.(graphql|react|rendererRef)[^\\"]*\\"', '', text)  # for escaped quotes
-    text = re.sub(r'css[\]\}\"]+', '', text)  # remove random 'css]]}' junk
-    text = re.sub(r'\{.*?\}', '', text, flags=re.DOTALL)  # remove {...}
-    text = re.sub(r'\[.*?\]', '', text, flags=re.DOTALL)  # remove [...]
-    
-    # Step 2: Remove leftover numbers, special chars artifacts
-    text = re.sub(r'[0-9]+', '', text)  # remove numbers
-    text = re.sub(r'[,\\\[\]\{\}\"]+', ' ', text)  # remove stray brackets and commas
-    text = re.sub(r'\s+', ' ', text)  # collapse spaces
-    
-    # Step 3: Keep only readable ASCII characters
-    text = re.sub(r'[^\x00-\x7F]+', ' ', text)  # remove non-ASCII
-
-    return text.strip()
+
+from text_cleaner import clean_output_text
 
 # Step 1: Load output.json fully
 with open('output.json', 'r', encoding='utf-8') as f:
@@ -86,7 +69,7 @@ def most_frequent_noun(text):
 
 # Step 6: Apply the functions to each record
 for item in data:
-    item['text'] = clean_text(item['text'])
+    item['text'] = clean_output_text(item['text'])
     stats = basic_text_statistics(item['text'])
     item['total_words'] = stats['total_words']
     item['total_sentences'] = stats['total_sentences']
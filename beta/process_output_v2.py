@@ -9,6 +9,7 @@ from text_cleaner import clean_text, basic_text_preprocess
 from text_miner import basic_text_statistics, most_frequent_noun, most_frequent_verb, sentiment_score, named_entities
 from summarizer import summarize_100_words, summarize_one_sentence
 from data_validators import validate_dataset
+from tosppcrawler.language import detect_language, english_or_unknown
 
 # Load simulated dataset
 try:
@@ -20,9 +21,18 @@ except Exception as e:
     data = []
 
 # Process each record
+skipped = 0
 for idx, item in enumerate(data):
     try:
         original_text = item.get('text', '')
+        # Told from the text as crawled: clean_text drops non-ASCII letters.
+        # Records tagged by the crawler keep their language.
+        item['language'] = item.get('language') or detect_language(original_text)
+        if not english_or_unknown(item['language']):
+            # The tokenizers, taggers, VADER and summaries are English-only
+            skipped += 1
+            continue
+
         cleaned_text = clean_text(original_text)
 
         # Basic statistics
@@ -48,6 +58,9 @@ for idx, item in enumerate(data):
     except Exception as e:
         print(f"Error processing record {idx}: {str(e)}")
 
+if skipped:
+    print(f"Skipped NLP on {skipped} records that are not in English.")
+
 # Save updated data
 save_json_file(data, 'simulated_output_with_stats.json')
 print("Saved updated simulated data to simulated_output_with_stats.json")
@@ -0,0 +1,124 @@
+"""
+sqlite_write_benchmark.py
+Compares the SQLite pipeline's batched WAL writes on a background thread
+with the previous commit-per-item write path on a temporary database. For
+each path it reports total time and how long the reactor thread was busy
+storing items, i.e. time during which no download could make progress.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from twisted.internet import defer, reactor
+
+from tosppcrawler.db_pipeline import SQLitePipeline
+
+ITEM_COUNT = 5000
+
+
+def load_items(path="output.json", count=ITEM_COUNT):
+    """
+    Build benchmark items by cycling through the crawled pages in path.
+
+    Returns:
+        list: `count` item dicts with title, url and text.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        pages = json.load(f)
+    return [
+        {"title": page.get("title"), "url": f"{page['url']}#{i}", "text": page.get("text")}
+        for i, page in zip(range(count), pages * (count // len(pages) + 1))
+    ]
+
+
+def write_per_item(db_path, items):
+    """
+    The write path SQLitePipeline used before batching: rollback journal and
+    one commit per item, all of it on the calling thread.
+
+    Returns:
+        float: Seconds the calling thread spent writing.
+    """
+    started = time.perf_counter()
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tos_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            url TEXT,
+            text TEXT
+        )
+    ''')
+    connection.commit()
+    for item in items:
+        cursor.execute('''
+            INSERT INTO tos_data (title, url, text) VALUES (?, ?, ?)
+        ''', (item.get('title'), item.get('url'), item.get('text')))
+        connection.commit()
+    connection.close()
+    return time.perf_counter() - started
+
+
+@defer.inlineCallbacks
+def write_batched(db_path, items, batch_size=100):
+    """
+    Feed items through the current SQLitePipeline on the running reactor.
+
+    Returns:
+        Deferred: Fires with the seconds the reactor thread spent in
+        process_item and close_spider.
+    """
+    pipeline = SQLitePipeline(db_path, batch_size=batch_size)
+    yield pipeline.open_spider(None)
+    blocked = 0.0
+    pending = []
+    for item in items:
+        started = time.perf_counter()
+        pending.append(pipeline.process_item(item, None))
+        blocked += time.perf_counter() - started
+    started = time.perf_counter()
+    closed = pipeline.close_spider(None)
+    blocked += time.perf_counter() - started
+    yield defer.gatherResults(pending + [closed])
+    return blocked
+
+
+def count_rows(db_path):
+    """
+    Number of rows stored in the tos_data table of db_path.
+    """
+    connection = sqlite3.connect(db_path)
+    rows = connection.execute("SELECT COUNT(*) FROM tos_data").fetchone()[0]
+    connection.close()
+    return rows
+
+
+@defer.inlineCallbacks
+def run_benchmark():
+    """
+    Time both write paths and report their throughput and reactor time.
+    """
+    items = load_items()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, write in (("commit per item", write_per_item), ("batched + WAL, writer thread", write_batched)):
+            db_path = os.path.join(tmp, f"{len(results)}.db")
+            started = time.perf_counter()
+            blocked = yield defer.maybeDeferred(write, db_path, items)
+            elapsed = time.perf_counter() - started
+            rows = count_rows(db_path)
+            results[label] = elapsed
+            print(f"{label}: {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s), "
+                  f"reactor busy {blocked:.2f}s")
+
+    print(f"speedup: {results['commit per item'] / results['batched + WAL, writer thread']:.1f}x")
+    reactor.stop()
+
+
+if __name__ == "__main__":
+    reactor.callWhenRunning(run_benchmark)
+    reactor.run()
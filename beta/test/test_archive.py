@@ -0,0 +1,129 @@
+"""
+tests/test_archive.py
+Unit tests for the record-and-replay response archive and for keeping
+replays away from the state of real crawls. They run under Twisted's trial
+test case, which spins the reactor until the Deferreds returned by a test
+have fired.
+"""
+
+import os
+import tempfile
+
+from scrapy import Spider
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from tosppcrawler.archive import ArchiveDownloadHandler, ArchiveRecorderMiddleware, ResponseArchive
+from tosppcrawler.middlewares import TosppcrawlerDownloaderMiddleware
+from tosppcrawler.pipelines import ContentFingerprintPipeline, SiteBoilerplatePipeline
+from tosppcrawler.url_feed import StartUrlFeed
+
+BODY = b"<html><body><p>We may update these terms.</p></body></html>"
+
+
+class TestResponseArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spider = Spider("test")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def crawler(self, mode):
+        return get_crawler(Spider, {"ARCHIVE_MODE": mode, "ARCHIVE_DIR": self.tmp.name})
+
+    @defer.inlineCallbacks
+    def record(self, *urls):
+        recorder = ArchiveRecorderMiddleware.from_crawler(self.crawler("record"))
+        yield recorder.spider_opened(self.spider)
+        for url in urls:
+            request = Request(url)
+            response = HtmlResponse(url, status=200, headers={"ETag": '"v1"'}, body=BODY, request=request)
+            self.assertIs(recorder.process_response(request, response, self.spider), response)
+        yield recorder.spider_closed(self.spider)
+
+    def test_latest_record_wins(self):
+        archive = ResponseArchive(self.tmp.name)
+        archive.write("f1", "https://example.com/a", 200, {}, b"old")
+        archive.write("f1", "https://example.com/a", 200, {}, b"new")
+        archive.write("f2", "https://example.com/b", 404, {"X": ["1"]}, b"")
+        self.assertEqual(archive.read("f1")[1], b"new")
+        self.assertIsNone(archive.read("f3"))
+        self.assertEqual([meta["url"] for meta, _ in archive], ["https://example.com/a", "https://example.com/b"])
+        archive.close()
+
+    def test_recorder_only_runs_when_recording(self):
+        with self.assertRaises(NotConfigured):
+            ArchiveRecorderMiddleware.from_crawler(self.crawler(None))
+
+    @defer.inlineCallbacks
+    def test_replay_round_trip(self):
+        yield self.record("https://example.com/terms", "https://example.com/cookies")
+        handler = ArchiveDownloadHandler.from_crawler(self.crawler("replay"))
+        request = Request("https://example.com/terms")
+        response = handler.download_request(request, self.spider).result
+        self.assertIsInstance(response, HtmlResponse)
+        self.assertEqual((response.status, response.body), (200, BODY))
+        self.assertEqual(response.headers.get("ETag"), b'"v1"')
+        self.assertIn("archived", response.flags)
+
+        failures = []
+        handler.download_request(Request("https://example.com/privacy"), self.spider).addErrback(failures.append)
+        self.assertTrue(failures[0].check(IgnoreRequest))
+        handler.close()
+
+    @defer.inlineCallbacks
+    def test_records_are_indexed_in_batches(self):
+        yield self.record(*(f"https://example.com/{page}" for page in range(5)))
+        archive = ResponseArchive(self.tmp.name)
+        self.assertEqual([meta["url"] for meta, _ in archive], [f"https://example.com/{page}" for page in range(5)])
+        archive.close()
+
+
+class TestReplayIsolation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state_db = os.path.join(self.tmp.name, "state.db")
+        self.settings = {
+            "ARCHIVE_MODE": "replay",
+            "FINGERPRINT_DB": self.state_db,
+            "VALIDATOR_CACHE_DB": self.state_db,
+            "SITE_BOILERPLATE_DB": self.state_db,
+            "FEED_CURSOR_DB": self.state_db,
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_validators_and_fingerprints_are_off(self):
+        crawler = get_crawler(Spider, self.settings)
+        with self.assertRaises(NotConfigured):
+            TosppcrawlerDownloaderMiddleware.from_crawler(crawler)
+        with self.assertRaises(NotConfigured):
+            ContentFingerprintPipeline.from_crawler(crawler)
+
+    def test_site_lines_are_only_read(self):
+        pipeline = SiteBoilerplatePipeline.from_crawler(get_crawler(Spider, self.settings))
+        pipeline.open_spider(None)
+        for topic in ("Cookies", "Rights", "Contact"):
+            item = pipeline.process_item({"url": f"https://example.com/{topic}", "text": f"Menu\n{topic}"}, None)
+            self.assertEqual(item["text"], f"Menu\n{topic}")
+        self.assertEqual(pipeline.site_lines.shards[0].stats(), (0, 0, 0))
+        pipeline.close_spider(None)
+
+    def test_feed_cursor_is_not_kept(self):
+        urls_file = os.path.join(self.tmp.name, "urls.txt")
+        with open(urls_file, "w", encoding="utf-8") as f:
+            f.write("https://example.com/terms\n")
+        spider = Spider.from_crawler(get_crawler(Spider, self.settings), "test", urls_file=urls_file)
+        feed = StartUrlFeed.from_spider(spider)
+        for position, url in feed:
+            feed.done(feed.request(Request(url), position))
+        feed.spider_closed(spider)
+        self.assertFalse(os.path.exists(self.state_db))
+
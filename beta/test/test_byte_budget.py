@@ -0,0 +1,123 @@
+"""
+tests/test_byte_budget.py
+Unit tests for the response byte budget middleware, feeding body chunks
+through its bytes_received handler the way the downloader does. They run
+under Twisted's trial test case, which spins the reactor until the Deferreds
+returned by a test have fired.
+"""
+
+import os
+import sqlite3
+import tempfile
+
+from scrapy import Spider
+from scrapy.exceptions import IgnoreRequest, StopDownload
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from tosppcrawler.budget import ByteBudgetMiddleware
+from tosppcrawler.sharding import shard_index, shard_paths
+
+CHUNK = b"<p>" + b"x" * 96 + b"</p>"
+
+
+class TestByteBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spider = Spider("test")
+        self.middleware = None
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        if self.middleware is not None:
+            yield self.middleware.spider_closed(self.spider)
+        self.tmp.cleanup()
+
+    def make_middleware(self, **settings):
+        settings.setdefault("BYTE_BUDGET_DB", os.path.join(self.tmp.name, "budget.db"))
+        self.middleware = ByteBudgetMiddleware(get_crawler(Spider, settings))
+        self.middleware.spider_opened(self.spider)
+        return self.middleware
+
+    def recorded_hits(self, db_path):
+        """
+        (url, limit hit, action) of every hit recorded in db_path.
+        """
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute("SELECT url, limit_hit, action FROM byte_budget_hits ORDER BY url").fetchall()
+        conn.close()
+        return rows
+
+    def download(self, url, chunks):
+        """
+        Feed chunks to the middleware until it stops the download.
+
+        Returns:
+            tuple: (request, number of chunks accepted, StopDownload or None)
+        """
+        request = Request(url)
+        for count in range(chunks):
+            try:
+                self.middleware.bytes_received(CHUNK, request, self.spider)
+            except StopDownload as stop:
+                return request, count, stop
+        return request, chunks, None
+
+    def test_response_limit_truncates_at_block_boundary(self):
+        middleware = self.make_middleware(BYTE_BUDGET_RESPONSE=350)
+        request, accepted, stop = self.download("https://example.com/terms", 10)
+        self.assertEqual(accepted, 3)
+        self.assertFalse(stop.fail)
+
+        # What the downloader delivers: every byte received, cut mid-tag
+        received = CHUNK * 4 + b"<p>xx"
+        response = HtmlResponse(request.url, body=received, request=request, flags=["download_stopped"])
+        truncated = middleware.process_response(request, response, self.spider)
+        self.assertEqual(truncated.body, CHUNK * 4)
+        self.assertIn("truncated", truncated.flags)
+
+    def test_oversized_content_length_is_downloaded_up_to_the_limit(self):
+        middleware = self.make_middleware(BYTE_BUDGET_RESPONSE=350)
+        request = Request("https://example.com/terms")
+        self.assertIsNone(middleware.headers_received({}, 10_000_000, request, self.spider))
+        _, accepted, stop = self.download("https://example.com/terms", 100_000)
+        self.assertEqual(accepted, 3)
+        self.assertFalse(stop.fail)
+
+    def test_abort_mode_fails_the_download(self):
+        middleware = self.make_middleware(BYTE_BUDGET_RESPONSE=350, BYTE_BUDGET_TRUNCATE=False)
+        _, _, stop = self.download("https://example.com/terms", 10)
+        self.assertTrue(stop.fail)
+        with self.assertRaises(StopDownload):
+            middleware.headers_received({}, 10_000_000, Request("https://example.com/big"), self.spider)
+
+    def test_domain_budget_ignores_further_requests(self):
+        middleware = self.make_middleware(BYTE_BUDGET_DOMAIN=500)
+        self.download("https://example.com/a", 4)
+        self.download("https://example.com/b", 4)
+        with self.assertRaises(IgnoreRequest):
+            middleware.process_request(Request("https://example.com/c"), self.spider)
+        self.assertIsNone(middleware.process_request(Request("https://example.org/"), self.spider))
+
+    @defer.inlineCallbacks
+    def test_hits_are_recorded(self):
+        self.make_middleware(BYTE_BUDGET_RESPONSE=350)
+        self.download("https://example.com/big", 10)
+        self.download("https://example.com/small", 2)
+        yield self.middleware.writer.close()
+        self.assertEqual(self.recorded_hits(os.path.join(self.tmp.name, "budget.db")),
+                         [("https://example.com/big", "response", "truncated")])
+
+    @defer.inlineCallbacks
+    def test_hits_are_kept_in_the_shard_of_their_site(self):
+        self.make_middleware(BYTE_BUDGET_RESPONSE=350, SQLITE_SHARDS=4)
+        urls = [f"https://{host}/terms" for host in ("a.example.com", "example.org", "example.net")]
+        for url in urls:
+            self.download(url, 10)
+        yield self.middleware.writer.close()
+        for url in urls:
+            path = shard_paths(os.path.join(self.tmp.name, "budget.db"), 4)[shard_index(url, 4)]
+            self.assertIn((url, "response", "truncated"), self.recorded_hits(path))
@@ -0,0 +1,98 @@
+"""
+tests/test_clean_text_equivalence.py
+Checks that text_cleaner.clean_text and clean_output_text give exactly the
+output of applying their rules one re.sub at a time, on the crawled pages
+in output.json, on hand-written edge cases and on random strings built
+from the characters the rules react to. Code blocks are removed with
+strip_code_blocks in both, see test_cleaner.py for its own tests.
+"""
+
+import json
+import os
+import random
+import re
+import unittest
+
+from text_cleaner import clean_output_text, clean_text, strip_code_blocks
+
+OUTPUT_JSON = os.path.join(os.path.dirname(__file__), "..", "output.json")
+
+
+def reference_clean_text(text):
+    # text_cleaner.clean_text rules, one pass each
+    text = re.sub(r'window\..*?;', '', text)
+    text = strip_code_blocks(text, function_definitions=True)
+    text = re.sub(r'\"[^\"]*\"\s*:\s*\"[^\"]*\"', '', text)
+    text = re.sub(r'\"[^\"]*\"\s*:\s*[^,]*,?', '', text)
+    text = re.sub(r'\"[^"]*\.(graphql|react|rendererRef)[^\"]*\"', '', text)
+    text = re.sub(r'\\"[^\\"]*\\.(graphql|react|rendererRef)[^\\"]*\\"', '', text)
+    text = re.sub(r'css[\]\}\"]+', '', text)
+    text = re.sub(r'[0-9]+', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\x00-\x7F]+', ' ', text)
+    return text.strip()
+
+
+def reference_clean_output_text(text):
+    # text_cleaner.clean_output_text rules, one pass each
+    text = re.sub(r'\"[^"]*\.(graphql|react|rendererRef)[^\"]*\"', '', text)
+    text = re.sub(r'\\"[^\\"]*\\.(graphql|react|rendererRef)[^\\"]*\\"', '', text)
+    text = re.sub(r'css[\]\}\"]+', '', text)
+    text = strip_code_blocks(text)
+    text = re.sub(r'[0-9]+', '', text)
+    text = re.sub(r'[,\\\[\]\{\}\"]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\x00-\x7F]+', ' ', text)
+    return text.strip()
+
+
+EDGE_CASES = [
+    "",
+    "   ",
+    "Plain policy text.",
+    "window.test = 'value'; Some normal text. function() { return 1; }",
+    "[ window.x ] ; y",
+    "{ unclosed [ brackets ] and } more { open",
+    "[a{b]c}",
+    "}{}{",
+    '"x""k":"v": y',
+    '"a": "b", "c": "d", "e": 5, rest',
+    '"relay.graphql" \\"x.react\\" \\"y\\.rendererRef\\"',
+    'css]]} css"} cssx',
+    "function (a) \n { b } function(c) d",
+    "12 apples and 3 pears  café naïve é é",
+    "\x1c\x1d\x1e\x1f\x85 control separators \x0b\x0c",
+    "éé leading and trailing é",
+    "a,,b \\ c\" d",
+    "lone \ud800 surrogate 42",
+]
+
+FUZZ_ALPHABET = list('{}[]()";:,.\\ \n\t09axé ') + [
+    "window.", "function", "css", "graphql", "react", "rendererRef",
+]
+
+
+class TestCleanTextEquivalence(unittest.TestCase):
+
+    def assert_equivalent(self, text):
+        self.assertEqual(clean_text(text), reference_clean_text(text), repr(text))
+        self.assertEqual(clean_output_text(text), reference_clean_output_text(text), repr(text))
+
+    def test_crawled_pages(self):
+        with open(OUTPUT_JSON, "r", encoding="utf-8") as f:
+            pages = json.load(f)
+        for page in pages:
+            self.assert_equivalent(page["text"])
+
+    def test_edge_cases(self):
+        for text in EDGE_CASES:
+            self.assert_equivalent(text)
+
+    def test_random_strings(self):
+        rng = random.Random(19)
+        for _ in range(3000):
+            self.assert_equivalent("".join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(0, 60))))
+
+
+if __name__ == "__main__":
+    unittest.main()
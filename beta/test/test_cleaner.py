@@ -3,8 +3,9 @@ tests/test_cleaner.py
 Unit tests for text_cleaner.py functions.
 """
 
+import time
 import unittest
-from text_cleaner import clean_text, basic_text_preprocess
+from text_cleaner import clean_text, basic_text_preprocess, strip_code_blocks
 
 class TestTextCleaner(unittest.TestCase):
 
@@ -32,5 +33,37 @@ class TestTextCleaner(unittest.TestCase):
         processed = basic_text_preprocess(raw_text)
         self.assertEqual(processed, "hi how are you")
 
+
+class TestStripCodeBlocks(unittest.TestCase):
+
+    def test_nested_blocks_are_removed_whole(self):
+        self.assertEqual(strip_code_blocks("a {b {c} [d, {e}] f} g"), "a  g")
+        self.assertEqual(strip_code_blocks("[1, [2, [3]]] end"), " end")
+
+    def test_brackets_in_string_literals_do_not_count(self):
+        self.assertEqual(strip_code_blocks('x {"k": "}", "q": "a\\"]"} y'), "x  y")
+
+    def test_unclosed_opener_is_kept_as_text(self):
+        self.assertEqual(strip_code_blocks("see { note and {x} [y] here"), "see { note and   here")
+        self.assertEqual(strip_code_blocks("{ a [ b {c} d"), "{ a [ b  d")
+
+    def test_stray_and_mismatched_closers(self):
+        self.assertEqual(strip_code_blocks("a } b ] c"), "a } b ] c")
+        self.assertEqual(strip_code_blocks("{ a ] b } c"), " c")
+
+    def test_function_definitions(self):
+        text = "Keep. function (a, b) { if (a) { return {x: b}; } } Also keep."
+        self.assertEqual(strip_code_blocks(text, function_definitions=True), "Keep.  Also keep.")
+        self.assertEqual(strip_code_blocks(text), "Keep. function (a, b)  Also keep.")
+        self.assertEqual(strip_code_blocks("function (x) without body", function_definitions=True),
+                         "function (x) without body")
+
+    def test_pathological_input_is_linear(self):
+        for text in ("{ a" * 100000, "{" + '"\\' * 100000, "{" * 100000 + "}" * 100000):
+            started = time.perf_counter()
+            strip_code_blocks(text, function_definitions=True)
+            self.assertLess(time.perf_counter() - started, 2.0)
+
+
 if __name__ == "__main__":
     unittest.main()
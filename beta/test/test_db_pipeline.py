@@ -0,0 +1,178 @@
+"""
+tests/test_db_pipeline.py
+Unit tests for the batched SQLite item pipeline and its background writer
+thread. They run under Twisted's trial test case, which spins the reactor
+until the Deferreds returned by a test have fired.
+"""
+
+import os
+import sqlite3
+import tempfile
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from tosppcrawler.db_pipeline import SQLitePipeline, open_store
+from tosppcrawler.writer import EnginePause
+
+
+class Engine:
+    # The pause flag of Scrapy's ExecutionEngine
+    paused = False
+
+    def pause(self):
+        self.paused = True
+
+    def unpause(self):
+        self.paused = False
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, count=1, start=0):
+        self.values[key] = self.values.get(key, start) + count
+
+
+class Crawler:
+    def __init__(self):
+        self.engine = Engine()
+        self.stats = Stats()
+
+
+class TestSQLitePipeline(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "test.db")
+        self.pipeline = SQLitePipeline(self.db_path, batch_size=3, flush_interval=60)
+        yield self.pipeline.open_spider(None)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.pipeline.close_spider(None)
+        self.tmp.cleanup()
+
+    def stored_urls(self):
+        connection = sqlite3.connect(self.db_path)
+        urls = [row[0] for row in connection.execute("SELECT url FROM tos_data ORDER BY id")]
+        connection.close()
+        return urls
+
+    def add(self, *urls, text="Policy text"):
+        return [
+            self.pipeline.process_item({"title": "Terms", "url": url, "text": text}, None)
+            for url in urls
+        ]
+
+    @defer.inlineCallbacks
+    def test_writes_once_batch_is_full(self):
+        first = self.add("https://example.com/1", "https://example.com/2")
+        self.assertFalse(first[0].called)
+        yield defer.gatherResults(first + self.add("https://example.com/3"))
+        self.assertEqual(len(self.stored_urls()), 3)
+
+    @defer.inlineCallbacks
+    def test_items_are_returned_once_written(self):
+        items = yield defer.gatherResults(self.add("https://example.com/1", "https://example.com/2", "https://example.com/3"))
+        self.assertEqual([item["url"] for item in items], self.stored_urls())
+
+    @defer.inlineCallbacks
+    def test_close_spider_flushes_partial_batch(self):
+        pending = self.add("https://example.com/1", "https://example.com/2")
+        yield self.pipeline.close_spider(None)
+        yield defer.gatherResults(pending)
+        self.assertEqual(self.stored_urls(), ["https://example.com/1", "https://example.com/2"])
+
+    @defer.inlineCallbacks
+    def test_failed_batch_is_reported_per_item(self):
+        pending = self.add("https://example.com/1", "https://example.com/2")
+        pending += self.add("https://example.com/bad", text=object())
+        for d in pending:
+            with self.assertRaises(sqlite3.Error):
+                yield d
+        self.assertEqual(self.stored_urls(), [])
+
+        yield defer.gatherResults(self.add("https://example.com/4", "https://example.com/5", "https://example.com/6"))
+        self.assertEqual(len(self.stored_urls()), 3)
+
+    @defer.inlineCallbacks
+    def test_batches_beyond_the_queue_wait_their_turn(self):
+        pending = self.add(*(f"https://example.com/{i}" for i in range(60)))
+        self.assertGreater(self.pipeline.pending(), 0)
+        yield defer.gatherResults(pending)
+        self.assertEqual(len(self.stored_urls()), 60)
+        self.assertEqual(self.pipeline.pending(), 0)
+
+    @defer.inlineCallbacks
+    def test_sharded_rows_go_to_their_domain_file(self):
+        sharded = SQLitePipeline(self.db_path, batch_size=2, flush_interval=60, shard_count=4)
+        yield sharded.open_spider(None)
+        urls = [f"https://{host}/terms" for host in ("a.example.com", "b.example.com", "example.org", "example.net")]
+        yield defer.gatherResults([
+            sharded.process_item({"title": "Terms", "url": url, "text": f"Policy {url}"}, None) for url in urls
+        ])
+        yield sharded.close_spider(None)
+
+        store = open_store(self.db_path, 4)
+        self.assertIs(store.shard(urls[0]), store.shard(urls[1]))
+        for url in urls:
+            self.assertEqual(store.get_text(url), f"Policy {url}")
+        self.assertEqual(len(store.search("policy")), 4)
+        store.close()
+
+    def test_uses_wal_journal(self):
+        connection = sqlite3.connect(self.db_path)
+        mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+        connection.close()
+        self.assertEqual(mode, "wal")
+
+    @defer.inlineCallbacks
+    def test_backlog_pauses_the_engine_until_every_holder_releases_it(self):
+        crawler = Crawler()
+        pipeline = SQLitePipeline(self.db_path, batch_size=1, flush_interval=60, queue_size=1, crawler=crawler)
+        yield pipeline.open_spider(None)
+        EnginePause.of(crawler).hold("enrichment")
+        pending = [
+            pipeline.process_item({"title": "Terms", "url": f"https://example.com/{i}", "text": "Text"}, None)
+            for i in range(30)
+        ]
+        self.assertTrue(crawler.engine.paused)
+        yield defer.gatherResults(pending)
+        self.assertEqual(crawler.stats.values["sqlite/backpressure_pauses"], 1)
+        self.assertTrue(crawler.engine.paused)
+        EnginePause.of(crawler).release("enrichment")
+        self.assertFalse(crawler.engine.paused)
+        yield pipeline.close_spider(None)
+
+
+class TestEnginePause(unittest.TestCase):
+
+    def test_engine_resumes_once_the_last_holder_releases_it(self):
+        crawler = Crawler()
+        pause = EnginePause.of(crawler)
+        self.assertIs(EnginePause.of(crawler), pause)
+        pause.hold("writer")
+        pause.hold("enrichment")
+        pause.hold("writer")
+        pause.release("writer")
+        self.assertTrue(crawler.engine.paused)
+        pause.release("writer")
+        self.assertTrue(crawler.engine.paused)
+        pause.release("enrichment")
+        self.assertFalse(crawler.engine.paused)
+
+    def test_pause_set_by_an_operator_is_kept(self):
+        crawler = Crawler()
+        crawler.engine.pause()
+        pause = EnginePause.of(crawler)
+        pause.hold("writer")
+        pause.release("writer")
+        self.assertTrue(crawler.engine.paused)
+
+        crawler.engine.unpause()
+        pause.hold("writer")
+        pause.release("writer")
+        self.assertFalse(crawler.engine.paused)
@@ -0,0 +1,146 @@
+"""
+tests/test_dupefilter.py
+Unit tests for the persistent Bloom filter dupefilter: generations, TTL
+rotation and persistence across crawl runs.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from scrapy.http import Request
+from scrapy.utils.request import RequestFingerprinter
+
+from tosppcrawler.dupefilter import BloomGeneration, PersistentDupeFilter
+
+TTL = 4 * 3600
+
+
+class TestBloomGeneration(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "0.bloom")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fingerprints_survive_reopening(self):
+        generation = BloomGeneration(self.path, 8 * 1024, 4)
+        generation.add(b"a" * 20)
+        self.assertIn(b"a" * 20, generation)
+        self.assertNotIn(b"b" * 20, generation)
+        generation.close()
+
+        reopened = BloomGeneration(self.path)
+        self.assertIn(b"a" * 20, reopened)
+        self.assertEqual((reopened.hash_count, reopened.bits_set), (4, 4))
+        reopened.close()
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * 64)
+        with self.assertRaises(ValueError):
+            BloomGeneration(self.path)
+
+
+class TestPersistentDupeFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.now = 1_000_000.0
+        self.clock = mock.patch("tosppcrawler.dupefilter.time.time", lambda: self.now)
+        self.clock.start()
+        self.filters = []
+
+    def tearDown(self):
+        for dupefilter in self.filters:
+            dupefilter.close("finished")
+        self.clock.stop()
+        self.tmp.cleanup()
+
+    def open_filter(self, **kwargs):
+        dupefilter = PersistentDupeFilter(
+            self.tmp.name, memory_mb=1, capacity=10_000, ttl=TTL, generations=4,
+            fingerprinter=RequestFingerprinter(), **kwargs,
+        )
+        dupefilter.open()
+        self.filters.append(dupefilter)
+        return dupefilter
+
+    def fetch(self, dupefilter, request):
+        if isinstance(request, str):
+            request = Request(request)
+        seen = dupefilter.request_seen(request)
+        if not seen:
+            dupefilter.response_downloaded(None, request, None)
+            dupefilter.request_left_downloader(request, None)
+        return seen
+
+    def generation_files(self):
+        return sorted(name for name in os.listdir(self.tmp.name) if name.endswith(".bloom"))
+
+    def test_duplicates_within_a_run(self):
+        dupefilter = self.open_filter()
+        request = Request("https://example.com/terms")
+        self.assertFalse(dupefilter.request_seen(request))
+        self.assertTrue(dupefilter.request_seen(request))
+
+    def test_fetched_urls_are_remembered_across_runs(self):
+        self.assertFalse(self.fetch(self.open_filter(), "https://example.com/terms"))
+        self.filters.pop().close("finished")
+        dupefilter = self.open_filter()
+        self.assertTrue(dupefilter.request_seen(Request("https://example.com/terms")))
+        self.assertFalse(dupefilter.request_seen(Request("https://example.com/privacy")))
+
+    def test_queued_but_unfetched_urls_are_not_persisted(self):
+        self.open_filter().request_seen(Request("https://example.com/terms"))
+        self.filters.pop().close("shutdown")
+        self.assertFalse(self.open_filter().request_seen(Request("https://example.com/terms")))
+
+    def test_generations_rotate_and_expire(self):
+        dupefilter = self.open_filter()
+        self.fetch(dupefilter, "https://example.com/old")
+        self.now += TTL / 4
+        self.fetch(dupefilter, "https://example.com/new")
+        self.assertEqual(len(self.generation_files()), 2)
+        self.filters.pop().close("finished")
+
+        # The first generation is older than the TTL by the next run
+        self.now += TTL * 3 / 4
+        dupefilter = self.open_filter()
+        self.assertEqual(len(self.generation_files()), 2)
+        self.assertFalse(dupefilter.request_seen(Request("https://example.com/old")))
+        self.assertTrue(dupefilter.request_seen(Request("https://example.com/new")))
+
+    def test_seeds_are_recrawled_after_their_own_ttl(self):
+        dupefilter = self.open_filter(seed_ttl=TTL / 4)
+        seed = Request("https://example.com/terms", meta={"dupefilter_seed": True})
+        self.assertFalse(self.fetch(dupefilter, seed))
+        self.assertTrue(dupefilter.request_seen(seed.replace()))
+        self.filters.pop().close("finished")
+
+        # A feed run again soon after is filtered...
+        self.now += TTL / 8
+        dupefilter = self.open_filter(seed_ttl=TTL / 4)
+        self.assertTrue(dupefilter.request_seen(seed.replace()))
+        self.filters.pop().close("finished")
+
+        # ...and fetched once the seed TTL has passed, while links to the
+        # same page still wait for the full TTL
+        self.now += TTL / 4
+        dupefilter = self.open_filter(seed_ttl=TTL / 4)
+        self.assertTrue(dupefilter.request_seen(Request("https://example.com/terms")))
+        self.assertFalse(self.fetch(dupefilter, seed.replace()))
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp.name, "seeds"))), 1)
+
+    def test_replay_leaves_no_files(self):
+        dupefilter = self.open_filter(persist=False)
+        self.assertFalse(self.fetch(dupefilter, "https://example.com/terms"))
+        self.assertTrue(dupefilter.request_seen(Request("https://example.com/terms")))
+        self.assertEqual(self.generation_files(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+"""
+tests/test_enrichment.py
+Unit tests for the batched, process-pool EnrichmentPipeline of
+tos_pp_crawler. The pool is replaced by one whose batches the tests finish
+by hand, except in the last test, which scores items in real worker
+processes.
+"""
+
+import os
+import sys
+from concurrent.futures import Future
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from tos_pp_crawler.enrichment import EnrichmentPipeline, enrich_texts
+from tos_pp_crawler.writer import EnginePause
+
+
+class Engine:
+    # The pause flag of Scrapy's ExecutionEngine
+    paused = False
+
+    def pause(self):
+        self.paused = True
+
+    def unpause(self):
+        self.paused = False
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, count=1, start=0):
+        self.values[key] = self.values.get(key, start) + count
+
+
+class Crawler:
+    def __init__(self):
+        self.engine = Engine()
+        self.stats = Stats()
+
+
+class Pool:
+    # Keeps every submitted batch until finish() scores it in process
+    def __init__(self):
+        self.batches = []
+        self.shut_down = False
+
+    def submit(self, function, *args):
+        future = Future()
+        self.batches.append((future, function, args))
+        return future
+
+    def finish(self):
+        future, function, args = self.batches.pop(0)
+        future.set_result(function(*args))
+        # The pipeline hears about it through reactor.callFromThread
+        return task.deferLater(reactor, 0, lambda: None)
+
+    def shutdown(self):
+        self.shut_down = True
+
+
+def item(text, language="en"):
+    return {"url": "https://example.com/terms", "text": text, "language": language}
+
+
+class TestEnrichmentPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.crawler = Crawler()
+        self.pipeline = EnrichmentPipeline(self.crawler, workers=1, batch_size=3, max_wait=60)
+        self.pool = self.pipeline.pool = Pool()
+
+    def tearDown(self):
+        if self.pipeline.flush_call is not None and self.pipeline.flush_call.active():
+            self.pipeline.flush_call.cancel()
+
+    def add(self, *texts):
+        return [self.pipeline.process_item(item(text), None) for text in texts]
+
+    @defer.inlineCallbacks
+    def test_items_are_scored_in_batches(self):
+        pending = self.add("We love privacy.", "Cookies are used.")
+        self.assertEqual(self.pool.batches, [])
+        pending += self.add("Data is sold.")
+        self.assertEqual(len(self.pool.batches), 1)
+        self.assertEqual(self.pool.batches[0][2][0], ["We love privacy.", "Cookies are used.", "Data is sold."])
+
+        yield self.pool.finish()
+        items = yield defer.gatherResults(pending)
+        self.assertEqual([result["word_count"] for result in items], [3, 3, 3])
+        self.assertGreater(items[0]["polarity"], 0)
+        self.assertEqual(self.crawler.stats.values["enrichment/items"], 3)
+
+    @defer.inlineCallbacks
+    def test_partial_batch_is_sent_after_max_wait(self):
+        self.pipeline.max_wait = 0.01
+        pending = self.add("Only item.")
+        self.assertEqual(self.pool.batches, [])
+        yield task.deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(len(self.pool.batches), 1)
+        yield self.pool.finish()
+        self.assertEqual((yield pending[0])["word_count"], 2)
+
+    @defer.inlineCallbacks
+    def test_items_not_in_english_get_no_sentiment(self):
+        pending = [self.pipeline.process_item(item("Wir lieben Datenschutz.", "de"), None)]
+        pending += self.add("We love privacy.", "Terms.")
+        yield self.pool.finish()
+        german, english, _ = yield defer.gatherResults(pending)
+        self.assertIsNone(german["polarity"])
+        self.assertIsNotNone(english["polarity"])
+
+    @defer.inlineCallbacks
+    def test_engine_is_paused_past_twice_the_workers(self):
+        self.pipeline.batch_size = 1
+        pending = self.add("One.", "Two.")
+        self.assertFalse(self.crawler.engine.paused)
+        pending += self.add("Three.")
+        self.assertTrue(self.crawler.engine.paused)
+        self.assertEqual(self.crawler.stats.values["enrichment/backpressure_pauses"], 1)
+
+        # Resumed once no more batches than workers are in flight
+        yield self.pool.finish()
+        self.assertTrue(self.crawler.engine.paused)
+        yield self.pool.finish()
+        self.assertFalse(self.crawler.engine.paused)
+        yield self.pool.finish()
+        yield defer.gatherResults(pending)
+
+    @defer.inlineCallbacks
+    def test_engine_stays_paused_while_a_writer_holds_it(self):
+        self.pipeline.batch_size = 1
+        pending = self.add("One.", "Two.", "Three.")
+        EnginePause.of(self.crawler).hold("writer")
+        for _ in pending:
+            yield self.pool.finish()
+        self.assertTrue(self.crawler.engine.paused)
+        EnginePause.of(self.crawler).release("writer")
+        self.assertFalse(self.crawler.engine.paused)
+
+    @defer.inlineCallbacks
+    def test_close_spider_waits_for_pending_batches(self):
+        pending = self.add("One.", "Two.", "Three.", "Four.")
+        closed = self.pipeline.close_spider(None)
+        self.assertEqual(len(self.pool.batches), 2)
+        self.assertFalse(closed.called)
+        yield self.pool.finish()
+        self.assertFalse(closed.called)
+        self.assertFalse(self.pool.shut_down)
+        yield self.pool.finish()
+        yield closed
+        self.assertTrue(self.pool.shut_down)
+        self.assertEqual(len((yield defer.gatherResults(pending))), 4)
+
+    def test_close_spider_without_pending_work_shuts_the_pool_down(self):
+        self.assertIsNone(self.pipeline.close_spider(None))
+        self.assertTrue(self.pool.shut_down)
+
+    @defer.inlineCallbacks
+    def test_scores_in_worker_processes(self):
+        pipeline = EnrichmentPipeline(self.crawler, workers=1, batch_size=2, max_wait=60)
+        pipeline.open_spider(None)
+        pending = [pipeline.process_item(item("We love privacy."), None),
+                   pipeline.process_item(item("Nous aimons la vie privée.", "fr"), None)]
+        yield pipeline.close_spider(None)
+        english, french = yield defer.gatherResults(pending)
+        self.assertEqual(english, {**item("We love privacy."), **enrich_texts(["We love privacy."])[0]})
+        self.assertEqual((french["word_count"], french["polarity"]), (5, None))
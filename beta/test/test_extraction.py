@@ -0,0 +1,135 @@
+"""
+tests/test_extraction.py
+Unit tests for the single-pass DOM text extractor and its boilerplate
+removal.
+"""
+
+import unittest
+
+from scrapy.http import HtmlResponse
+
+from tosppcrawler.extraction import (
+    extract_embedded_text, extract_main_text, extract_page_text, extract_text, iter_scored_blocks,
+)
+
+PAGE = b"""<html><head><title>Terms</title><style>p { color: red; }</style></head>
+<body>
+<div>Intro <b>bold</b> text<!-- note --> after<script>{"require":[["bootstrap"]]}</script> tail
+<p>First paragraph.</p><p>Second<br>line</p>
+<ul><li>one</li><li>two</li></ul>
+<noscript>Enable JavaScript</noscript><template><p>hidden</p></template>
+</div>
+<script type="application/json">{"policy": "data"}</script>
+</body></html>"""
+
+JS_SHELL = b"""<html><body><div id="root"></div>
+<script type="application/json">{"data":{"policy":{"title":"Privacy Policy",
+"className":"x1lliihq x1plvlek xryxfnj",
+"sections":[{"body":"We collect the information you provide when you use our Products.\\nThis includes what you enter when you sign up for an account.",
+"html":"\\u003Cp>We use this information to \\u003Cb>improve\\u003C/b> and personalize our Products.\\u003C/p>"},
+{"body":"We collect the information you provide when you use our Products."}]}}}</script>
+<script>window.cfg = {'notice': 'We don\\'t sell your personal information to anyone at all.', src: "https://cdn.example.com/app.js"};</script>
+</body></html>"""
+
+LEGAL_PAGE = b"""<html><head><title>Privacy Statement</title></head>
+<body class="has-cookie-banner">
+<div id="cookie-banner"><p>We use cookies to improve your experience on our site and to show you personalised
+advertising. By continuing to browse you agree to our use of cookies.</p><button>Accept all</button></div>
+<header><a href="/">Example</a><nav><ul><li><a href="/products">Products</a></li>
+<li><a href="/support">Support</a></li></ul></nav></header>
+<div class="breadcrumbs"><a href="/">Home</a> &gt; <a href="/legal">Legal</a> &gt; Privacy</div>
+<main><article>
+<header><h1>Privacy Statement</h1></header>
+<h2>Personal data we collect</h2>
+<p>We collect data from you, through our interactions with you and through our products. You provide some
+of this data directly, and we get some of it by collecting data about your use of our products.</p>
+<ul><li>Name and contact data.</li><li>Payment data.</li></ul>
+<p>We use the data we collect to provide you rich, interactive experiences and to keep our products secure.
+See <a href="/cookies">our cookie policy</a> for the details of how cookies are used.</p>
+<div class="share-links"><a href="#">Share on Twitter</a> <a href="#">Share by email</a></div>
+</article></main>
+<aside><h3>Related</h3><ul><li><a href="/terms">Terms of use</a></li></ul></aside>
+<footer><p>Copyright 2024 Example Corp. All rights reserved.</p><a href="/sitemap">Sitemap</a></footer>
+</body></html>"""
+
+
+class TestExtraction(unittest.TestCase):
+
+    def setUp(self):
+        self.response = HtmlResponse("https://example.com/terms", body=PAGE)
+
+    def test_skips_script_style_and_template(self):
+        text = extract_text(self.response)
+        for junk in ("require", "color", "Enable JavaScript", "hidden", "policy"):
+            self.assertNotIn(junk, text)
+
+    def test_keeps_text_around_skipped_nodes(self):
+        text = extract_text(self.response)
+        self.assertIn("Intro bold text after tail", text)
+
+    def test_block_elements_start_new_lines(self):
+        lines = extract_text(self.response).split("\n")
+        self.assertEqual(lines[1:], ["First paragraph.", "Second", "line", "one", "two"])
+
+    def test_max_chars_stops_early(self):
+        text = extract_text(self.response, max_chars=15)
+        self.assertLessEqual(len(text), 15)
+        self.assertTrue(text.startswith("Intro"))
+
+    def test_accepts_markup_strings(self):
+        self.assertEqual(extract_text("Hello <script>alert('hi')</script> World!!"), "Hello World!!")
+        self.assertEqual(extract_text("   "), "")
+
+    def test_embedded_text_keeps_prose_strings_only(self):
+        lines = extract_embedded_text(HtmlResponse("https://example.com/policy", body=JS_SHELL)).split("\n")
+        self.assertEqual(lines, [
+            "We collect the information you provide when you use our Products.",
+            "This includes what you enter when you sign up for an account.",
+            "We use this information to improve and personalize our Products.",
+            "We don't sell your personal information to anyone at all.",
+        ])
+
+    def test_page_text_falls_back_to_embedded_payloads(self):
+        shell = HtmlResponse("https://example.com/policy", body=JS_SHELL)
+        self.assertTrue(extract_page_text(shell).startswith("We collect the information"))
+        self.assertEqual(extract_page_text(self.response), extract_text(self.response))
+
+
+class TestBoilerplateRemoval(unittest.TestCase):
+
+    def setUp(self):
+        self.response = HtmlResponse("https://example.com/privacy", body=LEGAL_PAGE)
+
+    def test_keeps_main_content_with_its_headings(self):
+        self.assertEqual(extract_main_text(self.response).split("\n"), [
+            "Privacy Statement",
+            "Personal data we collect",
+            "We collect data from you, through our interactions with you and through our products. You provide "
+            "some of this data directly, and we get some of it by collecting data about your use of our products.",
+            "Name and contact data.",
+            "Payment data.",
+            "We use the data we collect to provide you rich, interactive experiences and to keep our products "
+            "secure. See our cookie policy for the details of how cookies are used.",
+        ])
+
+    def test_blocks_count_link_and_chrome_text(self):
+        blocks = {text: (link, chrome) for text, link, chrome in iter_scored_blocks(self.response)}
+        self.assertEqual(blocks["Home > Legal > Privacy"], (9, 22))
+        self.assertEqual(blocks["Privacy Statement"], (0, 0))
+        self.assertEqual(blocks["Products"], (8, 8))
+
+    def test_page_without_dense_blocks_keeps_everything_but_links(self):
+        page = "<div class='menu-wrapper'><h1>Terms</h1><p>Be nice.</p><a href='/'>Home</a></div>"
+        self.assertEqual(extract_main_text(page), "Terms\nBe nice.")
+
+    def test_page_text_with_main_content(self):
+        main = extract_page_text(self.response, main_content=True)
+        self.assertEqual(main, extract_main_text(self.response))
+        self.assertLess(len(main), len(extract_text(self.response)) * 0.7)
+        self.assertEqual(extract_page_text(self.response, max_chars=20, main_content=True), "Privacy Statement\nPe")
+        shell = HtmlResponse("https://example.com/policy", body=JS_SHELL)
+        self.assertEqual(extract_page_text(shell, main_content=True), extract_page_text(shell))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+tests/test_fingerprints.py
+Unit tests for skipping unchanged pages by content fingerprint. They run
+under Twisted's trial test case, which spins the reactor until the Deferreds
+returned by a test have fired.
+"""
+
+import os
+import tempfile
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from tosppcrawler.fingerprints import FingerprintStore, UnchangedContent, content_fingerprint
+from tosppcrawler.pipelines import ContentFingerprintPipeline
+from tosppcrawler.sharding import shard_index, shard_paths
+
+ITEM = {"title": "Terms", "url": "https://example.com/terms", "text": "We may  update\nthese terms."}
+
+
+class TestContentFingerprintPipeline(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spider = Spider("test")
+        self.crawler = get_crawler(Spider, {"FINGERPRINT_DB": os.path.join(self.tmp.name, "state.db")})
+        self.pipeline = ContentFingerprintPipeline.from_crawler(self.crawler)
+        yield self.pipeline.open_spider(self.spider)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.pipeline.close_spider(self.spider)
+        self.tmp.cleanup()
+
+    def next_run(self):
+        """
+        Close the pipeline, which writes what it buffered, and open it again.
+        """
+        return self.pipeline.close_spider(self.spider).addCallback(
+            lambda _: self.pipeline.open_spider(self.spider)
+        )
+
+    def test_whitespace_does_not_count_as_a_change(self):
+        self.assertEqual(content_fingerprint("We may update these terms."), content_fingerprint(ITEM["text"]))
+
+    @defer.inlineCallbacks
+    def test_stored_items_are_dropped_next_time(self):
+        item = self.pipeline.process_item(dict(ITEM), self.spider)
+        self.pipeline.item_scraped(item, None, self.spider)
+        yield self.next_run()
+        with self.assertRaises(UnchangedContent):
+            self.pipeline.process_item(dict(ITEM), self.spider)
+
+    @defer.inlineCallbacks
+    def test_fingerprints_are_written_in_batches(self):
+        for page in range(3):
+            item = self.pipeline.process_item(dict(ITEM, url=f"{ITEM['url']}/{page}"), self.spider)
+            self.pipeline.item_scraped(item, None, self.spider)
+        self.assertIsNone(self.pipeline.store.shard(ITEM["url"]).get(f"{ITEM['url']}/0"))
+        yield self.pipeline.writer.close()
+        self.assertEqual(self.crawler.stats.get_value("fingerprint/changed"), 3)
+        for page in range(3):
+            url = f"{ITEM['url']}/{page}"
+            self.assertEqual(self.pipeline.store.shard(url).get(url), content_fingerprint(ITEM["text"]))
+
+    @defer.inlineCallbacks
+    def test_sharded_fingerprints_stay_with_their_site(self):
+        yield self.pipeline.close_spider(self.spider)
+        db_path = os.path.join(self.tmp.name, "sharded.db")
+        self.crawler = get_crawler(Spider, {"FINGERPRINT_DB": db_path, "SQLITE_SHARDS": 4})
+        self.pipeline = ContentFingerprintPipeline.from_crawler(self.crawler)
+        yield self.pipeline.open_spider(self.spider)
+        urls = [f"https://{host}/terms" for host in ("a.example.com", "example.org", "example.net")]
+        for url in urls:
+            self.pipeline.item_scraped(self.pipeline.process_item(dict(ITEM, url=url), self.spider), None, self.spider)
+        yield self.next_run()
+        self.assertFalse(os.path.exists(db_path))
+        for url in urls:
+            store = FingerprintStore(shard_paths(db_path, 4)[shard_index(url, 4)])
+            self.assertEqual(store.get(url), content_fingerprint(ITEM["text"]))
+            store.close()
+            with self.assertRaises(UnchangedContent):
+                self.pipeline.process_item(dict(ITEM, url=url), self.spider)
+
+    @defer.inlineCallbacks
+    def test_failed_items_are_processed_again(self):
+        item = self.pipeline.process_item(dict(ITEM), self.spider)
+        self.pipeline.item_failed(item, None, self.spider, failure=None)
+        yield self.next_run()
+        self.assertEqual(self.pipeline.process_item(dict(ITEM), self.spider), ITEM)
+
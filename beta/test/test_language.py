@@ -0,0 +1,135 @@
+"""
+tests/test_language.py
+Unit tests for the character trigram language identifier and the
+pipeline that tags items with it.
+"""
+
+import json
+import os
+import unittest
+
+from scrapy import Spider
+from scrapy.exceptions import DropItem
+from scrapy.utils.test import get_crawler
+
+from tosppcrawler.language import UNDETERMINED, detect_language, english_or_unknown
+from tosppcrawler.pipelines import LanguagePipeline
+
+OUTPUT_JSON = os.path.join(os.path.dirname(__file__), "..", "output.json")
+
+SAMPLES = {
+    "en": "We collect information about you when you use our services, and we may share it with our partners "
+          "if the law requires us to do so. You can ask us to delete your personal data at any time.",
+    "de": "Wir erheben Daten über Sie, wenn Sie unsere Dienste nutzen, und geben sie nur an Dritte weiter, wenn "
+          "wir dazu gesetzlich verpflichtet sind. Sie können jederzeit die Löschung Ihrer Daten verlangen.",
+    "fr": "Nous collectons des informations vous concernant lorsque vous utilisez nos services et nous pouvons "
+          "les partager avec nos partenaires si la loi nous y oblige. Vous pouvez demander la suppression de vos données.",
+    "es": "Recopilamos información sobre usted cuando utiliza nuestros servicios y podemos compartirla con "
+          "nuestros socios si la ley nos obliga a hacerlo. Puede solicitar la eliminación de sus datos en cualquier momento.",
+    "it": "Raccogliamo informazioni su di te quando utilizzi i nostri servizi e possiamo condividerle con i "
+          "nostri partner se la legge ce lo impone. Puoi chiedere la cancellazione dei tuoi dati in qualsiasi momento.",
+    "pt": "Coletamos informações sobre você quando você usa nossos serviços e podemos compartilhá-las com "
+          "nossos parceiros se a lei exigir. Você pode solicitar a exclusão dos seus dados a qualquer momento.",
+    "nl": "Wij verzamelen gegevens over u wanneer u onze diensten gebruikt en kunnen deze delen met onze "
+          "partners als de wet ons daartoe verplicht. U kunt ons op elk moment vragen uw gegevens te verwijderen.",
+    "sv": "Vi samlar in uppgifter om dig när du använder våra tjänster och vi kan dela dem med våra partner "
+          "om lagen kräver det. Du kan när som helst be oss att radera dina personuppgifter.",
+    "pl": "Zbieramy informacje o Tobie, gdy korzystasz z naszych usług, i możemy je udostępniać naszym "
+          "partnerom, jeśli wymaga tego prawo. W każdej chwili możesz poprosić nas o usunięcie swoich danych.",
+    "tr": "Hizmetlerimizi kullandığınızda sizinle ilgili bilgileri topluyoruz ve yasa gerektirdiğinde bu "
+          "bilgileri iş ortaklarımızla paylaşabiliriz. Kişisel verilerinizin silinmesini her zaman talep edebilirsiniz.",
+    "ru": "Мы собираем информацию о вас, когда вы пользуетесь нашими услугами, и можем передавать её нашим "
+          "партнёрам, если этого требует закон. Вы можете в любое время попросить нас удалить ваши данные.",
+    "uk": "Ми збираємо інформацію про вас, коли ви користуєтеся нашими послугами, і можемо передавати її "
+          "нашим партнерам, якщо цього вимагає закон. Ви можете будь-коли попросити нас видалити ваші дані.",
+    "id": "Kami mengumpulkan informasi tentang Anda ketika Anda menggunakan layanan kami dan kami dapat "
+          "membagikannya dengan mitra kami jika diwajibkan oleh hukum. Anda dapat meminta kami menghapus data pribadi Anda.",
+    "da": "Vi indsamler oplysninger om dig, når du bruger vores tjenester, og vi kan dele dem med vores "
+          "samarbejdspartnere, hvis loven kræver det. Du kan til enhver tid bede os om at slette dine personoplysninger.",
+    "no": "Vi samler inn opplysninger om deg når du bruker tjenestene våre, og vi kan dele dem med våre "
+          "samarbeidspartnere dersom loven krever det. Du kan når som helst be oss om å slette personopplysningene dine.",
+    "fi": "Keräämme tietoja sinusta, kun käytät palvelujamme, ja voimme jakaa niitä kumppaneidemme kanssa, jos laki "
+          "sitä edellyttää.",
+    "cs": "Shromažďujeme informace o vás, když používáte naše služby, a můžeme je sdílet s našimi partnery.",
+    "hu": "Információkat gyűjtünk Önről, amikor használja szolgáltatásainkat, és megoszthatjuk azokat partnereinkkel.",
+    "ro": "Colectăm informații despre dumneavoastră atunci când utilizați serviciile noastre.",
+    "ja": "当社は、お客様が当社のサービスを利用する際に、お客様に関する情報を収集します。",
+    "zh": "我们在您使用我们的服务时收集有关您的信息，并可能在法律要求时与合作伙伴共享。",
+    "el": "Συλλέγουμε πληροφορίες για εσάς όταν χρησιμοποιείτε τις υπηρεσίες μας.",
+}
+
+
+class TestDetectLanguage(unittest.TestCase):
+
+    def test_policy_sentences(self):
+        for language, text in SAMPLES.items():
+            self.assertEqual(detect_language(text), language, text)
+
+    def test_plain_sentences_in_close_languages(self):
+        sentences = [
+            ("it", "Il titolare del trattamento è la società indicata sopra, che tratta i dati personali degli "
+                   "utenti nel rispetto della normativa vigente."),
+            ("it", "Utilizziamo i cookie per migliorare la tua esperienza sul sito e per mostrarti pubblicità "
+                   "personalizzata."),
+            ("es", "Utilizamos cookies para mejorar su experiencia en nuestro sitio web."),
+            ("pt", "Utilizamos cookies para melhorar a sua experiência no nosso site."),
+            ("da", "Vi bruger cookies til at forbedre din oplevelse på vores hjemmeside."),
+            ("no", "Vi bruker informasjonskapsler for å forbedre opplevelsen din på nettstedet vårt."),
+            ("sv", "Vi samlar in uppgifter om dig när du använder våra tjänster."),
+        ]
+        for language, text in sentences:
+            self.assertEqual(detect_language(text), language, text)
+
+    def test_short_texts(self):
+        for language, text in (("en", "We may share your data with partners."),
+                               ("de", "Wir teilen Ihre Daten nicht mit Dritten."),
+                               ("it", "Usiamo i cookie per migliorare il sito."),
+                               ("pl", "Używamy plików cookie, aby ulepszyć działanie naszej strony.")):
+            self.assertEqual(detect_language(text), language, text)
+        for text in ("Cookies", "Datenschutz", "Termini e condizioni"):
+            self.assertEqual(detect_language(text), UNDETERMINED, text)
+
+    def test_crawled_english_pages(self):
+        with open(OUTPUT_JSON, "r", encoding="utf-8") as f:
+            pages = json.load(f)
+        for page in pages:
+            self.assertTrue(english_or_unknown(detect_language(page["text"])), page["url"])
+
+    def test_long_text_is_sampled_from_the_middle(self):
+        text = "Menu Home Über uns " * 5 + SAMPLES["en"] * 20 + " Impressum Datenschutz" * 5
+        self.assertEqual(detect_language(text), "en")
+
+    def test_too_little_or_no_prose_is_undetermined(self):
+        code = "function(a,b){return a.map(x=>x*2)}" * 20
+        for text in ("", "Privacy Policy", "1234 " * 100, "x" * 5000, code):
+            self.assertEqual(detect_language(text), UNDETERMINED, text)
+
+
+class TestLanguagePipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.spider = Spider("test")
+
+    def pipeline(self, **settings):
+        return LanguagePipeline.from_crawler(get_crawler(Spider, settings))
+
+    def test_tags_items(self):
+        pipeline = self.pipeline()
+        item = pipeline.process_item({"url": "https://example.de/", "text": SAMPLES["de"]}, self.spider)
+        self.assertEqual(item["language"], "de")
+        item = pipeline.process_item({"url": "https://example.com/", "text": "x", "full_text": SAMPLES["fr"]},
+                                     self.spider)
+        self.assertEqual(item["language"], "fr")
+        self.assertEqual(pipeline.stats.get_value("language/de"), 1)
+
+    def test_filter_drops_other_languages_only(self):
+        pipeline = self.pipeline(LANGUAGE_FILTER=["en"])
+        with self.assertRaises(DropItem):
+            pipeline.process_item({"url": "https://example.es/", "text": SAMPLES["es"]}, self.spider)
+        for text in (SAMPLES["en"], "Terms"):
+            self.assertIn("language", pipeline.process_item({"url": "https://example.com/", "text": text},
+                                                            self.spider))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+tests/test_parallel_batch.py
+Unit tests for the process-pool batch engine, the batch cleaners and
+operations built on it and fused text operation chains.
+"""
+
+import json
+import os
+import unittest
+from functools import partial
+
+from batch_text_cleaner import HTML_TAG, basic_text_cleaner, clean_batch_texts
+from batch_text_operations import (
+    TextOperationChain, bulk_replace_keyword, convert_text_to_lowercase, count_keyword_occurrences_batch,
+    normalize_whitespace, strip_special_characters,
+)
+from parallel_batch import chunk_texts, map_texts, new_executor
+
+OUTPUT_JSON = os.path.join(os.path.dirname(__file__), "..", "output.json")
+
+
+def _tag(prefix, text):
+    return f"{prefix}:{len(text)}"
+
+
+class TestParallelBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(OUTPUT_JSON, "r", encoding="utf-8") as f:
+            cls.records = json.load(f) * 3
+
+    def test_chunks_are_sized_by_text(self):
+        texts = ["a" * 10, "b" * 10, "c" * 50, "d" * 5, "e" * 5]
+        self.assertEqual(chunk_texts(texts, 20), [texts[:2], [texts[2]], texts[3:]])
+        self.assertEqual(sum(chunk_texts(texts, 1), []), texts)
+
+    def test_results_keep_record_order(self):
+        texts = [record["text"] for record in self.records]
+        expected = [f"n:{len(text)}" for text in texts]
+        self.assertEqual(map_texts(partial(_tag, "n"), texts, workers=2, chunk_chars=1), expected)
+
+    def test_shared_executor(self):
+        texts = [record["text"] for record in self.records]
+        with new_executor(2) as executor:
+            self.assertEqual(map_texts(str.upper, texts, workers=2, executor=executor), [t.upper() for t in texts])
+            self.assertEqual(map_texts(len, texts, workers=2, executor=executor), [len(t) for t in texts])
+
+    def test_parallel_cleaning_matches_serial(self):
+        serial = clean_batch_texts(self.records, workers=1)
+        self.assertEqual(clean_batch_texts(self.records, workers=2), serial)
+        self.assertEqual([record["url"] for record in serial], [record["url"] for record in self.records])
+        self.assertIsNot(serial[0], self.records[0])
+
+    def test_only_markup_is_parsed_as_html(self):
+        self.assertEqual(basic_text_cleaner("Price < 5 and > 3, a<b"), "Price 5 and 3, ab")
+        self.assertEqual(basic_text_cleaner("<p>Hello <script>x()</script>world!</p>"), "Hello world!")
+
+    def test_comparisons_in_plain_text_are_not_tags(self):
+        for text in ("if x < b and c > d", "See < section 3 > of the Terms &amp; Conditions", "1 <2> 3"):
+            self.assertIsNone(HTML_TAG.search(text))
+        self.assertEqual(basic_text_cleaner("See < section 3 > of the Terms &amp; Conditions"),
+                         "See section 3 of the Terms amp Conditions")
+        for tag in ("<p>", "</div >", '<a href="/terms">', "<br/>", "<img src=x />", "<my-widget>"):
+            self.assertIsNotNone(HTML_TAG.search(f"Terms {tag} apply"))
+
+    def test_operations_with_workers(self):
+        stripped = strip_special_characters(self.records, workers=2)
+        self.assertEqual(stripped, strip_special_characters(self.records))
+        replaced = bulk_replace_keyword(stripped, "privacy", "PRIVACY", workers=2)
+        self.assertEqual(count_keyword_occurrences_batch(replaced, "privacy", workers=2),
+                         count_keyword_occurrences_batch(replaced, "privacy"))
+
+
+class TestTextOperationChain(unittest.TestCase):
+
+    def setUp(self):
+        with open(OUTPUT_JSON, "r", encoding="utf-8") as f:
+            self.records = json.load(f)
+        self.chain = (TextOperationChain().strip_special_characters().normalize_whitespace()
+                      .replace_keyword("privacy", "PRIVACY").lowercase())
+
+    def step_by_step(self):
+        records = normalize_whitespace(strip_special_characters(self.records))
+        return convert_text_to_lowercase(bulk_replace_keyword(records, "privacy", "PRIVACY"))
+
+    def test_fused_chain_matches_separate_passes(self):
+        self.assertEqual(list(self.chain.apply(self.records)), self.step_by_step())
+        self.assertEqual(list(self.chain.apply(self.records, workers=2)), self.step_by_step())
+
+    def test_records_are_pulled_one_at_a_time(self):
+        pulled = []
+
+        def source():
+            for record in self.records:
+                pulled.append(record["url"])
+                yield record
+
+        results = self.chain.apply(source())
+        self.assertEqual(pulled, [])
+        next(results)
+        self.assertEqual(len(pulled), 1)
+
+    def test_count_keyword_ends_a_chain(self):
+        expected = count_keyword_occurrences_batch(self.step_by_step(), "Privacy")
+        self.assertGreater(expected, 0)
+        self.assertEqual(self.chain.count_keyword(iter(self.records), "Privacy"), expected)
+        self.assertEqual(self.chain.count_keyword(self.records, "Privacy", workers=2), expected)
+
+    def test_adding_a_step_leaves_the_chain_unchanged(self):
+        upper = self.chain.uppercase()
+        self.assertEqual(len(upper.steps), len(self.chain.steps) + 1)
+        self.assertEqual(self.chain("A b"), "a b")
+
+
+if __name__ == "__main__":
+    unittest.main()
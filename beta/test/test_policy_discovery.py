@@ -0,0 +1,109 @@
+"""
+tests/test_policy_discovery.py
+Unit tests for how the discovery spider scores homepage links and picks
+the policy pages to follow for a domain.
+"""
+
+import unittest
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from tosppcrawler.spiders.policy_discovery import PolicyDiscoverySpider
+
+HOMEPAGE = b"""
+<html><body>
+  <nav>
+    <a href="/products">Products</a>
+    <a href="/blog/cookies">Cookies</a>
+    <a href="#top">Privacy</a>
+    <a href="mailto:privacy@example.com">Privacy team</a>
+  </nav>
+  <main><p>Welcome.</p><a href="/read-more">Read more</a></main>
+  <footer>
+    <a href="/about">About</a>
+    <a href="/legal/privacy-policy">Privacy Policy</a>
+    <a href="/legal/privacy-policy#cookies">Privacy</a>
+    <a href="/tos">Terms of Service</a>
+    <a href="/help">Help</a>
+  </footer>
+</body></html>
+"""
+
+
+def homepage(body=HOMEPAGE, domain="example.com"):
+    request = Request(f"https://{domain}/")
+    return HtmlResponse(request.url, body=body, request=request)
+
+
+def single_link(anchor, footer=False):
+    anchor = f"<footer>{anchor}</footer>" if footer else anchor
+    return homepage(f"<html><body>{anchor}</body></html>".encode())
+
+
+class TestPolicyDiscoverySpider(unittest.TestCase):
+
+    def spider(self, **kwargs):
+        self.crawler = get_crawler(PolicyDiscoverySpider)
+        return PolicyDiscoverySpider.from_crawler(self.crawler, **kwargs)
+
+    def test_anchor_text_is_scored(self):
+        spider = self.spider()
+        self.assertEqual(spider.score_links(single_link('<a href="/x">Privacy</a>')), [(5, "https://example.com/x")])
+        self.assertEqual(spider.score_links(single_link('<a href="/x">Terms &amp; Conditions</a>')),
+                         [(5, "https://example.com/x")])
+        self.assertEqual(spider.score_links(single_link('<a href="/x" aria-label="Legal notice">&#167;</a>')), [])
+        self.assertEqual(spider.score_links(single_link('<a href="/x" title="Legal privacy">&#167;</a>')),
+                         [(8, "https://example.com/x")])
+
+    def test_url_keywords_are_scored(self):
+        spider = self.spider()
+        self.assertEqual(spider.score_links(single_link('<a href="/privacy-policy">Read more</a>')),
+                         [(6, "https://example.com/privacy-policy")])
+        self.assertEqual(spider.score_links(single_link('<a href="/legal">Read more</a>')), [])
+
+    def test_footer_links_score_higher(self):
+        spider = self.spider()
+        link = '<a href="/x">Privacy</a>'
+        self.assertEqual(spider.score_links(single_link(link, footer=True)), [(8, "https://example.com/x")])
+        self.assertEqual(spider.score_links(single_link('<div class="site-footer">' + link + '</div>')),
+                         [(8, "https://example.com/x")])
+
+    def test_links_are_ranked_once_per_url(self):
+        self.assertEqual(self.spider().score_links(homepage()), [
+            (19, "https://example.com/legal/privacy-policy"),
+            (13, "https://example.com/tos"),
+        ])
+
+    def test_threshold_comes_from_spider_arguments(self):
+        spider = self.spider(min_link_score="1")
+        urls = [url for _, url in spider.score_links(homepage())]
+        self.assertEqual(urls, ["https://example.com/legal/privacy-policy", "https://example.com/tos",
+                                "https://example.com/blog/cookies"])
+        spider = self.spider(min_link_score="14")
+        self.assertEqual(spider.score_links(homepage()), [(19, "https://example.com/legal/privacy-policy")])
+
+    def test_pages_per_domain_are_capped(self):
+        spider = self.spider(min_link_score="1", max_policy_pages="2")
+        requests = list(spider.parse_homepage(homepage(), "example.com"))
+        self.assertEqual([request.url for request in requests],
+                         ["https://example.com/legal/privacy-policy", "https://example.com/tos"])
+        self.assertTrue(all(request.callback == spider.parse for request in requests))
+        self.assertEqual(self.crawler.stats.get_value("policy_discovery/candidates_followed"), 2)
+
+    def test_domains_without_candidates_are_counted(self):
+        spider = self.spider()
+        response = homepage(b'<html><body><a href="/shop">Shop</a></body></html>', "shop.example")
+        self.assertEqual(list(spider.parse_homepage(response, "shop.example")), [])
+        self.assertEqual(self.crawler.stats.get_value("policy_discovery/domains"), 1)
+        self.assertEqual(self.crawler.stats.get_value("policy_discovery/domains_without_candidates"), 1)
+
+    def test_start_requests_go_to_the_homepages(self):
+        spider = self.spider(domains="DuckDuckGo.com, mozilla.org,")
+        requests = list(spider.start_requests())
+        self.assertEqual([request.url for request in requests], ["https://duckduckgo.com/", "https://mozilla.org/"])
+        self.assertEqual(requests[0].cb_kwargs, {"domain": "duckduckgo.com"})
+
+
+if __name__ == "__main__":
+    unittest.main()
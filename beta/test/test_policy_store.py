@@ -0,0 +1,177 @@
+"""
+tests/test_policy_store.py
+Unit tests for the compressed, versioned and searchable policies table of
+tos_pp_crawler.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from tos_pp_crawler.storage import PolicyStore, compress_text, decompress_text, train_dictionary
+
+CLAUSES = [
+    "We may share your information with our service providers and partners.",
+    "These Terms are governed by the laws of the State of California.",
+    "You can request a copy of the personal data we hold about you.",
+    "We use cookies and similar technologies to remember your preferences.",
+]
+
+
+def policy(company, paragraphs=20):
+    # A long policy made of clauses shared across companies, so a trained
+    # dictionary has something to find, and of lines unique to company
+    lines = [f"{company} privacy policy."]
+    for i in range(paragraphs):
+        lines.append(f"{company} keeps record {i} of {company.lower()} accounts in region {i * 7}.")
+        lines.extend(CLAUSES)
+    return "\n".join(lines)
+
+
+def item(url, text):
+    return {
+        "url": url,
+        "text": text[:500],
+        "full_text": text,
+        "word_count": len(text.split()),
+        "char_count": len(text),
+        "language": "en",
+    }
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_round_trip_with_and_without_dictionary(self):
+        text = policy("Acme") + " Données personnelles."
+        dictionary = train_dictionary([policy("Globex"), policy("Initech")])
+        self.assertTrue(dictionary)
+        self.assertEqual(decompress_text(compress_text(text)), text)
+        self.assertEqual(decompress_text(compress_text(text, dictionary), dictionary), text)
+        short = policy("Acme", paragraphs=1)
+        self.assertLess(len(compress_text(short, dictionary)), len(compress_text(short)))
+
+    def test_dictionary_keeps_sentences_recurring_across_documents(self):
+        dictionary = train_dictionary([policy("Globex"), policy("Initech")], size=200)
+        self.assertLessEqual(len(dictionary), 200)
+        self.assertIn(CLAUSES[0].encode("utf-8"), dictionary)
+        self.assertNotIn(b"Globex", dictionary)
+
+    def test_small_samples_give_no_dictionary(self):
+        self.assertEqual(train_dictionary([]), b"")
+        self.assertEqual(train_dictionary([policy("Acme")]), b"")
+
+
+class TestPolicyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "test.db")
+        self.store = PolicyStore(self.db_path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_full_text_is_stored_compressed(self):
+        text = policy("Acme")
+        self.store.save(item("https://acme.com/privacy", text))
+        self.assertEqual(self.store.get_full_text("https://acme.com/privacy"), text)
+        self.assertIsNone(self.store.get_full_text("https://acme.com/terms"))
+        compressed, original = self.store.storage_stats()
+        self.assertEqual(original, len(text.encode("utf-8")))
+        self.assertLess(compressed, original // 4)
+        excerpt, language = self.store.connection.execute("SELECT text, language FROM policies").fetchone()
+        self.assertEqual((excerpt, language), (text[:500], "en"))
+
+    def test_train_dictionary_recompresses_rows(self):
+        texts = {f"https://{name.lower()}.com/privacy": policy(name) for name in ("Acme", "Globex", "Initech")}
+        self.store.save_many([item(url, text) for url, text in texts.items()])
+        before = self.store.storage_stats()
+        first = self.store.train_dictionary()
+        self.assertIsNotNone(first)
+        after = self.store.storage_stats()
+        self.assertEqual(after[1], before[1])
+        self.assertLess(after[0], before[0])
+        self.assertEqual(dict(self.store.iter_full_texts()), texts)
+
+        # Rows compressed with an older dictionary stay readable after
+        # retraining, and after reopening
+        self.store.save(item("https://umbrella.com/privacy", policy("Umbrella")))
+        second = self.store.train_dictionary(recompress=False)
+        self.assertNotEqual(first, second)
+        self.store.close()
+        self.store = PolicyStore(self.db_path)
+        rows = dict(self.store.connection.execute("SELECT url, dictionary_id FROM policies"))
+        self.assertEqual(rows["https://umbrella.com/privacy"], first)
+        self.assertEqual(self.store.get_full_text("https://umbrella.com/privacy"), policy("Umbrella"))
+        self.store.save(item("https://hooli.com/privacy", policy("Hooli")))
+        self.assertEqual(self.store.get_full_text("https://hooli.com/privacy"), policy("Hooli"))
+
+    def test_train_dictionary_needs_recurring_sentences(self):
+        self.assertIsNone(self.store.train_dictionary())
+        self.store.save(item("https://acme.com/privacy", policy("Acme")))
+        self.assertIsNone(self.store.train_dictionary())
+        self.assertEqual(
+            self.store.connection.execute("SELECT COUNT(*) FROM compression_dictionaries").fetchone()[0], 0
+        )
+
+    def test_search_covers_the_whole_text(self):
+        self.store.save_many([
+            item("https://acme.com/privacy", policy("Acme") + "\nDisputes go to binding arbitration."),
+            item("https://globex.com/privacy", policy("Globex")),
+        ])
+        results = self.store.search("arbitration")
+        self.assertEqual([url for url, _, _ in results], ["https://acme.com/privacy"])
+        self.assertIn("[arbitration]", results[0][1])
+        self.assertEqual(len(self.store.search("cookies")), 2)
+
+        # A recrawl replaces the indexed text
+        self.store.save(item("https://acme.com/privacy", policy("Acme")))
+        self.assertEqual(self.store.search("arbitration"), [])
+        self.store.connection.execute("INSERT INTO policies_fts (policies_fts) VALUES ('integrity-check')")
+
+    def test_recrawls_keep_old_versions(self):
+        url = "https://acme.com/privacy"
+        texts = [policy("Acme").replace("region 0.", f"region 0 (v{v}).") for v in range(4)]
+        for text in texts:
+            self.store.save(item(url, text))
+        self.store.save(item(url, texts[-1]))
+
+        self.assertEqual(self.store.connection.execute("SELECT COUNT(*) FROM policies").fetchone()[0], 1)
+        self.assertEqual([version for version, _ in self.store.versions(url)], [1, 2, 3])
+        for version, text in enumerate(texts, start=1):
+            self.assertEqual(self.store.get_version(url, version), text)
+        self.assertIsNone(self.store.get_version(url, 9))
+        self.assertIsNone(self.store.get_version("https://globex.com/privacy", 1))
+
+    def test_legacy_database_is_migrated(self):
+        path = os.path.join(self.tmp.name, "legacy.db")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE policies(url TEXT PRIMARY KEY, text TEXT, word_count INTEGER, "
+                           "char_count INTEGER, polarity REAL, subjectivity REAL)")
+        connection.execute("INSERT INTO policies VALUES ('https://acme.com/terms', 'Binding arbitration applies.', "
+                           "3, 28, 0.0, 0.0)")
+        connection.commit()
+        connection.close()
+
+        store = PolicyStore(path)
+        columns = [row[1] for row in store.connection.execute("PRAGMA table_info(policies)")]
+        for column in ("full_text", "dictionary_id", "crawled_at", "language"):
+            self.assertIn(column, columns)
+        self.assertIsNone(store.get_full_text("https://acme.com/terms"))
+        self.assertEqual(list(store.iter_full_texts()), [])
+        # Rows without a full text are indexed with their excerpt
+        self.assertEqual(store.search("arbitration")[0][0], "https://acme.com/terms")
+
+        store.save(item("https://acme.com/terms", policy("Acme")))
+        self.assertEqual(store.get_full_text("https://acme.com/terms"), policy("Acme"))
+        self.assertEqual(store.search("arbitration"), [])
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+tests/test_search_index.py
+Unit tests for the FTS5 index the SQLite pipeline keeps over tos_data.
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from tosppcrawler.db_pipeline import TosDataStore
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "test.db")
+        self.store = TosDataStore(self.db_path)
+        self.store.save_many([
+            ("Privacy Policy", "https://example.com/privacy", "We use cookies to remember your settings."),
+            ("Terms of Service", "https://example.com/terms", "You may not resell the service. Cookies are optional."),
+            ("About", "https://example.com/about", "A small company."),
+        ])
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_ranked_matches_with_snippets(self):
+        results = self.store.search("cookies")
+        self.assertEqual({url for url, _, _, _ in results}, {"https://example.com/privacy", "https://example.com/terms"})
+        self.assertIn("[cookies]", results[0][2].lower())
+        self.assertEqual(self.store.search("privacy")[0][0], "https://example.com/privacy")
+
+    def test_updates_replace_indexed_text(self):
+        self.store.save_many([("About", "https://example.com/about", "Now with telemetry.")])
+        self.assertEqual(self.store.search("company"), [])
+        self.assertEqual(self.store.search("telemetry")[0][0], "https://example.com/about")
+        self.store.connection.execute("INSERT INTO tos_data_fts (tos_data_fts) VALUES ('integrity-check')")
+
+    def test_existing_rows_are_indexed_on_first_open(self):
+        path = os.path.join(self.tmp.name, "legacy.db")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE tos_data (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, url TEXT, text TEXT)")
+        connection.execute("INSERT INTO tos_data (title, url, text) VALUES ('Terms', 'https://example.org/', 'Arbitration clause.')")
+        connection.commit()
+        connection.close()
+
+        store = TosDataStore(path)
+        self.assertEqual(store.search("arbitration")[0][0], "https://example.org/")
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
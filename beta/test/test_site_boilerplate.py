@@ -0,0 +1,194 @@
+"""
+tests/test_site_boilerplate.py
+Unit tests for cross-page boilerplate line detection per site.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from tosppcrawler.site_boilerplate import SiteBoilerplate, line_hash
+
+TOPICS = ["Cookies", "Advertising", "Children", "Security", "Retention", "Transfers", "Rights", "Contact"]
+HEADER = "Microsoft Privacy\nSkip to main content\nSign in"
+FOOTER = "Contact us | Terms of use | (c) Microsoft 2024"
+COOKIE_NOTICE = ("We use optional cookies to improve your experience on our websites and to display "
+                 "personalized advertising. If you reject optional cookies, only necessary ones are used.")
+POLICY = [
+    f"{topic}: Microsoft collects data from you, through our interactions with you and through our "
+    f"products, to handle {topic.lower()}, and keeps it only as long as that purpose needs it."
+    for topic in TOPICS + ["Billing", "Support", "Updates", "Research"]
+]
+
+
+def body(topic):
+    """
+    Two paragraphs about topic, long enough to outweigh the page chrome.
+    """
+    return (f"{topic}: this section explains what we collect about {topic.lower()} and why we need it.\n"
+            f"You can ask us about {topic.lower()} at any time and we answer within a month.")
+
+
+def name(number):
+    # Line hashes ignore digits, so distinct pages need distinct letters
+    return "".join(chr(ord("a") + int(digit)) for digit in str(number))
+
+
+def page(text, year=2024):
+    return f"{HEADER}\n{text}\n{FOOTER.replace('2024', str(year))}"
+
+
+def locale_variant(locale):
+    """
+    The privacy statement as served for one locale: the same body under a
+    title naming the locale.
+    """
+    return page("\n".join([f"Microsoft Privacy Statement ({locale})"] + POLICY))
+
+
+class TestSiteBoilerplate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.site_lines = SiteBoilerplate(os.path.join(self.tmp.name, "state.db"))
+
+    def tearDown(self):
+        self.site_lines.close()
+        self.tmp.cleanup()
+
+    def test_lines_are_normalized(self):
+        self.assertEqual(line_hash("  (C)  Microsoft 2023 "), line_hash("(c) microsoft 2024"))
+        self.assertIsNone(line_hash("   "))
+
+    def test_new_pages_are_stripped_once_lines_recur(self):
+        first = self.site_lines.ingest("https://privacy.microsoft.com/en-us", page(body("Data")))
+        self.assertEqual(first, page(body("Data")))
+        self.site_lines.ingest("https://www.microsoft.com/legal/terms", page(body("Terms"), 2023))
+        third = self.site_lines.ingest("https://privacy.microsoft.com/en-gb", page(body("Cookies")))
+        self.assertEqual(third, body("Cookies"))
+
+    def test_other_sites_keep_their_lines(self):
+        for topic in TOPICS[:3]:
+            self.site_lines.ingest(f"https://microsoft.com/{topic}", page(body(topic)))
+        self.assertEqual(self.site_lines.strip("https://example.com/privacy", page(body("x"))), page(body("x")))
+
+    def test_lines_need_a_share_of_the_site(self):
+        for name in ("One", "Two", "Three"):
+            self.site_lines.ingest(f"https://example.com/{name}", f"Shared\n{body(name)}")
+        self.assertEqual(self.site_lines.strip("https://example.com/One", f"Shared\n{body('One')}"), body("One"))
+        for topic in TOPICS[:4]:
+            self.site_lines.ingest(f"https://example.com/{topic}", body(topic))
+        self.assertEqual(self.site_lines.strip("https://example.com/One", f"Shared\n{body('One')}"),
+                         f"Shared\n{body('One')}")
+
+    def test_recrawled_and_duplicate_urls_count_once(self):
+        for _ in range(3):
+            self.site_lines.ingest("https://example.com/privacy", page(body("Policy")))
+        self.site_lines.ingest("https://example.com/privacy?lang=en", page(body("Policy")))
+        self.site_lines.ingest("http://example.com/privacy", page(body("Policy")))
+        self.assertEqual(self.site_lines.boilerplate("example.com"), frozenset())
+        self.site_lines.ingest("https://example.com/terms", page(body("Terms")))
+        self.site_lines.ingest("https://example.com/cookies", page(body("Cookies")))
+        self.assertIn(line_hash(HEADER.split("\n")[0]), self.site_lines.boilerplate("example.com"))
+
+        # A changed page gives back the counts of its old version
+        self.site_lines.ingest("https://example.com/terms", body("Terms"))
+        self.site_lines.ingest("https://example.com/cookies", body("Cookies"))
+        self.assertEqual(self.site_lines.boilerplate("example.com"), frozenset())
+
+    def test_locale_variants_are_not_counted(self):
+        for locale in ("en-us", "en-gb", "en-ca"):
+            url = f"https://privacy.microsoft.com/{locale}/privacystatement"
+            self.assertEqual(self.site_lines.ingest(url, locale_variant(locale)), locale_variant(locale))
+        self.assertEqual(self.site_lines.boilerplate("microsoft.com"), frozenset())
+
+        # Once other pages make the chrome boilerplate, every variant keeps
+        # its whole body
+        for topic in TOPICS[:2]:
+            self.site_lines.ingest(f"https://www.microsoft.com/{topic}", page(body(topic)))
+        self.assertEqual(self.site_lines.ingest("https://privacy.microsoft.com/en-ie", locale_variant("en-ie")),
+                         "\n".join(["Microsoft Privacy Statement (en-ie)"] + POLICY))
+        self.assertNotIn(line_hash(POLICY[0]), self.site_lines.boilerplate("microsoft.com"))
+
+    def test_long_lines_are_only_stripped_at_the_edges(self):
+        pages = [f"{COOKIE_NOTICE}\n{body(topic)}\n{COOKIE_NOTICE}\n{body(topic + 's')}" for topic in TOPICS[:3]]
+        for topic, text in zip(TOPICS, pages):
+            self.site_lines.ingest(f"https://example.com/{topic}", text)
+        self.assertEqual(self.site_lines.strip("https://example.com/Cookies", pages[0]),
+                         f"{body('Cookies')}\n{COOKIE_NOTICE}\n{body('Cookiess')}")
+
+    def test_pages_are_never_stripped_to_a_fraction(self):
+        for topic in TOPICS[:3]:
+            self.site_lines.ingest(f"https://example.com/{topic}", page(body(topic)))
+        self.assertEqual(self.site_lines.strip("https://example.com/stub", page("Stub.")), page("Stub."))
+
+    def test_bulk_pass_strips_pages_seen_before(self):
+        pages = [(f"https://amazon.com/help/{topic}", page(body(topic))) for topic in TOPICS[:4]]
+        self.assertEqual(list(self.site_lines.strip_many(pages)),
+                         [(url, body(topic)) for (url, _), topic in zip(pages, TOPICS)])
+        self.assertEqual(self.site_lines.stats(), (1, 4, 4))
+
+    def test_batches_are_counted_in_one_transaction(self):
+        pages = [(f"https://example.com/{topic}", page(body(topic))) for topic in TOPICS[:3]]
+        self.assertEqual(self.site_lines.ingest_many(pages),
+                         [page(body(TOPICS[0])), page(body(TOPICS[1])), body(TOPICS[2])])
+        with self.assertRaises(AttributeError):
+            self.site_lines.ingest_many([("https://example.com/new", page(body("New"))), ("https://example.com/bad", 1)])
+        self.assertEqual(self.site_lines.stats()[1], 3)
+        self.assertEqual(self.site_lines.strip("https://example.com/new", page(body("New"))), body("New"))
+
+    def test_state_is_kept_between_runs(self):
+        for topic in TOPICS[:3]:
+            self.site_lines.ingest(f"https://example.com/{topic}", page(body(topic)))
+        self.site_lines.close()
+        self.site_lines = SiteBoilerplate(os.path.join(self.tmp.name, "state.db"))
+        self.assertEqual(self.site_lines.ingest("https://example.com/new", page(body("New"))), body("New"))
+
+    def test_pages_counted_before_near_duplicates_still_count(self):
+        path = os.path.join(self.tmp.name, "legacy.db")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE site_pages (domain TEXT, page_hash INTEGER, urls INTEGER, line_hashes BLOB, "
+                           "PRIMARY KEY (domain, page_hash)) WITHOUT ROWID")
+        connection.commit()
+        connection.close()
+        legacy = SiteBoilerplate(path)
+        for topic in TOPICS[:3]:
+            legacy.ingest(f"https://example.com/{topic}", page(body(topic)))
+        self.assertEqual(legacy.stats(), (1, 3, 4))
+        legacy.close()
+
+    def test_near_duplicates_are_found_among_pages_indexed_on_open(self):
+        path = os.path.join(self.tmp.name, "unindexed.db")
+        site_lines = SiteBoilerplate(path)
+        site_lines.ingest("https://privacy.microsoft.com/en-us", locale_variant("en-us"))
+        site_lines.connection.execute("DROP TABLE site_bands")
+        site_lines.close()
+
+        site_lines = SiteBoilerplate(path)
+        site_lines.ingest("https://privacy.microsoft.com/en-gb", locale_variant("en-gb"))
+        self.assertEqual(site_lines.connection.execute("SELECT SUM(counted) FROM site_pages").fetchone()[0], 1)
+
+        # A changed page leaves the index with its old counts
+        site_lines.ingest("https://privacy.microsoft.com/en-us", page(body("Cookies")))
+        site_lines.ingest("https://privacy.microsoft.com/en-ca", locale_variant("en-ca"))
+        self.assertEqual(site_lines.connection.execute("SELECT SUM(counted) FROM site_pages").fetchone()[0], 2)
+        site_lines.close()
+
+    def test_cost_per_page_does_not_grow_with_the_site(self):
+        # Every page is compared with a bounded number of candidates, not
+        # with every page of its site
+        timings = []
+        for batch in range(20):
+            pages = [(f"https://example.com/{name(i)}", page(body(name(i))))
+                     for i in range(batch * 100, (batch + 1) * 100)]
+            start = time.perf_counter()
+            self.site_lines.ingest_many(pages)
+            timings.append(time.perf_counter() - start)
+        self.assertEqual(self.site_lines.stats()[1], 2000)
+        self.assertLess(min(timings[-3:]), 2 * min(timings[1:4]))
+
+
+if __name__ == "__main__":
+    unittest.main()
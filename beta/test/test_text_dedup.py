@@ -0,0 +1,93 @@
+"""
+tests/test_text_dedup.py
+Unit tests for the content-addressed, reference-counted text blobs behind
+tos_data.
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from tosppcrawler.db_pipeline import TosDataStore
+
+POLICY = " ".join(f"Clause {i}: we may share your data with partners." for i in range(100))
+
+
+class TestTextDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = TosDataStore(os.path.join(self.tmp.name, "test.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def blobs(self):
+        return self.store.connection.execute("SELECT hash, refcount FROM text_blobs ORDER BY hash").fetchall()
+
+    def test_identical_texts_share_a_blob(self):
+        self.store.save_many([("Terms", f"https://mirror{i}.example.com/terms", POLICY) for i in range(5)])
+        self.assertEqual([refcount for _, refcount in self.blobs()], [5])
+        self.assertEqual(self.store.get_text("https://mirror3.example.com/terms"), POLICY)
+
+    def test_truncated_copies_reference_the_full_text(self):
+        self.store.save_many([("Terms", "https://example.com/full", POLICY)])
+        self.store.save_many([("Terms", f"https://example.com/{n}", POLICY[:n]) for n in (200, 900)])
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertEqual(self.store.get_text("https://example.com/200"), POLICY[:200])
+        self.assertEqual(self.store.storage_stats(), (3, 1, len(POLICY) + 1100, len(POLICY)))
+
+    def test_longer_text_takes_over_a_stored_prefix(self):
+        self.store.save_many([("Terms", "https://example.com/a", POLICY[:300]), ("Terms", "https://example.com/b", POLICY[:300])])
+        self.store.save_many([("Terms", "https://example.com/c", POLICY)])
+        self.assertEqual([refcount for _, refcount in self.blobs()], [3])
+        self.assertEqual(self.store.get_text("https://example.com/a"), POLICY[:300])
+        self.assertEqual(self.store.get_text("https://example.com/c"), POLICY)
+
+    def test_prefixes_are_found_among_many_texts_with_one_head(self):
+        variants = [f"{POLICY[:300]} Variant {i}: {POLICY[300:]}" for i in range(12)]
+        self.store.save_many([("Terms", f"https://example.com/{i}", text) for i, text in enumerate(variants)])
+        self.store.save_many([("Terms", "https://example.com/cut", variants[11][:2000])])
+        self.store.save_many([("Terms", "https://example.com/longer", variants[10] + " Last clause.")])
+        self.assertEqual(len(self.blobs()), 12)
+        self.assertEqual(self.store.get_text("https://example.com/cut"), variants[11][:2000])
+        self.assertEqual(self.store.get_text("https://example.com/10"), variants[10])
+
+    def test_unreferenced_blobs_are_collected(self):
+        self.store.save_many([("Terms", "https://example.com/a", "Old terms."), ("Terms", "https://example.com/b", "Shared.")])
+        self.store.save_many([("Terms", "https://example.com/a", "Shared.")])
+        self.assertEqual([refcount for _, refcount in self.blobs()], [2])
+        self.assertEqual(self.store.get_version("https://example.com/a", 1), "Old terms.")
+
+    def test_unique_texts_counts_rows(self):
+        self.store.save_many([("Terms", f"https://example.com/{i}", POLICY) for i in range(3)])
+        self.store.save_many([("Terms", "https://example.com/short", POLICY[:500])])
+        self.assertEqual(sorted(self.store.unique_texts()), sorted([(POLICY, 3), (POLICY[:500], 1)]))
+
+    def test_search_reads_shared_texts(self):
+        self.store.save_many([("Terms", f"https://example.com/{i}", POLICY[:400 + i]) for i in range(3)])
+        self.assertEqual(len(self.store.search("partners")), 3)
+        self.store.save_many([("Terms", "https://example.com/0", "Nothing to see.")])
+        self.assertEqual(len(self.store.search("partners")), 2)
+        self.store.connection.execute("INSERT INTO tos_data_fts (tos_data_fts) VALUES ('integrity-check')")
+
+    def test_inline_texts_move_to_blobs_on_open(self):
+        path = os.path.join(self.tmp.name, "legacy.db")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE tos_data (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, url TEXT, text TEXT)")
+        connection.executemany("INSERT INTO tos_data (title, url, text) VALUES ('Terms', ?, ?)",
+                               [("https://example.org/a", POLICY), ("https://example.org/b", POLICY)])
+        connection.commit()
+        connection.close()
+
+        store = TosDataStore(path)
+        self.assertEqual(store.storage_stats()[:2], (2, 1))
+        self.assertEqual(store.get_text("https://example.org/b"), POLICY)
+        self.assertEqual(len(store.search("partners")), 2)
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+tests/test_url_feed.py
+Unit tests for the lazy, resumable start URL feed and its cursor.
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from scrapy import Spider
+from scrapy.http import Request
+from scrapy.utils.request import RequestFingerprinter
+from scrapy.utils.test import get_crawler
+
+from tosppcrawler.dupefilter import PersistentDupeFilter
+from tosppcrawler.sharding import shard_paths
+
+from tosppcrawler.url_feed import StartUrlFeed
+
+URLS = [f"https://example.com/{i}" for i in range(7)]
+
+
+class TestStartUrlFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cursor_db = os.path.join(self.tmp.name, "cursor.db")
+        self.urls_file = os.path.join(self.tmp.name, "urls.txt")
+        with open(self.urls_file, "w", encoding="utf-8") as f:
+            f.write("# seeds\n" + "\n\n".join(URLS) + "\n\n")
+        self.feeds = []
+
+    def tearDown(self):
+        for feed in self.feeds:
+            feed.connection.close()
+        self.tmp.cleanup()
+
+    def open_feed(self, **source):
+        source = source or {"path": self.urls_file}
+        feed = StartUrlFeed("test", self.cursor_db, batch_size=3, **source)
+        self.feeds.append(feed)
+        return feed
+
+    def crawl(self, feed, count=None):
+        """
+        Take count URLs (all by default) from the feed and finish their
+        requests. Returns the URLs taken.
+        """
+        urls = []
+        for position, url in feed:
+            feed.done(feed.request(Request(url), position))
+            urls.append(url)
+            if len(urls) == count:
+                break
+        return urls
+
+    def test_reads_every_url_in_order(self):
+        self.assertEqual(self.crawl(self.open_feed()), URLS)
+
+    def test_repeated_urls_are_fetched_once(self):
+        with open(self.urls_file, "a", encoding="utf-8") as f:
+            f.write("\n".join([URLS[0], URLS[3], URLS[0]]) + "\n")
+        dupefilter = PersistentDupeFilter(os.path.join(self.tmp.name, "dupefilter"), memory_mb=1, capacity=1000,
+                                          fingerprinter=RequestFingerprinter())
+        dupefilter.open()
+        feed = self.open_feed()
+        fetched = []
+        for position, url in feed:
+            request = feed.request(Request(url), position)
+            self.assertFalse(request.dont_filter)
+            if not dupefilter.request_seen(request):
+                dupefilter.response_downloaded(None, request, None)
+                dupefilter.request_left_downloader(request, None)
+                fetched.append(url)
+            # Filtered seeds are dropped, which finishes them as well
+            feed.done(request)
+        dupefilter.close("finished")
+        self.assertEqual(fetched, URLS)
+        self.assertEqual(feed.cursor, 0)
+        self.assertFalse(feed.pending)
+
+    def test_resumes_at_the_first_unfinished_batch(self):
+        feed = self.open_feed()
+        urls = iter(feed)
+        finished = [next(urls) for _ in range(4)]
+        for position, url in finished[:3]:
+            feed.done(feed.request(Request(url), position))
+        # The fourth URL was queued but never answered
+        self.assertEqual(self.crawl(self.open_feed()), URLS[3:])
+
+    def test_cursor_waits_for_every_request_of_a_batch(self):
+        feed = self.open_feed()
+        urls = iter(feed)
+        first, second, third = next(urls), next(urls), next(urls)
+        for position, url in (second, third):
+            feed.done(feed.request(Request(url), position))
+        self.assertEqual(feed.cursor, 0)
+        feed.done(feed.request(Request(first[1]), first[0]))
+        self.assertGreater(feed.cursor, 0)
+
+    def test_finished_feed_starts_over(self):
+        feed = self.open_feed()
+        self.assertEqual(self.crawl(feed), URLS)
+        self.assertEqual(feed.cursor, 0)
+        self.assertEqual(self.crawl(self.open_feed()), URLS)
+
+    def test_cursor_past_the_end_starts_over(self):
+        feed = self.open_feed()
+        feed.cursor = os.path.getsize(self.urls_file)
+        feed._save()
+        self.assertEqual(self.crawl(self.open_feed()), URLS)
+
+    def test_reset_restarts_an_unfinished_feed(self):
+        self.crawl(self.open_feed(), 4)
+        feed = self.open_feed()
+        feed.reset()
+        self.assertEqual(self.crawl(feed), URLS)
+
+    def test_blank_database_rows_do_not_end_the_feed(self):
+        db_path = os.path.join(self.tmp.name, "seeds.db")
+        connection = sqlite3.connect(db_path)
+        connection.execute("CREATE TABLE start_urls (url TEXT)")
+        rows = [URLS[0]] + [None, "", "  "] * 2 + URLS[1:3]
+        connection.executemany("INSERT INTO start_urls (url) VALUES (?)", [(url,) for url in rows])
+        connection.commit()
+        connection.close()
+        self.assertEqual(self.crawl(self.open_feed(db_path=db_path)), URLS[:3])
+
+    def test_sharded_cursor_is_kept_in_one_shard(self):
+        settings = {"FEED_CURSOR_DB": self.cursor_db, "FEED_BATCH_SIZE": 3, "SQLITE_SHARDS": 4}
+        spider = Spider.from_crawler(get_crawler(Spider, settings), "test", urls_file=self.urls_file)
+        feed = StartUrlFeed.from_spider(spider)
+        self.feeds.append(feed)
+        self.crawl(feed, 4)
+        shards = [path for path in shard_paths(self.cursor_db, 4) if os.path.exists(path)]
+        self.assertEqual(len(shards), 1)
+        self.assertFalse(os.path.exists(self.cursor_db))
+        self.feeds.append(StartUrlFeed.from_spider(spider))
+        self.assertEqual(self.crawl(self.feeds[-1]), URLS[3:])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+tests/test_validator_cache.py
+Unit tests for the conditional-GET downloader middleware, run against a
+local HTTP server that serves ETag/Last-Modified validators. They run under
+Twisted's trial test case, which spins the reactor until the Deferreds
+returned by a test have fired.
+"""
+
+import os
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrapy import Spider
+from scrapy.exceptions import DropItem, IgnoreRequest
+from scrapy.http import HtmlResponse, Request
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from tosppcrawler.fingerprints import UnchangedContent
+from tosppcrawler.middlewares import TosppcrawlerDownloaderMiddleware
+
+ETAG = '"policy-v1"'
+LAST_MODIFIED = "Tue, 01 Apr 2025 00:00:00 GMT"
+BODY = b"<html><body><p>Terms of Service</p></body></html>"
+
+
+class ValidatorHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def fetch(request):
+    """
+    Download a Scrapy request with urllib and wrap the result in a response.
+    """
+    headers = {key.decode(): request.headers.get(key).decode() for key in request.headers}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(request.url, headers=headers)) as raw:
+            status, raw_headers, body = raw.status, dict(raw.headers), raw.read()
+    except urllib.error.HTTPError as e:
+        status, raw_headers, body = e.code, dict(e.headers), b""
+    return HtmlResponse(request.url, status=status, headers=raw_headers, body=body, request=request)
+
+
+class TestValidatorCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ValidatorHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/terms"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.spider = Spider(name="test")
+        self.middleware = TosppcrawlerDownloaderMiddleware(self.db_path)
+        yield self.middleware.spider_opened(self.spider)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.middleware.spider_closed(self.spider)
+        os.remove(self.db_path)
+
+    def crawl(self, stored=True):
+        """
+        Fetch the page and, when stored, report its item as scraped.
+        """
+        request = Request(self.url)
+        self.middleware.process_request(request, self.spider)
+        response = self.middleware.process_response(request, fetch(request), self.spider)
+        if stored:
+            self.middleware.item_scraped({}, response, self.spider)
+        return request, response
+
+    def next_run(self):
+        """
+        Close the middleware, which writes what it buffered, and open it again.
+        """
+        return self.middleware.spider_closed(self.spider).addCallback(
+            lambda _: self.middleware.spider_opened(self.spider)
+        )
+
+    def test_first_crawl_sends_no_validators(self):
+        request, response = self.crawl()
+        self.assertNotIn(b"If-None-Match", request.headers)
+        self.assertEqual(response.status, 200)
+
+    @defer.inlineCallbacks
+    def test_recrawl_sends_stored_validators(self):
+        self.crawl()
+        yield self.next_run()
+        request = Request(self.url)
+        self.middleware.process_request(request, self.spider)
+        self.assertEqual(request.headers.get(b"If-None-Match"), ETAG.encode())
+        self.assertEqual(request.headers.get(b"If-Modified-Since"), LAST_MODIFIED.encode())
+
+    @defer.inlineCallbacks
+    def test_not_modified_is_dropped(self):
+        self.crawl()
+        yield self.next_run()
+        with self.assertRaises(IgnoreRequest):
+            self.crawl()
+
+    @defer.inlineCallbacks
+    def test_validators_are_written_in_batches(self):
+        _, response = self.crawl(stored=False)
+        saved = self.middleware.save_validators(response, self.spider)
+        self.assertFalse(saved.called)
+        self.middleware.writer.flush()
+        yield saved
+        request = Request(self.url)
+        self.middleware.process_request(request, self.spider)
+        self.assertEqual(request.headers.get(b"If-None-Match"), ETAG.encode())
+
+    @defer.inlineCallbacks
+    def test_validators_wait_for_the_item_to_be_stored(self):
+        _, response = self.crawl(stored=False)
+        self.middleware.item_dropped({}, response, DropItem("failed"), self.spider)
+        yield self.next_run()
+        request, response = self.crawl()
+        self.assertNotIn(b"If-None-Match", request.headers)
+        self.assertEqual(response.status, 200)
+
+    @defer.inlineCallbacks
+    def test_unchanged_items_keep_their_validators(self):
+        _, response = self.crawl(stored=False)
+        self.middleware.item_dropped({}, response, UnchangedContent("unchanged"), self.spider)
+        yield self.next_run()
+        with self.assertRaises(IgnoreRequest):
+            self.crawl()
+
+    @defer.inlineCallbacks
+    def test_dont_validate_meta_skips_cache(self):
+        self.crawl()
+        yield self.next_run()
+        request = Request(self.url, meta={"dont_validate": True})
+        self.middleware.process_request(request, self.spider)
+        self.assertNotIn(b"If-None-Match", request.headers)
+
@@ -0,0 +1,103 @@
+"""
+tests/test_versions.py
+Unit tests for delta-encoded version history and the versioned tos_data
+store.
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from tosppcrawler.db_pipeline import TosDataStore
+from tosppcrawler.versions import apply_delta, make_delta, split_units
+
+POLICY = "\n".join(
+    f"Section {i}. We may update these terms from time to time. Continued use means you accept them!"
+    for i in range(200)
+)
+
+
+class TestDeltas(unittest.TestCase):
+
+    def test_units_join_back_to_the_original(self):
+        text = "One. Two?  Three!\n\nFour\twithout end"
+        self.assertEqual("".join(split_units(text)), text)
+
+    def test_round_trip(self):
+        edited = POLICY.replace("Section 42. We may", "Section 42. We will", 1) + "\nSection 200. New clause."
+        self.assertEqual(apply_delta(POLICY, make_delta(POLICY, edited)), edited)
+        self.assertEqual(apply_delta(edited, make_delta(edited, POLICY)), POLICY)
+        self.assertEqual(apply_delta("", make_delta("", POLICY)), POLICY)
+
+    def test_small_change_gives_small_delta(self):
+        edited = POLICY.replace("Section 7.", "Section 7 (revised).", 1)
+        self.assertLess(len(make_delta(edited, POLICY)), 100)
+
+
+class TestTosDataStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = TosDataStore(os.path.join(self.tmp.name, "test.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_recrawls_keep_one_row_and_rebuild_old_versions(self):
+        url = "https://example.com/terms"
+        texts = [POLICY.replace("Section 1.", f"Section 1 (v{v}).", 1) for v in range(5)]
+        for text in texts:
+            self.store.save_many([("Terms", url, text)])
+
+        rows = self.store.connection.execute("SELECT COUNT(*) FROM tos_data WHERE url = ?", (url,)).fetchone()[0]
+        self.assertEqual(rows, 1)
+        self.assertEqual(self.store.get_text(url), texts[-1])
+        self.assertEqual(len(self.store.versions(url)), 4)
+        for version, text in enumerate(texts, start=1):
+            self.assertEqual(self.store.get_version(url, version), text)
+        self.assertIsNone(self.store.get_version(url, 9))
+        self.assertLess(self.store.history.size(url), len(POLICY) // 10)
+
+    def test_unchanged_text_adds_no_version(self):
+        self.store.save_many([("Terms", "https://example.com/a", POLICY)])
+        self.store.save_many([("Terms", "https://example.com/a", POLICY)])
+        self.assertEqual(self.store.versions("https://example.com/a"), [])
+
+    def test_updates_newest_of_legacy_duplicate_rows(self):
+        path = os.path.join(self.tmp.name, "legacy.db")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE tos_data (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, url TEXT, text TEXT)")
+        connection.executemany("INSERT INTO tos_data (title, url, text) VALUES (?, ?, ?)",
+                               [("Terms", "https://example.com/a", "Old."), ("Terms", "https://example.com/a", "Older copy.")])
+        connection.commit()
+        connection.close()
+
+        store = TosDataStore(path)
+        store.save_many([("Terms", "https://example.com/a", "New.")])
+        self.assertEqual(store.get_version("https://example.com/a", 1), "Older copy.")
+        self.assertEqual(store.get_text("https://example.com/a"), "New.")
+        store.close()
+
+    def test_language_is_stored_and_migrated(self):
+        self.store.save_many([("Terms", "https://example.com/a", "Old.", "en"), ("Terms", "https://example.com/b", "B.")])
+        self.store.save_many([("AGB", "https://example.com/a", "Neu.", "de")])
+        self.assertEqual(self.store.get_language("https://example.com/a"), "de")
+        self.assertIsNone(self.store.get_language("https://example.com/b"))
+
+        path = os.path.join(self.tmp.name, "legacy.db")
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE tos_data (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, url TEXT, text TEXT)")
+        connection.execute("CREATE VIEW tos_texts AS SELECT id, title, url, text FROM tos_data")
+        connection.commit()
+        connection.close()
+
+        store = TosDataStore(path)
+        store.save_many([("Terms", "https://example.com/a", "New.", "en")])
+        self.assertEqual(store.connection.execute("SELECT language FROM tos_texts").fetchall(), [("en",)])
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,48 +5,274 @@ Functions to clean raw scraped text data.
 
 import re
 
-def clean_text(text):
+# Patterns compiled once at import. Each cleaning rule pairs a pattern with
+# the substrings it cannot match without, so a rule whose trigger is absent
+# from the text is skipped instead of scanning the whole string.
+_WINDOW_ASSIGNMENT = re.compile(r'window\..*?;')
+_KEY_STRING_VALUE = re.compile(r'\"[^\"]*\"\s*:\s*\"[^\"]*\"')
+_KEY_ANY_VALUE = re.compile(r'\"[^\"]*\"\s*:\s*[^,]*,?')
+_FRAMEWORK_REFERENCE = re.compile(r'\"[^"]*\.(graphql|react|rendererRef)[^\"]*\"')
+_ESCAPED_FRAMEWORK_REFERENCE = re.compile(r'\\"[^\\"]*\\.(graphql|react|rendererRef)[^\\"]*\\"')
+_CSS_JUNK = re.compile(r'css[\]\}\"]+')
+_NON_ASCII_BYTES = re.compile(rb'[\x80-\xff]+')
+_STRAY_PUNCTUATION_TO_SPACE = bytes.maketrans(b',\\[]{}"', b'       ')
+
+_FRAMEWORK_NAMES = ('graphql', 'react', 'rendererRef')
+
+# strip_code_blocks scanner tokens; a string literal ends at its line
+_STRING = r'"[^"\\\n]*(?:\\.[^"\\\n]*)*'
+_BLOCK_OPENER = re.compile(r'[{\[]')
+_TOP_LEVEL_TOKEN = re.compile(r'[{\[()]')
+_BRACKET = re.compile(r'[{}\[\]]')
+_BLOCK_TOKEN = re.compile(_STRING + r'"|[{}\[\]"]')
+_STRING_LITERAL = re.compile(_STRING)
+_FUNCTION_HEAD = re.compile(r'function\s*\(')
+_WHITESPACE = re.compile(r'\s*')
+_OPENER_OF = {'}': '{', ']': '['}
+
+
+def strip_code_blocks(text, function_definitions=False):
     """
-    Cleans the input text by removing unwanted patterns like JavaScript, CSS, 
-    meta fields, numbers, extra spaces, and non-ASCII characters.
+    Removes {...} and [...] blocks such as inline JSON and script bodies,
+    with any blocks nested inside them, in one left-to-right scan.
+
+    Inside a block, double-quoted string literals (with backslash escapes,
+    ending at the line) are skipped, so braces and brackets in them do not
+    count. A closer that does not match the innermost open block is treated
+    as text. An opener that is never closed is kept as text, while complete
+    blocks after it are still removed. With function_definitions, a block
+    written as the body of `function (...)` is removed with that head.
+
+    Each character is looked at a bounded number of times, so the time is
+    linear in the length of the text whatever its nesting.
 
     Args:
-        text (str): Raw scraped text.
+        text (str): Text to clean.
+        function_definitions (bool): Also remove `function (...)` heads.
 
     Returns:
-        str: Cleaned text.
+        str: Text without the blocks.
     """
-    # Remove window object assignments
-    text = re.sub(r'window\..*?;', '', text)
+    spans = []      # (start, end) of the removed blocks, in order
+    parens = {}     # '(' position -> matching ')' position, outside blocks
+    open_parens = []
+    if function_definitions and 'function' in text:
+        top_level = _TOP_LEVEL_TOKEN
+    else:
+        top_level = _BLOCK_OPENER
+    position = 0
+    while True:
+        token = top_level.search(text, position)
+        if token is None:
+            break
+        index = token.start()
+        char = text[index]
+        position = index + 1
+        if char == '(':
+            open_parens.append(index)
+        elif char == ')':
+            if open_parens:
+                parens[open_parens.pop()] = index
+        else:
+            end = _block_end(text, index)
+            if end is None:
+                # The opener is text; scan once more for the outermost
+                # complete blocks after it. A block closes after every
+                # block inside it.
+                closed = []
+                _block_end(text, index, closed)
+                inner = []
+                for span in reversed(closed):
+                    if not inner or span[1] <= inner[-1][0]:
+                        inner.append(span)
+                spans.extend(reversed(inner))
+                break
+            spans.append((index, end))
+            position = end
 
-    # Remove function definitions
-    text = re.sub(r'function\s*\(.*?\)\s*{.*?}', '', text, flags=re.DOTALL)
+    if not spans:
+        return text
+    if parens:
+        spans = _with_function_heads(text, spans, parens)
 
-    # Remove JSON-like { ... } and [ ... ] artifacts
-    text = re.sub(r'\{.*?\}', '', text, flags=re.DOTALL)
-    text = re.sub(r'\[.*?\]', '', text, flags=re.DOTALL)
+    pieces = []
+    position = 0
+    for start, end in spans:
+        if end <= position:
+            continue
+        pieces.append(text[position:max(start, position)])
+        position = end
+    pieces.append(text[position:])
+    return ''.join(pieces)
 
-    # Remove "key": "value" pairs often present in JS configs
-    text = re.sub(r'\"[^\"]*\"\s*:\s*\"[^\"]*\"', '', text)
-    text = re.sub(r'\"[^\"]*\"\s*:\s*[^,]*,?', '', text)
 
-    # Remove .graphql, .react, .rendererRef references
-    text = re.sub(r'\"[^"]*\.(graphql|react|rendererRef)[^\"]*\"', '', text)
-    text = re.sub(r'\\"[^\\"]*\\.(graphql|react|rendererRef)[^\\"]*\\"', '', text)
+def _block_end(text, start, closed=None):
+    """
+    Finds where the block opened at `start` ends.
 
-    # Remove CSS, random commas, leftover brackets
-    text = re.sub(r'css[\]\}\"]+', '', text)
+    Args:
+        text (str): Text being scanned.
+        start (int): Position of the opener.
+        closed (list): If given, collects the (start, end) of every block
+            closed inside, in closing order.
 
-    # Remove numbers
-    text = re.sub(r'[0-9]+', '', text)
+    Returns:
+        int: Position after the closer, or None if the block never closes.
+    """
+    stack = [start]  # positions of the open levels
+    position = start + 1
+    while position is not None:
+        resume = None
+        for token in _BLOCK_TOKEN.finditer(text, position):
+            index = token.start()
+            char = text[index]
+            if char == '{' or char == '[':
+                stack.append(index)
+            elif char == '"':
+                if token.end() - index > 1:
+                    continue  # a whole string literal
+                # A quote that starts no literal: every quote up to where
+                # the literal gave up is escaped and would give up there
+                # too, so only brackets count until then
+                stop = _STRING_LITERAL.match(text, index).end()
+                for bracket in _BRACKET.finditer(text, index + 1, stop):
+                    if _bracket(text, stack, closed, bracket.start()):
+                        return bracket.end()
+                resume = stop
+                break
+            elif text[stack[-1]] == _OPENER_OF[char]:
+                # _bracket() inlined, this loop sees nearly every token
+                opened = stack.pop()
+                if not stack:
+                    return index + 1
+                if closed is not None:
+                    closed.append((opened, index + 1))
+        position = resume
+    return None
 
-    # Collapse multiple spaces and newlines
-    text = re.sub(r'\s+', ' ', text)
 
-    # Remove non-ASCII characters
-    text = re.sub(r'[^\x00-\x7F]+', ' ', text)
+def _bracket(text, stack, closed, index):
+    # Opens or closes a level; True once the outermost block is closed
+    char = text[index]
+    if char == '{' or char == '[':
+        stack.append(index)
+    elif text[stack[-1]] == _OPENER_OF[char]:
+        opened = stack.pop()
+        if not stack:
+            return True
+        if closed is not None:
+            closed.append((opened, index + 1))
+    return False
 
-    return text.strip()
+
+def _with_function_heads(text, spans, parens):
+    # Extends each outermost block that is the body of `function (...)`
+    # back to the start of the word function
+    ends = dict(spans)
+    for head in _FUNCTION_HEAD.finditer(text):
+        close = parens.get(head.end() - 1)
+        if close is None:
+            continue
+        body = _WHITESPACE.match(text, close + 1).end()
+        if body in ends:
+            ends[head.start()] = ends.pop(body)
+    return sorted(ends.items())
+
+
+def _remove(pattern):
+    return lambda text: pattern.sub('', text)
+
+
+# (triggers, rule) pairs in the order they are applied
+_CLEAN_TEXT_RULES = [
+    (('window.',), _remove(_WINDOW_ASSIGNMENT)),
+    (('{', '['), lambda text: strip_code_blocks(text, function_definitions=True)),
+    (('"',), _remove(_KEY_STRING_VALUE)),
+    (('"',), _remove(_KEY_ANY_VALUE)),
+    (_FRAMEWORK_NAMES, _remove(_FRAMEWORK_REFERENCE)),
+    (_FRAMEWORK_NAMES, _remove(_ESCAPED_FRAMEWORK_REFERENCE)),
+    (('css',), _remove(_CSS_JUNK)),
+]
+
+_CLEAN_OUTPUT_TEXT_RULES = [
+    (_FRAMEWORK_NAMES, _remove(_FRAMEWORK_REFERENCE)),
+    (_FRAMEWORK_NAMES, _remove(_ESCAPED_FRAMEWORK_REFERENCE)),
+    (('css',), _remove(_CSS_JUNK)),
+    (('{', '['), strip_code_blocks),
+]
+
+
+def _apply_rules(text, rules):
+    for triggers, rule in rules:
+        if any(trigger in text for trigger in triggers):
+            text = rule(text)
+    return text
+
+
+def _normalize(text, stray_punctuation=False):
+    """
+    Removes digits, optionally turns runs of stray brackets, commas and
+    quotes into spaces, collapses whitespace and replaces runs of non-ASCII
+    characters with a space.
+
+    UTF-8 only uses bytes below 0x80 for ASCII characters, so digits and
+    punctuation are translated on the encoded text and non-ASCII runs are
+    found as runs of high bytes, both far faster than on a str holding
+    non-ASCII characters. str.split() splits on the same characters the
+    regex whitespace class matches, so joining its parts collapses and
+    strips whitespace in one pass. A stray punctuation run turned into a
+    space per character instead of one space collapses the same way.
+
+    Args:
+        text (str): Text left by the structural rules.
+        stray_punctuation (bool): Also replace runs of brackets, braces,
+            commas, quotes and backslashes with a space.
+
+    Returns:
+        str: Normalized text.
+    """
+    table = _STRAY_PUNCTUATION_TO_SPACE if stray_punctuation else None
+    data = text.encode('utf-8', 'surrogatepass').translate(table, b'0123456789')
+    text = ' '.join(data.decode('utf-8', 'surrogatepass').split())
+    if not text.isascii():
+        data = _NON_ASCII_BYTES.sub(b' ', text.encode('utf-8', 'surrogatepass'))
+        text = data.decode('ascii').strip()
+    return text
+
+
+def clean_text(text):
+    """
+    Cleans the input text by removing unwanted patterns like JavaScript, CSS, 
+    meta fields, numbers, extra spaces, and non-ASCII characters.
+
+    The rules are applied in order: window assignments, function
+    definitions, {...} and [...] artifacts, "key": value pairs, .graphql,
+    .react and .rendererRef references, CSS junk, then digits, whitespace
+    and non-ASCII characters. The result is the same as applying one
+    re.sub per rule, without the passes that cannot match.
+
+    Args:
+        text (str): Raw scraped text.
+
+    Returns:
+        str: Cleaned text.
+    """
+    return _normalize(_apply_rules(text, _CLEAN_TEXT_RULES))
+
+
+def clean_output_text(text):
+    """
+    The cleaning process_output.py applies to crawled pages: framework
+    references, CSS junk, {...} and [...] artifacts, digits and stray
+    brackets, commas and quotes, then whitespace and non-ASCII characters.
+
+    Args:
+        text (str): Raw scraped text.
+
+    Returns:
+        str: Cleaned text.
+    """
+    return _normalize(_apply_rules(text, _CLEAN_OUTPUT_TEXT_RULES), stray_punctuation=True)
 
 def basic_text_preprocess(text):
     """
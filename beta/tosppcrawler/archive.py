@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import struct
+import time
+import zlib
+
+from scrapy import signals
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.misc import build_from_crawler
+from twisted.internet import defer
+
+from tosppcrawler.writer import BatchedWriter, writer_options
+
+RECORD = struct.Struct("<II")  # metadata length, body length
+
+
+class ResponseArchive:
+    # Append-only archive of raw HTTP responses. Records go to
+    # responses.dat as a small JSON header (url, status, headers) followed by
+    # the zlib-compressed body; index.db maps each request fingerprint to the
+    # offset of its latest record, so a lookup is one seek and one read.
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.data_path = os.path.join(path, "responses.dat")
+        self.index = sqlite3.connect(os.path.join(path, "index.db"))
+        self.index.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                fingerprint TEXT PRIMARY KEY,
+                url TEXT,
+                offset INTEGER,
+                length INTEGER,
+                recorded_at REAL
+            )
+        ''')
+        self.index.commit()
+        self.writer = None
+        self.reader = None
+
+    def write(self, fingerprint, url, status, headers, body):
+        self.write_many([(fingerprint, url, status, headers, body)])
+
+    def write_many(self, records):
+        # (fingerprint, url, status, headers, body) records, indexed in one
+        # transaction
+        if self.writer is None:
+            self.writer = open(self.data_path, "ab")
+        rows = []
+        for fingerprint, url, status, headers, body in records:
+            meta = json.dumps({"url": url, "status": status, "headers": headers}).encode("utf-8")
+            body = zlib.compress(body, 6)
+            offset = self.writer.tell()
+            self.writer.write(RECORD.pack(len(meta), len(body)))
+            self.writer.write(meta)
+            self.writer.write(body)
+            rows.append((fingerprint, url, offset, RECORD.size + len(meta) + len(body), time.time()))
+        # Records are on disk before the index points at them
+        self.writer.flush()
+        with self.index:
+            self.index.executemany(
+                "INSERT OR REPLACE INTO responses (fingerprint, url, offset, length, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def _read_at(self, offset):
+        if self.reader is None:
+            self.reader = open(self.data_path, "rb")
+        self.reader.seek(offset)
+        meta_length, body_length = RECORD.unpack(self.reader.read(RECORD.size))
+        meta = json.loads(self.reader.read(meta_length))
+        body = zlib.decompress(self.reader.read(body_length))
+        return meta, body
+
+    def read(self, fingerprint):
+        # Returns (meta, body) for the latest record of a fingerprint, or None
+        row = self.index.execute(
+            "SELECT offset FROM responses WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._read_at(row[0])
+
+    def __iter__(self):
+        # Latest record of every archived request, in data file order
+        rows = self.index.execute("SELECT offset FROM responses ORDER BY offset")
+        for (offset,) in rows.fetchall():
+            yield self._read_at(offset)
+
+    def close(self):
+        for f in (self.writer, self.reader):
+            if f is not None:
+                f.close()
+        self.index.close()
+
+
+def build_response(meta, body, request=None):
+    # Rebuilds the Scrapy response (HtmlResponse, TextResponse, ...) for an
+    # archived record
+    headers = Headers({key: values for key, values in meta["headers"].items()})
+    cls = responsetypes.from_args(headers=headers, url=meta["url"], body=body)
+    return cls(
+        url=meta["url"],
+        status=meta["status"],
+        headers=headers,
+        body=body,
+        request=request,
+        flags=["archived"],
+    )
+
+
+class ArchiveRecorderMiddleware:
+    # Writes every downloaded response to the archive when ARCHIVE_MODE is
+    # "record". It sits next to the downloader so it stores the bytes as they
+    # came off the wire, before decompression and redirects. Bodies are
+    # compressed and appended in batches by a BatchedWriter thread (see
+    # writer.py), which spider_closed waits for.
+
+    def __init__(self, path, fingerprinter, stats, writer_options=None):
+        self.path = path
+        self.fingerprinter = fingerprinter
+        self.stats = stats
+        self.writer_options = writer_options or {}
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.get("ARCHIVE_MODE") != "record":
+            raise NotConfigured
+        s = cls(
+            crawler.settings.get("ARCHIVE_DIR", "archive"),
+            crawler.request_fingerprinter,
+            crawler.stats,
+            # One archive, which replays look up by request fingerprint
+            writer_options(crawler.settings, sharded=False),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        self.writer = BatchedWriter(
+            self.path,
+            ResponseArchive,
+            lambda archive, records: archive.write_many(records),
+            lambda archive: archive.close(),
+            name="archive-writer",
+            **self.writer_options,
+        )
+        return self.writer.start()
+
+    def process_response(self, request, response, spider):
+        # A 304 has no body to replay; keep the last full copy instead
+        if response.status != 304 and "archived" not in response.flags:
+            headers = {
+                key.decode("latin-1"): [value.decode("latin-1") for value in values]
+                for key, values in response.headers.items()
+            }
+            d = self.writer.submit(response.url, (
+                self.fingerprinter.fingerprint(request).hex(),
+                response.url,
+                response.status,
+                headers,
+                response.body,
+            ))
+            d.addErrback(self._not_recorded, response.url, spider)
+            self.stats.inc_value("archive/recorded", spider=spider)
+            self.stats.inc_value("archive/recorded_bytes", len(response.body), spider=spider)
+        return response
+
+    def _not_recorded(self, failure, url, spider):
+        spider.logger.error("Could not archive %s: %s", url, failure.getErrorMessage())
+
+    def spider_closed(self, spider):
+        return self.writer.close()
+
+
+class ArchiveDownloadHandler:
+    # HTTP(S) download handler for offline re-parsing. With ARCHIVE_MODE set
+    # to "replay" every request is answered from the archive with no network
+    # access, and requests that were never recorded fail with IgnoreRequest.
+    # In any other mode it hands requests to Scrapy's regular HTTP handler.
+    #
+    # The stateful components check ARCHIVE_MODE themselves, so a replay
+    # neither filters pages by what real crawls stored nor changes it: the
+    # dupefilter, validator cache, fingerprint pipeline and feed cursor keep
+    # nothing, and SiteBoilerplatePipeline only reads its line counts.
+
+    lazy = False
+
+    def __init__(self, settings, crawler):
+        self.replay = settings.get("ARCHIVE_MODE") == "replay"
+        self.crawler = crawler
+        if self.replay:
+            self.archive = ResponseArchive(settings.get("ARCHIVE_DIR", "archive"))
+            self.handler = None
+        else:
+            self.archive = None
+            self.handler = build_from_crawler(HTTP11DownloadHandler, crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        if not self.replay:
+            return self.handler.download_request(request, spider)
+
+        record = self.archive.read(self.crawler.request_fingerprinter.fingerprint(request).hex())
+        if record is None:
+            self.crawler.stats.inc_value("archive/miss", spider=spider)
+            return defer.fail(IgnoreRequest(f"Not in the response archive: {request.url}"))
+        self.crawler.stats.inc_value("archive/replayed", spider=spider)
+        return defer.succeed(build_response(*record, request=request))
+
+    def close(self):
+        if self.replay:
+            self.archive.close()
+            return None
+        return self.handler.close()
@@ -0,0 +1,112 @@
+import hashlib
+
+# Texts sharing their first HEAD_CHARS characters are checked for being
+# prefixes of one another
+HEAD_CHARS = 128
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TextBlobStore:
+    # Content-addressed text storage. Each distinct text is stored once in
+    # text_blobs under its SHA-1; records keep (hash, length) and read back
+    # the first `length` characters of the blob, so a text that is a prefix
+    # of a stored one (a truncated copy, a mirror cut short) costs nothing
+    # extra. When a new text extends a stored one, the longer text replaces
+    # it and the records of the shorter one are pointed at the new blob.
+    #
+    # Prefixes are only looked for among blobs with the same head_hash, and
+    # SQLite compares every one of them with the new text, so no prefix
+    # match is missed however many texts share a head; a head shared by
+    # many distinct texts (a long cookie banner, say) makes put() slower,
+    # not less effective. The longest matching blob wins.
+    #
+    # refcount counts the records using a blob; put() adds a reference,
+    # release() drops one and collect_garbage() deletes unreferenced blobs.
+    # referrers lists the (table, hash column) pairs that point at blobs.
+    # Nothing is committed here, so blob and record changes share the
+    # caller's transaction.
+
+    def __init__(self, connection, referrers):
+        self.connection = connection
+        self.referrers = referrers
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS text_blobs (
+                hash TEXT PRIMARY KEY,
+                head_hash TEXT,
+                length INTEGER,
+                refcount INTEGER,
+                text TEXT
+            )
+        ''')
+        self.connection.execute("CREATE INDEX IF NOT EXISTS text_blobs_head ON text_blobs (head_hash)")
+
+    def put(self, text):
+        # Adds a reference to text; returns the (hash, length) to store
+        digest = text_hash(text)
+        if self._add_reference(digest):
+            return digest, len(text)
+        if len(text) >= HEAD_CHARS:
+            head = text_hash(text[:HEAD_CHARS])
+            # A stored text that starts with this one
+            row = self.connection.execute(
+                "SELECT hash FROM text_blobs WHERE head_hash = ? AND length > ? AND substr(text, 1, ?) = ? "
+                "ORDER BY length DESC, hash LIMIT 1",
+                (head, len(text), len(text), text),
+            ).fetchone()
+            if row is not None:
+                self._add_reference(row[0])
+                return row[0], len(text)
+            # A stored text this one starts with
+            row = self.connection.execute(
+                "SELECT hash FROM text_blobs WHERE head_hash = ? AND length < ? AND text = substr(?, 1, length) "
+                "ORDER BY length DESC, hash LIMIT 1",
+                (head, len(text), text),
+            ).fetchone()
+            if row is not None:
+                self._extend(row[0], digest, head, text)
+                return digest, len(text)
+        else:
+            head = None
+        self.connection.execute(
+            "INSERT INTO text_blobs (hash, head_hash, length, refcount, text) VALUES (?, ?, ?, 1, ?)",
+            (digest, head, len(text), text),
+        )
+        return digest, len(text)
+
+    def _add_reference(self, digest):
+        cursor = self.connection.execute("UPDATE text_blobs SET refcount = refcount + 1 WHERE hash = ?", (digest,))
+        return cursor.rowcount > 0
+
+    def _extend(self, old_hash, digest, head, text):
+        # text starts with the blob old_hash: store text, move the old
+        # blob's records over to it and drop the old blob
+        refcount = self.connection.execute(
+            "SELECT refcount FROM text_blobs WHERE hash = ?", (old_hash,)
+        ).fetchone()[0]
+        self.connection.execute(
+            "INSERT INTO text_blobs (hash, head_hash, length, refcount, text) VALUES (?, ?, ?, ?, ?)",
+            (digest, head, len(text), refcount + 1, text),
+        )
+        for table, column in self.referrers:
+            self.connection.execute(f"UPDATE {table} SET {column} = ? WHERE {column} = ?", (digest, old_hash))
+        self.connection.execute("DELETE FROM text_blobs WHERE hash = ?", (old_hash,))
+
+    def release(self, digest):
+        self.connection.execute("UPDATE text_blobs SET refcount = refcount - 1 WHERE hash = ?", (digest,))
+
+    def get(self, digest, length):
+        row = self.connection.execute(
+            "SELECT substr(text, 1, ?) FROM text_blobs WHERE hash = ?", (length, digest)
+        ).fetchone()
+        return row[0] if row else None
+
+    def collect_garbage(self):
+        # Deletes blobs no record refers to; returns how many
+        return self.connection.execute("DELETE FROM text_blobs WHERE refcount <= 0").rowcount
+
+    def size(self):
+        # (blobs, characters stored)
+        return self.connection.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM text_blobs").fetchone()
@@ -0,0 +1,254 @@
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+
+from scrapy import signals
+from scrapy.dupefilters import BaseDupeFilter
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<4sIdQ")  # magic, hash count, created at, bits set
+MAGIC = b"TPBF"
+
+
+class BloomGeneration:
+    # One mmap'd Bloom filter file covering a slice of the recrawl TTL. The
+    # bit array lives in the page cache, not the Python heap, so the memory
+    # cost is fixed by the file size whatever the number of fingerprints.
+
+    def __init__(self, path, size_bits=None, hash_count=None):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, hash_count, time.time(), 0))
+                f.truncate(HEADER.size + size_bits // 8)
+
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.hash_count, self.created, self.bits_set = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a fingerprint filter file")
+        self.size_bits = (len(self.map) - HEADER.size) * 8
+
+    def _positions(self, fingerprint):
+        # Double hashing over the first 16 bytes of the SHA-1 fingerprint
+        h1 = int.from_bytes(fingerprint[:8], "little")
+        h2 = int.from_bytes(fingerprint[8:16], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size_bits
+
+    def __contains__(self, fingerprint):
+        data = self.map
+        offset = HEADER.size
+        for bit in self._positions(fingerprint):
+            if not data[offset + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def add(self, fingerprint):
+        data = self.map
+        offset = HEADER.size
+        for bit in self._positions(fingerprint):
+            index = offset + (bit >> 3)
+            mask = 1 << (bit & 7)
+            byte = data[index]
+            if not byte & mask:
+                data[index] = byte | mask
+                self.bits_set += 1
+
+    def false_positive_rate(self):
+        # Probability that an unseen fingerprint hits k bits already set
+        return (self.bits_set / self.size_bits) ** self.hash_count
+
+    def close(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.hash_count, self.created, self.bits_set)
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+
+class RotatingBloomFilter:
+    # Bloom filter generations in one directory, each covering ttl /
+    # generation_count seconds. A generation older than ttl is deleted, so
+    # a fingerprint is forgotten between ttl minus one generation and ttl
+    # after it was added.
+
+    def __init__(self, path, ttl, generation_count, generation_bits, hash_count):
+        self.path = path
+        self.ttl = ttl
+        self.generation_count = generation_count
+        self.generation_bits = generation_bits
+        self.hash_count = hash_count
+        self.generations = []
+
+    def open(self, now):
+        os.makedirs(self.path, exist_ok=True)
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".bloom"):
+                continue
+            generation = BloomGeneration(os.path.join(self.path, name))
+            if now - generation.created >= self.ttl:
+                generation.close()
+                os.remove(generation.path)
+            else:
+                self.generations.append(generation)
+        self._rotate(now)
+
+    def _rotate(self, now):
+        # Starts a new generation when the newest one has covered its slice
+        # of the TTL, and drops generations that have expired meanwhile.
+        period = self.ttl / self.generation_count
+        while self.generations and now - self.generations[0].created >= self.ttl:
+            expired = self.generations.pop(0)
+            expired.close()
+            os.remove(expired.path)
+        if not self.generations or now - self.generations[-1].created >= period:
+            path = os.path.join(self.path, f"{int(now * 1000):015d}.bloom")
+            self.generations.append(BloomGeneration(path, self.generation_bits, self.hash_count))
+
+    def __contains__(self, fingerprint):
+        return any(fingerprint in generation for generation in reversed(self.generations))
+
+    def add(self, fingerprint, now):
+        if now - self.generations[-1].created >= self.ttl / self.generation_count:
+            self._rotate(now)
+        self.generations[-1].add(fingerprint)
+
+    def bits_set(self):
+        return sum(generation.bits_set for generation in self.generations)
+
+    def false_positive_rate(self):
+        # Chance that a never-seen fingerprint is wrongly reported: it only
+        # has to hit in one of the live generations
+        miss = 1.0
+        for generation in self.generations:
+            miss *= 1.0 - generation.false_positive_rate()
+        return 1.0 - miss
+
+    def close(self):
+        for generation in self.generations:
+            generation.close()
+        self.generations = []
+
+
+def _sizing(memory_mb, capacity, generations):
+    # Bits per generation and hash count for capacity fingerprints per TTL
+    bits = max(memory_mb * 8 * 1024 * 1024 // generations // 8 * 8, 64)
+    per_generation = max(capacity // generations, 1)
+    return bits, min(max(round(bits / per_generation * math.log(2)), 1), 16)
+
+
+class PersistentDupeFilter(BaseDupeFilter):
+    # Request fingerprint filter that remembers pages across crawl runs.
+    # Fingerprints go into rotating Bloom filter generations on disk (see
+    # RotatingBloomFilter), so a URL becomes crawlable again DUPEFILTER_TTL
+    # after it was fetched.
+    #
+    # Start requests from a URL feed (tagged with meta["dupefilter_seed"])
+    # are recrawled on their own schedule: they are only checked against
+    # the seeds fetched within DUPEFILTER_SEED_TTL, kept in a second set of
+    # generations under the seeds/ subdirectory, so a feed run again the
+    # next day reaches the validator cache and the content fingerprints
+    # while a URL repeated in a feed, or in overlapping feeds, is fetched
+    # once. Within a run every request, seed or not, is fetched once.
+    #
+    # A fingerprint is only persisted once its response has been downloaded.
+    # Requests still queued when a crawl stops are therefore fetched on the
+    # next run instead of being filtered as already seen. When replaying the
+    # response archive nothing is read from or written to disk, so every
+    # archived page is parsed again.
+
+    def __init__(self, path, memory_mb=64, capacity=50_000_000, ttl=7 * 24 * 3600,
+                 generations=4, fingerprinter=None, stats=None, debug=False, persist=True,
+                 seed_ttl=12 * 3600, seed_memory_mb=16, seed_capacity=10_000_000):
+        self.path = path
+        self.persist = persist
+        self.pages = RotatingBloomFilter(path, ttl, generations, *_sizing(memory_mb, capacity, generations))
+        self.seeds = RotatingBloomFilter(
+            os.path.join(path, "seeds"), seed_ttl, generations,
+            *_sizing(seed_memory_mb, seed_capacity, generations),
+        )
+        self.fingerprinter = fingerprinter
+        self.stats = stats
+        self.debug = debug
+        # Fingerprints scheduled in this run but not downloaded yet
+        self.pending = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter = cls(
+            settings.get("DUPEFILTER_DIR", "dupefilter"),
+            memory_mb=settings.getint("DUPEFILTER_MEMORY_MB", 64),
+            capacity=settings.getint("DUPEFILTER_CAPACITY", 50_000_000),
+            ttl=settings.getfloat("DUPEFILTER_TTL", 7 * 24 * 3600),
+            generations=settings.getint("DUPEFILTER_GENERATIONS", 4),
+            fingerprinter=crawler.request_fingerprinter,
+            stats=crawler.stats,
+            debug=settings.getbool("DUPEFILTER_DEBUG"),
+            persist=settings.get("ARCHIVE_MODE") != "replay",
+            seed_ttl=settings.getfloat("DUPEFILTER_SEED_TTL", 12 * 3600),
+            seed_memory_mb=settings.getint("DUPEFILTER_SEED_MEMORY_MB", 16),
+            seed_capacity=settings.getint("DUPEFILTER_SEED_CAPACITY", 10_000_000),
+        )
+        crawler.signals.connect(dupefilter.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(dupefilter.request_left_downloader, signal=signals.request_left_downloader)
+        return dupefilter
+
+    def open(self):
+        if not self.persist:
+            return
+        now = time.time()
+        self.pages.open(now)
+        self.seeds.open(now)
+        logger.info(
+            "Persistent dupefilter: %d generation(s), %d bits x %d hashes each",
+            len(self.pages.generations), self.pages.generation_bits, self.pages.hash_count,
+        )
+
+    def request_seen(self, request):
+        fingerprint = self.fingerprinter.fingerprint(request)
+        if fingerprint in self.pending:
+            return True
+        if fingerprint in (self.seeds if request.meta.get("dupefilter_seed") else self.pages):
+            return True
+        self.pending.add(fingerprint)
+        return False
+
+    def response_downloaded(self, response, request, spider):
+        if not self.persist:
+            return
+        fingerprint = self.fingerprinter.fingerprint(request)
+        now = time.time()
+        self.pages.add(fingerprint, now)
+        if request.meta.get("dupefilter_seed"):
+            self.seeds.add(fingerprint, now)
+
+    def request_left_downloader(self, request, spider):
+        # Without persistence the pending set is this run's only memory
+        if not self.persist:
+            return
+        self.pending.discard(self.fingerprinter.fingerprint(request))
+
+    def false_positive_rate(self):
+        return self.pages.false_positive_rate()
+
+    def close(self, reason):
+        rate = self.false_positive_rate()
+        if self.stats is not None:
+            self.stats.set_value("dupefilter/persistent_generations", len(self.pages.generations))
+            self.stats.set_value("dupefilter/persistent_bits_set", self.pages.bits_set())
+            self.stats.set_value("dupefilter/estimated_false_positive_rate", round(rate, 6))
+            self.stats.set_value("dupefilter/seed_bits_set", self.seeds.bits_set())
+        logger.info("Persistent dupefilter closed, estimated false-positive rate %.4f%%", rate * 100)
+        self.pages.close()
+        self.seeds.close()
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug("Filtered duplicate request: %(request)s", {"request": request}, extra={"spider": spider})
+        if self.stats is not None:
+            self.stats.inc_value("dupefilter/filtered", spider=spider)
@@ -0,0 +1,394 @@
+import json
+import re
+
+from lxml import etree, html
+
+# Subtrees that never hold readable text: code, inline data blobs and markup
+# that is not rendered. They are skipped without being visited.
+SKIPPED_TAGS = frozenset([
+    "script", "style", "noscript", "template", "svg", "math",
+    "iframe", "object", "embed", "canvas", "head",
+])
+
+# Elements that start a new line of text when rendered
+BLOCK_TAGS = frozenset([
+    "address", "article", "aside", "blockquote", "br", "caption", "dd",
+    "details", "dialog", "div", "dl", "dt", "fieldset", "figcaption",
+    "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6",
+    "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section",
+    "summary", "table", "tbody", "td", "tfoot", "th", "thead", "tr", "ul",
+])
+
+_WHITESPACE = re.compile(r"\s+")
+
+# One string literal in a JSON/JS payload, with the colon that marks it as an
+# object key. The unrolled loops never backtrack, so a payload is tokenized
+# in a single left-to-right scan.
+_STRING_TOKEN = re.compile(
+    r'"([^"\\]*(?:\\.[^"\\]*)*)"(\s*:)?'
+    r"|'([^'\\]*(?:\\.[^'\\]*)*)'(\s*:)?",
+    re.S,
+)
+_UNESCAPED_QUOTE = re.compile(r'(?<!\\)"')
+_CODE_CHARS = re.compile(r"[{}\[\]<>=;|\\$_@#]")
+
+# Visible text shorter than this is treated as a JavaScript shell and the
+# embedded payloads are tried instead
+EMBEDDED_FALLBACK_CHARS = 1000
+
+
+def _root(source):
+    # Accepts a Scrapy response (reusing the tree parsel already built), an
+    # lxml element, or raw HTML as str/bytes.
+    selector = getattr(source, "selector", None)
+    if selector is not None:
+        return selector.root
+    if isinstance(source, etree._Element):
+        return source
+    if not source or not source.strip():
+        return None
+    try:
+        return html.fromstring(source)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def iter_blocks(source):
+    # Walks the DOM once, depth first, and yields the visible text of each
+    # block element as one whitespace-collapsed line. Only the pieces of the
+    # block currently being built are held in memory.
+    root = _root(source)
+    if root is None or not isinstance(root.tag, str):
+        return
+    body = root.find(".//body") if root.tag == "html" else root
+    if body is None:
+        body = root
+
+    line = []
+    walker = etree.iterwalk(body, events=("start", "end", "comment", "pi"))
+    for event, element in walker:
+        if event in ("comment", "pi"):
+            if element.tail:
+                line.append(element.tail)
+            continue
+
+        tag = element.tag
+        if event == "start":
+            if tag in SKIPPED_TAGS or element.get("hidden") is not None:
+                walker.skip_subtree()
+                continue
+            if tag in BLOCK_TAGS and line:
+                text = _WHITESPACE.sub(" ", "".join(line)).strip()
+                line.clear()
+                if text:
+                    yield text
+            if element.text:
+                line.append(element.text)
+        else:
+            if tag in BLOCK_TAGS and line:
+                text = _WHITESPACE.sub(" ", "".join(line)).strip()
+                line.clear()
+                if text:
+                    yield text
+            if element.tail and element is not body:
+                line.append(element.tail)
+
+    if line:
+        text = _WHITESPACE.sub(" ", "".join(line)).strip()
+        if text:
+            yield text
+
+
+def _join_lines(lines, max_chars=None):
+    # Joins lines one per row, stopping as soon as max_chars is reached so
+    # a generator of lines is only consumed as far as needed
+    kept = []
+    size = 0
+    for text in lines:
+        if max_chars is not None and size + len(text) >= max_chars:
+            kept.append(text[:max(max_chars - size, 0)].rstrip())
+            break
+        kept.append(text)
+        size += len(text) + 1
+    return "\n".join(kept)
+
+
+def extract_text(source, max_chars=None):
+    # Visible page text with one line per block, without the script, style
+    # and JSON payloads a plain '*::text' selection drags along. With
+    # max_chars set, extraction stops as soon as that much text is collected.
+    return _join_lines(iter_blocks(source), max_chars)
+
+
+# Page chrome rather than content: landmarks, ARIA roles and class/id words
+# used for menus, banners, cookie notices and sharing widgets. header and
+# footer only count outside article/main/section, where they are the site
+# banner and footer instead of the document's own heading or sign-off.
+CHROME_TAGS = frozenset(["nav", "aside", "form", "menu", "button", "select", "dialog"])
+SITE_CHROME_TAGS = frozenset(["header", "footer"])
+CONTENT_TAGS = frozenset(["article", "main", "section"])
+CHROME_ROLES = frozenset([
+    "navigation", "banner", "contentinfo", "complementary", "search",
+    "menu", "menubar", "toolbar", "dialog", "alertdialog",
+])
+_CHROME_HINT = re.compile(
+    r"cookie|consent|gdpr|banner|breadcrumb|(?<![a-z])nav|menu|masthead|footer|sidebar|"
+    r"social|share|newsletter|subscribe|skip-?link|promo|advert|popup|modal|toolbar",
+    re.I,
+)
+
+# A block is content when its text is dense (words per 80-character line,
+# as boilerpipe measures it) and at most a third of it is link text
+LINE_CHARS = 80
+MIN_TEXT_DENSITY = 10
+MAX_LINK_DENSITY = 0.33
+
+
+def _is_chrome(element, in_content):
+    tag = element.tag
+    if tag in CHROME_TAGS or (tag in SITE_CHROME_TAGS and not in_content):
+        return True
+    if element.get("role") in CHROME_ROLES or element.get("aria-modal") == "true":
+        return True
+    hints = f"{element.get('id', '')} {element.get('class', '')}"
+    return tag not in CONTENT_TAGS and bool(hints.strip()) and _CHROME_HINT.search(hints) is not None
+
+
+def iter_scored_blocks(source):
+    # The blocks of iter_blocks as (text, link chars, chrome chars): how much
+    # of each line sits inside <a> elements and inside page chrome. Each
+    # piece of text is tagged with the context it was found in, so inline
+    # share links or cookie notices inside a paragraph count for their size.
+    root = _root(source)
+    if root is None or not isinstance(root.tag, str):
+        return
+    body = root.find(".//body") if root.tag == "html" else root
+    if body is None:
+        body = root
+
+    pieces = []
+    # (in link, in chrome, in content) of the element being walked
+    context = [(False, False, False)]
+
+    def flush():
+        text = _WHITESPACE.sub(" ", "".join(piece for piece, _, _ in pieces)).strip()
+        if not text:
+            pieces.clear()
+            return None
+        link = _WHITESPACE.sub(" ", "".join(piece for piece, in_link, _ in pieces if in_link)).strip()
+        chrome = _WHITESPACE.sub(" ", "".join(piece for piece, _, in_chrome in pieces if in_chrome)).strip()
+        pieces.clear()
+        return text, len(link), len(chrome)
+
+    walker = etree.iterwalk(body, events=("start", "end", "comment", "pi"))
+    for event, element in walker:
+        if event in ("comment", "pi"):
+            if element.tail:
+                pieces.append((element.tail,) + context[-1][:2])
+            continue
+
+        tag = element.tag
+        if event == "start":
+            in_link, in_chrome, in_content = context[-1]
+            context.append((
+                in_link or tag == "a",
+                in_chrome or (element is not body and _is_chrome(element, in_content)),
+                in_content or tag in CONTENT_TAGS or element.get("role") == "main",
+            ))
+            if tag in SKIPPED_TAGS or element.get("hidden") is not None:
+                walker.skip_subtree()
+                continue
+            if tag in BLOCK_TAGS and pieces:
+                block = flush()
+                if block:
+                    yield block
+            if element.text:
+                pieces.append((element.text,) + context[-1][:2])
+        else:
+            context.pop()
+            if tag in BLOCK_TAGS and pieces:
+                block = flush()
+                if block:
+                    yield block
+            if element.tail and element is not body:
+                pieces.append((element.tail,) + context[-1][:2])
+
+    if pieces:
+        block = flush()
+        if block:
+            yield block
+
+
+def _text_density(text):
+    # Words per line of text wrapped at LINE_CHARS; a block that fits on
+    # one line scores its word count
+    words = len(text.split())
+    if len(text) <= LINE_CHARS:
+        return words
+    return words * LINE_CHARS / len(text)
+
+
+def _main_lines(source):
+    # Lines of the main content and the number of characters of all visible
+    # text. Blocks are classed as content (dense, few links), boilerplate
+    # (chrome or mostly links) or short; a short block such as a heading or
+    # one-line list item is kept when a neighbouring block is content, as in
+    # jusText. A page without any content block (a short notice, or one
+    # wrapped whole in an element with a menu-like class) keeps every block
+    # that is not mostly links.
+    blocks = []
+    total = 0
+    for text, link_chars, chrome_chars in iter_scored_blocks(source):
+        total += len(text) + 1
+        link_list = link_chars > len(text) * MAX_LINK_DENSITY
+        if link_list or chrome_chars * 2 > len(text):
+            good = False
+        elif _text_density(text) >= MIN_TEXT_DENSITY:
+            good = True
+        else:
+            good = None
+        blocks.append((text, good, link_list))
+
+    if not any(good for _, good, _ in blocks):
+        return [text for text, _, link_list in blocks if not link_list], total
+
+    # Class of the nearest content or boilerplate block after each block
+    following = []
+    after = None
+    for _, good, _ in reversed(blocks):
+        following.append(after)
+        if good is not None:
+            after = good
+    following.reverse()
+
+    lines = []
+    before = None
+    for (text, good, _), after in zip(blocks, following):
+        if good or (good is None and (before or after)):
+            lines.append(text)
+        if good is not None:
+            before = good
+    return lines, total
+
+
+def extract_main_text(source, max_chars=None):
+    # Visible text of the main content only: navigation, banners, cookie
+    # notices, footers and link lists are dropped by block text and link
+    # density. The whole page is scored before max_chars is applied.
+    lines, _ = _main_lines(source)
+    return _join_lines(lines, max_chars)
+
+
+def _decode(raw, single_quoted=False):
+    # Resolves JSON/JS escapes in a string literal body; None when it is not
+    # valid JSON string syntax (e.g. JS-only \x escapes)
+    if single_quoted:
+        raw = _UNESCAPED_QUOTE.sub('\\\\"', raw.replace("\\'", "'"))
+    try:
+        return json.loads(f'"{raw}"', strict=False)
+    except ValueError:
+        return None
+
+
+def iter_embedded_strings(source):
+    # Yields the string values (not the object keys) of every inline
+    # <script> payload: JSON bootstrap data, JSON-LD and JS object literals.
+    root = _root(source)
+    if root is None or not isinstance(root.tag, str):
+        return
+    for script in root.iter("script"):
+        if script.get("src") or not script.text:
+            continue
+        for match in _STRING_TOKEN.finditer(script.text):
+            double, double_key, single, single_key = match.groups()
+            if double_key or single_key:
+                continue
+            raw = double if double is not None else single
+            if raw and " " in raw:
+                value = _decode(raw, single_quoted=double is None)
+                if value:
+                    yield value
+
+
+def looks_like_prose(text, min_words=8):
+    # True for sentences meant for a reader, false for identifiers, URLs,
+    # CSS classes, code and serialized data
+    words = text.split()
+    if len(words) < min_words or "://" in words[0]:
+        return False
+    if len(_CODE_CHARS.findall(text)) * 20 > len(text):
+        return False
+    alphabetic = sum(1 for word in words if word.strip(".,;:!?()\"'").isalpha())
+    return alphabetic * 10 >= len(words) * 7 and any(c.islower() for c in text)
+
+
+def extract_embedded_text(source, min_words=8):
+    # Policy text shipped inside JSON/JS payloads by JavaScript-rendered
+    # pages, one prose string per line in payload order. Strings holding
+    # HTML fragments are run through extract_text; repeats are dropped.
+    lines = []
+    seen = set()
+    for value in iter_embedded_strings(source):
+        if "<" in value and ">" in value:
+            value = extract_text(value)
+        for line in value.split("\n"):
+            line = _WHITESPACE.sub(" ", line).strip()
+            if line not in seen and looks_like_prose(line, min_words):
+                seen.add(line)
+                lines.append(line)
+    return "\n".join(lines)
+
+
+def extract_page_text(source, max_chars=None, main_content=False):
+    # Visible text, or the embedded payload text when the page is a JS shell
+    # whose markup carries next to nothing. With main_content, only the main
+    # content of the visible text is kept, as by extract_main_text.
+    if main_content:
+        lines, visible_chars = _main_lines(source)
+        text = _join_lines(lines, max_chars)
+    else:
+        text = extract_text(source, max_chars)
+        visible_chars = len(text)
+    if visible_chars < EMBEDDED_FALLBACK_CHARS:
+        embedded = extract_embedded_text(source)
+        if len(embedded) > len(text):
+            text = embedded[:max_chars] if max_chars is not None else embedded
+    return text
+
+
+if __name__ == "__main__":
+    # python -m tosppcrawler.extraction [archive dir] [output.json]
+    # Post-processing pass over the stored HTML of a response archive
+    # (ARCHIVE_MODE = "record"): writes the text the spiders extract with
+    # BOILERPLATE_REMOVAL on for every archived page, as {title, url, text}
+    # records, and reports how much boilerplate was dropped
+    import sys
+
+    from scrapy import Request
+    from scrapy.downloadermiddlewares.httpcompression import HttpCompressionMiddleware
+    from scrapy.http import HtmlResponse
+
+    from tosppcrawler.archive import ResponseArchive, build_response
+
+    archive = ResponseArchive(sys.argv[1] if len(sys.argv) > 1 else "archive")
+    # Archived bodies are stored as they came off the wire, still compressed
+    decompression = HttpCompressionMiddleware()
+    records = []
+    visible_chars = main_chars = 0
+    for meta, body in archive:
+        response = build_response(meta, body, request=Request(meta["url"]))
+        response = decompression.process_response(response.request, response, None)
+        if meta["status"] != 200 or not isinstance(response, HtmlResponse):
+            continue
+        text = extract_page_text(response, main_content=True)
+        visible_chars += len(extract_page_text(response))
+        main_chars += len(text)
+        records.append({"title": response.css("title::text").get(), "url": response.url, "text": text})
+    archive.close()
+
+    output = sys.argv[2] if len(sys.argv) > 2 else "main_text.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    removed = 1 - main_chars / visible_chars if visible_chars else 0
+    print(f"{len(records)} pages written to {output}: {main_chars} of {visible_chars} characters of text kept "
+          f"({removed:.0%} boilerplate removed)")
@@ -0,0 +1,260 @@
+import math
+import re
+from collections import Counter
+
+# Most frequent words of each language, as they occur in running text and
+# in privacy policies and terms, and a sample paragraph of policy prose.
+# The character trigrams (with the word boundaries) of both, weighted by
+# how often they occur, are the language profiles: function words and
+# common endings make up most of any text, so a few hundred characters are
+# enough to tell even close languages (Danish and Norwegian, Spanish and
+# Portuguese) apart without a trained model.
+LANGUAGE_WORDS = {
+    "en": "the of and to a in is that for it as with was on be by you this are or your we not have from at "
+          "an will our any may can if which us such use information other these their they all when",
+    "de": "der die und in den von zu das mit sich des auf für ist im dem nicht ein eine als auch es an werden "
+          "aus er hat dass sie nach wird bei einer um am sind noch wie einem über einen so zum haben nur oder "
+          "aber vor zur bis durch ihre ihnen wir uns unsere ihrer daten",
+    "fr": "de la le et les des en un une du est que pour qui dans par pas sur au plus ne se ce il sont avec ou "
+          "vous nous vos votre nos notre leur aux cette peut être données ces elle",
+    "es": "de la que el en y a los del se las por un para con no una su al es lo como más o pero sus le ha si "
+          "sin sobre este ya entre cuando todo esta ser son también usted datos nuestros nuestra puede",
+    "it": "di e il la che in a per un è del non una le i con si da al dei delle della come alla sono ha più "
+          "lo gli nel anche ma se o questo sua suoi nostri dati può essere questa ai",
+    "pt": "de a o que e do da em um para é com não uma os no se na por mais as dos como mas ao das à seu sua "
+          "ou quando nos já também pelo pela até isso você seus dados nossos podemos",
+    "nl": "de en van het een in is dat op te zijn met voor niet die aan er om ook als bij door maar worden "
+          "wordt uit dan of naar kan hebben deze je u uw wij ons onze gegevens",
+    "sv": "och i att det som en på är av för med till den har de inte om ett men var ni sig från vi så kan "
+          "eller vid dig ditt dina våra oss uppgifter",
+    "da": "og i at det er en til på af for med den de ikke som har vi et kan eller fra om dig din dine vores "
+          "os oplysninger ved skal være",
+    "no": "og i det at på er en til som for av med har de ikke den et om vi kan eller fra deg din dine våre "
+          "oss opplysninger ved skal være",
+    "fi": "ja on ei että se oli hän mutta kun tai myös ovat ole voi kanssa tämä nämä sinun meidän tietoja jos "
+          "vain sekä mukaan kuten",
+    "pl": "i w na z się nie do to że jest o jak a co po przez dla od lub są być ten oraz może twoje nasze "
+          "dane danych jego jej",
+    "cs": "a v se na je že s z do o to k i jako by pro ale jsou nebo být jeho jejich vaše naše údaje osobní "
+          "také podle",
+    "ro": "de și în a la cu pe care nu din o se un ca pentru mai sau este sunt dumneavoastră noastre datele "
+          "prin acest această",
+    "hu": "a az és hogy nem is egy van meg csak de ki el ha mint már vagy be azt ez adatok adatait ön által",
+    "tr": "ve bir bu da de için ile olarak gibi daha çok olan ama en veya sizin bizim kişisel verileri her ne "
+          "kadar",
+    "id": "yang dan di ke dari ini itu untuk dengan tidak dalam akan pada juga ada atau oleh kami anda data "
+          "pribadi dapat kepada",
+    "ru": "и в не на что с по к а из у о это как для от или мы вы ваши наши данные быть может при также его "
+          "их все он она",
+    "uk": "і в не на що з до та у як це для від або ми ви ваші наші дані може при також його їх",
+}
+
+LANGUAGE_SAMPLES = {
+    "en": "This privacy notice explains how we collect, use and share personal information when you visit our "
+          "website or use our products. We process your data only where the law allows it, for example to provide "
+          "the service you asked for, to keep your account secure or to comply with our legal obligations. You have "
+          "the right to access, correct or delete the information we hold about you, and you can contact us at any "
+          "time if you have questions about this notice.",
+    "de": "Diese Datenschutzerklärung beschreibt, wie wir personenbezogene Daten erheben, verwenden und weitergeben, "
+          "wenn Sie unsere Website besuchen oder unsere Produkte nutzen. Wir verarbeiten Ihre Daten nur, soweit dies "
+          "gesetzlich erlaubt ist, zum Beispiel um den von Ihnen gewünschten Dienst bereitzustellen, Ihr Konto zu "
+          "schützen oder unseren rechtlichen Pflichten nachzukommen. Sie haben das Recht auf Auskunft, Berichtigung "
+          "und Löschung der über Sie gespeicherten Informationen und können sich jederzeit an uns wenden.",
+    "fr": "Cette politique de confidentialité explique comment nous collectons, utilisons et partageons les données "
+          "personnelles lorsque vous visitez notre site ou utilisez nos produits. Nous ne traitons vos données que "
+          "lorsque la loi le permet, par exemple pour fournir le service demandé, assurer la sécurité de votre compte "
+          "ou respecter nos obligations légales. Vous avez le droit d'accéder à vos informations, de les rectifier ou "
+          "de les effacer, et vous pouvez nous contacter à tout moment.",
+    "es": "Esta política de privacidad explica cómo recopilamos, utilizamos y compartimos los datos personales cuando "
+          "usted visita nuestro sitio web o utiliza nuestros productos. Solo tratamos sus datos cuando la ley lo "
+          "permite, por ejemplo para prestar el servicio que ha solicitado, proteger su cuenta o cumplir con nuestras "
+          "obligaciones legales. Usted tiene derecho a acceder a la información que conservamos sobre usted, "
+          "rectificarla o suprimirla, y puede ponerse en contacto con nosotros en cualquier momento.",
+    "it": "La presente informativa sulla privacy descrive come raccogliamo, utilizziamo e condividiamo i dati "
+          "personali quando visiti il nostro sito web o utilizzi i nostri prodotti. Trattiamo i tuoi dati soltanto "
+          "quando la legge lo consente, ad esempio per fornire il servizio richiesto, proteggere il tuo account o "
+          "adempiere agli obblighi di legge. Hai il diritto di accedere alle informazioni che conserviamo su di te, di "
+          "rettificarle o di cancellarle, e puoi contattarci in qualsiasi momento per qualunque domanda.",
+    "pt": "Esta política de privacidade explica como recolhemos, utilizamos e partilhamos dados pessoais quando "
+          "visita o nosso site ou utiliza os nossos produtos. Só tratamos os seus dados quando a lei o permite, por "
+          "exemplo para prestar o serviço que pediu, manter a sua conta segura ou cumprir as nossas obrigações "
+          "legais. Tem o direito de aceder às informações que guardamos sobre si, de as corrigir ou de as apagar, e "
+          "pode contactar-nos a qualquer momento. Não vendemos os seus dados e não os partilhamos sem o seu "
+          "consentimento.",
+    "nl": "Deze privacyverklaring legt uit hoe wij persoonsgegevens verzamelen, gebruiken en delen wanneer u onze "
+          "website bezoekt of onze producten gebruikt. Wij verwerken uw gegevens alleen als de wet dat toestaat, "
+          "bijvoorbeeld om de dienst te leveren waar u om hebt gevraagd, uw account te beveiligen of te voldoen aan "
+          "onze wettelijke verplichtingen. U hebt het recht om de gegevens die wij over u bewaren in te zien, te laten "
+          "corrigeren of te laten verwijderen, en u kunt altijd contact met ons opnemen.",
+    "sv": "Denna integritetspolicy förklarar hur vi samlar in, använder och delar personuppgifter när du besöker vår "
+          "webbplats eller använder våra produkter. Vi behandlar dina uppgifter endast när lagen tillåter det, till "
+          "exempel för att tillhandahålla den tjänst du har bett om, skydda ditt konto eller uppfylla våra rättsliga "
+          "skyldigheter. Du har rätt att få tillgång till de uppgifter vi har om dig, att rätta dem eller att radera "
+          "dem, och du kan alltid kontakta oss om du har frågor.",
+    "da": "Denne privatlivspolitik forklarer, hvordan vi indsamler, bruger og deler personoplysninger, når du besøger "
+          "vores hjemmeside eller bruger vores produkter. Vi behandler kun dine oplysninger, når loven tillader det, "
+          "for eksempel for at levere den tjeneste, du har bedt om, beskytte din konto eller overholde vores juridiske "
+          "forpligtelser. Du har ret til at få indsigt i de oplysninger, vi har om dig, og til at få dem rettet eller "
+          "slettet, og du kan altid kontakte os, hvis du har spørgsmål. Vi sælger ikke dine oplysninger til andre.",
+    "no": "Denne personvernerklæringen forklarer hvordan vi samler inn, bruker og deler personopplysninger når du "
+          "besøker nettstedet vårt eller bruker produktene våre. Vi behandler bare opplysningene dine når loven "
+          "tillater det, for eksempel for å levere tjenesten du har bedt om, beskytte kontoen din eller oppfylle våre "
+          "rettslige forpliktelser. Du har rett til innsyn i opplysningene vi har om deg, og til å få dem rettet eller "
+          "slettet, og du kan alltid kontakte oss dersom du har spørsmål. Vi selger ikke opplysningene dine til andre.",
+    "fi": "Tässä tietosuojaselosteessa kerrotaan, miten keräämme, käytämme ja jaamme henkilötietoja, kun vierailet "
+          "verkkosivustollamme tai käytät tuotteitamme. Käsittelemme tietojasi vain silloin, kun laki sen sallii, "
+          "esimerkiksi tarjotaksemme pyytämäsi palvelun, suojataksemme tilisi tai täyttääksemme lakisääteiset "
+          "velvollisuutemme. Sinulla on oikeus tarkastaa sinusta tallennetut tiedot, oikaista ne tai poistaa ne, ja "
+          "voit ottaa meihin yhteyttä milloin tahansa.",
+    "pl": "Niniejsza polityka prywatności wyjaśnia, w jaki sposób zbieramy, wykorzystujemy i udostępniamy dane "
+          "osobowe, gdy odwiedzasz naszą stronę internetową lub korzystasz z naszych produktów. Przetwarzamy Twoje "
+          "dane tylko wtedy, gdy pozwala na to prawo, na przykład aby świadczyć usługę, o którą prosisz, chronić "
+          "Twoje konto lub wypełniać nasze obowiązki prawne. Masz prawo dostępu do informacji, które o Tobie "
+          "przechowujemy, do ich poprawienia lub usunięcia, i możesz skontaktować się z nami w dowolnym momencie.",
+    "cs": "Tyto zásady ochrany osobních údajů vysvětlují, jak shromažďujeme, používáme a sdílíme osobní údaje, když "
+          "navštívíte naše webové stránky nebo používáte naše produkty. Vaše údaje zpracováváme pouze tehdy, když to "
+          "zákon dovoluje, například abychom poskytli službu, o kterou jste požádali, ochránili váš účet nebo splnili "
+          "naše zákonné povinnosti. Máte právo na přístup k údajům, které o vás uchováváme, na jejich opravu nebo "
+          "výmaz a můžete nás kdykoli kontaktovat.",
+    "ro": "Această politică de confidențialitate explică modul în care colectăm, folosim și partajăm datele cu "
+          "caracter personal atunci când vizitați site-ul nostru sau folosiți produsele noastre. Prelucrăm datele "
+          "dumneavoastră numai atunci când legea permite acest lucru, de exemplu pentru a furniza serviciul solicitat, "
+          "pentru a vă proteja contul sau pentru a ne respecta obligațiile legale. Aveți dreptul de a accesa "
+          "informațiile pe care le deținem despre dumneavoastră, de a le rectifica sau de a le șterge.",
+    "hu": "Ez az adatvédelmi tájékoztató elmagyarázza, hogyan gyűjtjük, használjuk és osztjuk meg a személyes "
+          "adatokat, amikor Ön felkeresi weboldalunkat vagy használja termékeinket. Az Ön adatait csak akkor kezeljük, "
+          "ha azt a jogszabály lehetővé teszi, például a kért szolgáltatás nyújtása, fiókja védelme vagy jogi "
+          "kötelezettségeink teljesítése érdekében. Önnek joga van hozzáférni az Önről tárolt információkhoz, kérheti "
+          "azok helyesbítését vagy törlését, és bármikor kapcsolatba léphet velünk.",
+    "tr": "Bu gizlilik politikası, web sitemizi ziyaret ettiğinizde veya ürünlerimizi kullandığınızda kişisel "
+          "verileri nasıl topladığımızı, kullandığımızı ve paylaştığımızı açıklar. Verilerinizi yalnızca yasanın izin "
+          "verdiği durumlarda, örneğin talep ettiğiniz hizmeti sunmak, hesabınızı korumak veya yasal "
+          "yükümlülüklerimizi yerine getirmek için işleriz. Hakkınızda sakladığımız bilgilere erişme, bunları düzeltme "
+          "veya silme hakkına sahipsiniz ve bizimle her zaman iletişime geçebilirsiniz.",
+    "id": "Kebijakan privasi ini menjelaskan bagaimana kami mengumpulkan, menggunakan, dan membagikan data pribadi "
+          "ketika Anda mengunjungi situs web kami atau menggunakan produk kami. Kami hanya memproses data Anda apabila "
+          "diizinkan oleh hukum, misalnya untuk menyediakan layanan yang Anda minta, melindungi akun Anda, atau "
+          "memenuhi kewajiban hukum kami. Anda berhak untuk mengakses informasi yang kami simpan tentang Anda, "
+          "memperbaikinya, atau menghapusnya, dan Anda dapat menghubungi kami kapan saja.",
+    "ru": "Настоящая политика конфиденциальности объясняет, как мы собираем, используем и передаём персональные "
+          "данные, когда вы посещаете наш сайт или пользуетесь нашими продуктами. Мы обрабатываем ваши данные только "
+          "в случаях, разрешённых законом, например чтобы предоставить запрошенную вами услугу, защитить вашу учётную "
+          "запись или выполнить наши юридические обязательства. Вы имеете право получить доступ к информации, которую "
+          "мы храним о вас, исправить или удалить её, и можете связаться с нами в любое время.",
+    "uk": "Ця політика конфіденційності пояснює, як ми збираємо, використовуємо та передаємо персональні дані, коли "
+          "ви відвідуєте наш сайт або користуєтеся нашими продуктами. Ми обробляємо ваші дані лише у випадках, "
+          "дозволених законом, наприклад щоб надати послугу, яку ви замовили, захистити ваш обліковий запис або "
+          "виконати наші юридичні зобов'язання. Ви маєте право отримати доступ до інформації, яку ми зберігаємо про "
+          "вас, виправити або видалити її, і можете зв'язатися з нами будь-коли.",
+}
+
+# Scripts used by a single language (or one dominant one) need no
+# profile. Kana comes before Han, which Japanese text mixes in.
+SCRIPT_LANGUAGES = [
+    ("ja", "\u3040-\u30ff"),
+    ("ko", "\u1100-\u11ff\uac00-\ud7af"),
+    ("zh", "\u4e00-\u9fff"),
+    ("el", "\u0370-\u03ff"),
+    ("he", "\u0590-\u05ff"),
+    ("ar", "\u0600-\u06ff"),
+    ("hi", "\u0900-\u097f"),
+    ("th", "\u0e00-\u0e7f"),
+]
+
+UNDETERMINED = "und"
+# Characters looked at: a window from the middle of the text, away from
+# headers and navigation that may be in another language
+SAMPLE_CHARS = 600
+# Fewer trigrams than this, fewer than MIN_LETTERS of the sample's
+# non-space characters in words, a best profile scoring less than
+# MIN_WEIGHT per trigram, or one less than MIN_MARGIN times ahead of the
+# runner-up (as with serialized data and code) leaves the language
+# undetermined
+MIN_TRIGRAMS = 20
+MIN_LETTERS = 0.7
+MIN_WEIGHT = 10
+MIN_MARGIN = 1.1
+# A trigram's weight in a profile is WEIGHT_SCALE times the log of how much
+# more often than WEIGHT_FLOOR it occurs in the language's text, at most
+# _MAX_WEIGHT; rarer trigrams weigh nothing
+WEIGHT_SCALE = 8
+WEIGHT_FLOOR = 1e-4
+_MAX_WEIGHT = 63
+# Bits per language in a packed score, see _build_profiles
+_SLOT_BITS = 20
+
+_WORD = re.compile(r"[^\W\d_]+")
+_SCRIPTS = [(language, re.compile(f"[{ranges}]")) for language, ranges in SCRIPT_LANGUAGES]
+_OTHER_SCRIPT = re.compile("[" + "".join(ranges for _, ranges in SCRIPT_LANGUAGES) + "]")
+_SPACE = re.compile(r"\s")
+
+
+def _trigrams(words):
+    for word in words:
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+
+def _build_profiles():
+    # Trigram -> an integer holding its weight for every language in that
+    # language's slot. Adding up these integers scores a text for all
+    # languages at once, one addition per trigram; a slot of _SLOT_BITS
+    # cannot overflow on a SAMPLE_CHARS sample.
+    profiles = {}
+    for slot, (language, words) in enumerate(LANGUAGE_WORDS.items()):
+        text = f"{words} {LANGUAGE_SAMPLES.get(language, '')}".lower()
+        counts = Counter(_trigrams(_WORD.findall(text)))
+        total = sum(counts.values())
+        for trigram, count in counts.items():
+            weight = min(round(WEIGHT_SCALE * math.log(count / total / WEIGHT_FLOOR)), _MAX_WEIGHT)
+            if weight > 0:
+                profiles[trigram] = profiles.get(trigram, 0) + (weight << (slot * _SLOT_BITS))
+    return profiles
+
+
+_PROFILES = _build_profiles()
+
+
+def _sample(text):
+    start = max(len(text) - SAMPLE_CHARS, 0) // 2
+    return text[start:start + SAMPLE_CHARS]
+
+
+def detect_language(text):
+    # ISO 639-1 code of the language of text, or "und" when it is too short
+    # or not close enough to any profile
+    if not text:
+        return UNDETERMINED
+    sample = _sample(text).lower()
+    if _OTHER_SCRIPT.search(sample):
+        letters = sum(len(word) for word in _WORD.findall(sample))
+        for language, script in _SCRIPTS:
+            if len(script.findall(sample)) * 2 > letters:
+                return language
+
+    # A word has as many padded trigrams as letters; each distinct word is
+    # split into trigrams once
+    words = Counter(_WORD.findall(sample))
+    total = sum(len(word) * count for word, count in words.items())
+    if total < MIN_TRIGRAMS or total < MIN_LETTERS * len(_SPACE.sub("", sample)):
+        return UNDETERMINED
+    packed = 0
+    for word, count in words.items():
+        padded = f" {word} "
+        for i in range(len(word)):
+            packed += _PROFILES.get(padded[i:i + 3], 0) * count
+    mask = (1 << _SLOT_BITS) - 1
+    scores = sorted(
+        ((packed >> (slot * _SLOT_BITS)) & mask, language) for slot, language in enumerate(LANGUAGE_WORDS)
+    )
+    (runner_up, _), (score, language) = scores[-2:]
+    if score < total * MIN_WEIGHT or score < runner_up * MIN_MARGIN:
+        return UNDETERMINED
+    return language
+
+
+def english_or_unknown(language):
+    # True when English-only analysis (punkt, taggers, VADER, TextBlob) is
+    # worth running: English text, or text too short to tell
+    return language in (None, "en", UNDETERMINED)
@@ -3,11 +3,18 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import sqlite3
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from tosppcrawler.fingerprints import UnchangedContent
+from tosppcrawler.sharding import ShardedStore
+from tosppcrawler.writer import BatchedWriter, writer_options
+
 
 class TosppcrawlerSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -57,38 +64,110 @@ class TosppcrawlerSpiderMiddleware:
 
 
 class TosppcrawlerDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    # Conditional-GET recrawl cache. The ETag/Last-Modified validators of
+    # every page we fetch are kept in SQLite and replayed on the next run as
+    # If-None-Match/If-Modified-Since, so a policy that has not changed comes
+    # back as a bodyless 304 and is dropped before parse() and the pipelines.
+    #
+    # Validators are only saved once the page's item has been stored (or
+    # dropped as unchanged, so already stored). A page whose parse or
+    # pipelines failed is fetched in full next time instead of answering
+    # 304 on every later crawl and never being extracted again. Replaying
+    # the response archive neither sends nor saves validators.
+    #
+    # Lookups run on the reactor; saved validators are written in batches
+    # by a BatchedWriter thread (see writer.py), which spider_closed waits
+    # for. With SQLITE_SHARDS above one, validators are kept in the shard
+    # file of their URL's site, next to its items.
+
+    def __init__(self, db_path, stats=None, writer_options=None):
+        self.db_path = db_path
+        self.stats = stats
+        self.writer_options = writer_options or {}
+        self.connections = None
+        self.writer = None
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if crawler.settings.get("ARCHIVE_MODE") == "replay":
+            raise NotConfigured
+        s = cls(
+            crawler.settings.get("VALIDATOR_CACHE_DB", "tospp_data.db"),
+            crawler.stats,
+            writer_options(crawler.settings),
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(s.item_dropped, signal=signals.item_dropped)
         return s
 
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+        if self.connections is None or request.meta.get("dont_validate"):
+            return None
+
+        row = self.connections.shard(request.url).execute(
+            "SELECT etag, last_modified FROM http_validators WHERE url = ?",
+            (request.url,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        etag, last_modified = row
+        if etag:
+            request.headers.setdefault(b"If-None-Match", etag)
+        if last_modified:
+            request.headers.setdefault(b"If-Modified-Since", last_modified)
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        if self.connections is None:
+            return response
+
+        if response.status == 304 and (
+            b"If-None-Match" in request.headers or b"If-Modified-Since" in request.headers
+        ):
+            if self.stats is not None:
+                self.stats.inc_value("validator_cache/not_modified", spider=spider)
+            raise IgnoreRequest(f"Not modified since last crawl: {request.url}")
+
+        if response.status == 200:
+            etag = response.headers.get(b"ETag")
+            last_modified = response.headers.get(b"Last-Modified")
+            if etag or last_modified:
+                # Kept with the request until its item is stored
+                request.meta["http_validators"] = (
+                    etag.decode("latin-1") if etag else None,
+                    last_modified.decode("latin-1") if last_modified else None,
+                )
         return response
 
+    def item_scraped(self, item, response, spider):
+        self.save_validators(response, spider)
+
+    def item_dropped(self, item, response, exception, spider):
+        # An unchanged page is stored as it is
+        if isinstance(exception, UnchangedContent):
+            self.save_validators(response, spider)
+
+    def save_validators(self, response, spider):
+        validators = response.meta.pop("http_validators", None)
+        if self.writer is None or validators is None:
+            return None
+        url = response.request.url
+        d = self.writer.submit(url, (url,) + validators)
+        d.addCallbacks(self._saved, self._not_saved, callbackArgs=(spider,), errbackArgs=(url, spider))
+        return d
+
+    def _saved(self, row, spider):
+        if self.stats is not None:
+            self.stats.inc_value("validator_cache/stored", spider=spider)
+
+    def _not_saved(self, failure, url, spider):
+        # The page is fetched in full next time
+        spider.logger.error("Could not save the validators of %s: %s", url, failure.getErrorMessage())
+
     def process_exception(self, request, exception, spider):
         # Called when a download handler or a process_request()
         # (from other downloader middleware) raises an exception.
@@ -99,5 +178,47 @@ class TosppcrawlerDownloaderMiddleware:
         # - return a Request object: stops process_exception() chain
         pass
 
+    @staticmethod
+    def _connect(db_path):
+        connection = sqlite3.connect(db_path)
+        # Lookups are not blocked while the writer thread commits
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS http_validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT
+            )
+        ''')
+        connection.commit()
+        return connection
+
+    @staticmethod
+    def _write(connection, rows):
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO http_validators (url, etag, last_modified) VALUES (?, ?, ?)", rows
+            )
+
     def spider_opened(self, spider):
+        self.connections = ShardedStore(
+            self.db_path, self.writer_options.get("shard_count", 1), self._connect, lambda row: row[0]
+        )
+        self.writer = BatchedWriter(
+            self.db_path,
+            self._connect,
+            self._write,
+            lambda connection: connection.close(),
+            name="validator-writer",
+            **self.writer_options,
+        )
         spider.logger.info("Spider opened: %s" % spider.name)
+        return self.writer.start()
+
+    def spider_closed(self, spider):
+        if self.connections is None:
+            return None
+        self.connections.close()
+        self.connections = None
+        writer, self.writer = self.writer, None
+        return writer.close()
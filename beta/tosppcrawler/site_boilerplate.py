@@ -0,0 +1,371 @@
+import hashlib
+import json
+import math
+import re
+import sqlite3
+from array import array
+from collections import Counter
+
+from tosppcrawler.sharding import ShardedStore, registrable_domain, shard_index
+
+# A line is boilerplate for a site once it is on at least MIN_PAGES of the
+# site's pages and on at least MIN_SHARE of them
+MIN_PAGES = 3
+MIN_SHARE = 0.5
+# Boilerplate lines up to this long (menus, headers, copyright lines) are
+# stripped wherever they are; longer ones only in a run of boilerplate at
+# the top or bottom of a page, where cookie notices and footers sit
+MAX_LINE_CHARS = 80
+# A page sharing this much of its lines (Jaccard) with a page already
+# counted for its site, like a locale variant of one policy, is not counted
+NEAR_DUPLICATE = 0.8
+# Near-duplicates are looked up through one-permutation MinHash: a page's
+# line hashes are spread over SIGNATURE_SIZE bins and each bin keeps its
+# smallest hash. The signature is cut into bands of BAND_ROWS bins, and
+# only pages sharing a band are compared line by line: at most
+# MAX_CANDIDATES per band are looked up, and of those the MAX_CANDIDATES
+# sharing the most bands are compared. With 8 bands of 3 a page at the
+# threshold shares a band with its duplicate 99.7% of the time.
+SIGNATURE_SIZE = 24
+BAND_ROWS = 3
+MAX_CANDIDATES = 20
+# A page that stripping would leave with less than this share of its
+# characters is kept as it is
+MIN_KEPT = 0.5
+
+_WHITESPACE = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+
+def _hash(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big", signed=True)
+
+
+def _bands(hashes):
+    # (band, bucket) pairs of a page's MinHash signature; none for a page
+    # without lines. An empty bin borrows the value of the next full one,
+    # marked with its distance so the two do not look alike.
+    if not hashes:
+        return []
+    bins = [None] * SIGNATURE_SIZE
+    for h in hashes:
+        i = h % SIGNATURE_SIZE
+        if bins[i] is None or h < bins[i]:
+            bins[i] = h
+    signature = array("q")
+    for i in range(SIGNATURE_SIZE):
+        distance = 0
+        while bins[(i + distance) % SIGNATURE_SIZE] is None:
+            distance += 1
+        signature.append(bins[(i + distance) % SIGNATURE_SIZE] ^ distance)
+    return [
+        (band, _hash(signature[band * BAND_ROWS:(band + 1) * BAND_ROWS].tobytes()))
+        for band in range(SIGNATURE_SIZE // BAND_ROWS)
+    ]
+
+
+def line_hash(line):
+    # 64-bit hash of a line with case, spacing and numbers normalized, so
+    # "(c) 2023" and "(C) 2024" footers count as the same line; None for
+    # blank lines
+    normalized = _DIGITS.sub("0", _WHITESPACE.sub(" ", line).strip().lower())
+    if not normalized:
+        return None
+    return _hash(normalized.encode("utf-8"))
+
+
+class SiteBoilerplate:
+    # Lines (one per block, as extraction.py writes them) that recur across
+    # the pages of a site: headers, footers, cookie notices and menus that
+    # per-page extraction kept. For every registrable domain site_lines
+    # counts the pages each line hash is on. A page is a distinct set of
+    # lines: URLs serving the same page share one site_pages row, counted
+    # by reference, so mirrors and duplicate URLs of one policy do not make
+    # its own lines look repeated. site_urls remembers the page of every
+    # URL, so a re-crawled URL replaces its old counts instead of adding to
+    # them. Counts are updated one page at a time, so new pages are
+    # stripped on ingest without a pass over the corpus.
+    #
+    # Near-identical pages (locale variants, reprints of one policy) share
+    # their body, not just their chrome: a page close to one already counted
+    # is kept in site_pages with counted = 0 and adds nothing to site_lines,
+    # so the body lines of a policy never reach the threshold through its
+    # variants. site_bands indexes the MinHash bands of counted pages, so
+    # finding the pages to compare a new one with costs the same on a site
+    # of ten pages as on one of ten thousand. strip() is conservative on top of that: long lines are only
+    # stripped at the edges of a page, and a page that would lose most of
+    # its text is not stripped at all.
+
+    def __init__(self, db_path, min_pages=MIN_PAGES, min_share=MIN_SHARE):
+        self.min_pages = min_pages
+        self.min_share = min_share
+        self.connection = sqlite3.connect(db_path)
+        indexed = self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'site_bands'").fetchone()
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS site_urls (
+                url TEXT PRIMARY KEY,
+                domain TEXT,
+                page_hash INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS site_pages (
+                domain TEXT,
+                page_hash INTEGER,
+                urls INTEGER,
+                line_hashes BLOB,
+                counted INTEGER DEFAULT 1,
+                PRIMARY KEY (domain, page_hash)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS site_bands (
+                domain TEXT,
+                band INTEGER,
+                bucket INTEGER,
+                page_hash INTEGER,
+                PRIMARY KEY (domain, band, bucket, page_hash)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS site_lines (
+                domain TEXT,
+                line_hash INTEGER,
+                pages INTEGER,
+                PRIMARY KEY (domain, line_hash)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS site_lines_pages ON site_lines (domain, pages);
+        ''')
+        # Pages counted before near-duplicates were told apart all count
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(site_pages)")]
+        if "counted" not in columns:
+            self.connection.execute("ALTER TABLE site_pages ADD COLUMN counted INTEGER DEFAULT 1")
+        if not indexed:
+            # Index the pages counted before bands were kept
+            pages = self.connection.execute(
+                "SELECT domain, page_hash, line_hashes FROM site_pages WHERE counted"
+            ).fetchall()
+            for domain, page_hash, blob in pages:
+                self._index_page(domain, page_hash, _bands(array("q", blob)))
+        self.connection.commit()
+        # Boilerplate line hashes per domain, dropped when the domain's
+        # counts change, and the number of counted pages per domain, kept
+        # in step with site_pages
+        self.cache = {}
+        self.pages = {}
+
+    def is_observed(self, url):
+        return self.connection.execute("SELECT 1 FROM site_urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def _index_page(self, domain, page_hash, bands):
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO site_bands (domain, band, bucket, page_hash) VALUES (?, ?, ?, ?)",
+            ((domain, band, bucket, page_hash) for band, bucket in bands),
+        )
+
+    def _near_duplicate(self, domain, hashes, bands):
+        # True when a page counted for domain shares NEAR_DUPLICATE of its
+        # lines with hashes. Only pages sharing a band are compared.
+        if not bands:
+            return False
+        lines = set(hashes)
+        shared_bands = Counter()
+        for band, bucket in bands:
+            shared_bands.update(row[0] for row in self.connection.execute(
+                "SELECT page_hash FROM site_bands WHERE domain = ? AND band = ? AND bucket = ? LIMIT ?",
+                (domain, band, bucket, MAX_CANDIDATES),
+            ))
+        for page_hash, _ in shared_bands.most_common(MAX_CANDIDATES):
+            (blob,) = self.connection.execute(
+                "SELECT line_hashes FROM site_pages WHERE domain = ? AND page_hash = ?", (domain, page_hash)
+            ).fetchone()
+            other = array("q", blob)
+            shared = len(lines.intersection(other))
+            if shared and shared >= NEAR_DUPLICATE * (len(lines) + len(other) - shared):
+                return True
+        return False
+
+    def _counted_pages(self, domain):
+        pages = self.pages.get(domain)
+        if pages is None:
+            (pages,) = self.connection.execute(
+                "SELECT COUNT(*) FROM site_pages WHERE domain = ? AND counted", (domain,)
+            ).fetchone()
+            self.pages[domain] = pages
+        return pages
+
+    def _add_page(self, domain, page_hash, hashes):
+        updated = self.connection.execute(
+            "UPDATE site_pages SET urls = urls + 1 WHERE domain = ? AND page_hash = ?", (domain, page_hash)
+        ).rowcount
+        if updated:
+            return
+        bands = _bands(hashes)
+        counted = not self._near_duplicate(domain, hashes, bands)
+        pages = self._counted_pages(domain)
+        self.connection.execute(
+            "INSERT INTO site_pages (domain, page_hash, urls, line_hashes, counted) VALUES (?, ?, 1, ?, ?)",
+            (domain, page_hash, hashes.tobytes(), counted),
+        )
+        if not counted:
+            return
+        self.pages[domain] = pages + 1
+        self._index_page(domain, page_hash, bands)
+        self.connection.executemany(
+            "INSERT INTO site_lines (domain, line_hash, pages) VALUES (?, ?, 1) "
+            "ON CONFLICT (domain, line_hash) DO UPDATE SET pages = pages + 1",
+            ((domain, h) for h in hashes),
+        )
+
+    def _remove_page(self, domain, page_hash):
+        self.connection.execute(
+            "UPDATE site_pages SET urls = urls - 1 WHERE domain = ? AND page_hash = ?", (domain, page_hash)
+        )
+        row = self.connection.execute(
+            "SELECT line_hashes, counted FROM site_pages WHERE domain = ? AND page_hash = ? AND urls <= 0",
+            (domain, page_hash),
+        ).fetchone()
+        if row is None:
+            return
+        pages = self._counted_pages(domain)
+        self.connection.execute("DELETE FROM site_pages WHERE domain = ? AND page_hash = ?", (domain, page_hash))
+        if not row[1]:
+            return
+        self.pages[domain] = pages - 1
+        hashes = array("q", row[0])
+        self.connection.executemany(
+            "DELETE FROM site_bands WHERE domain = ? AND band = ? AND bucket = ? AND page_hash = ?",
+            ((domain, band, bucket, page_hash) for band, bucket in _bands(hashes)),
+        )
+        self.connection.executemany(
+            "UPDATE site_lines SET pages = pages - 1 WHERE domain = ? AND line_hash = ?",
+            ((domain, h) for h in hashes),
+        )
+        self.connection.execute("DELETE FROM site_lines WHERE domain = ? AND pages <= 0", (domain,))
+
+    def observe(self, url, text):
+        # Counts the lines of a page's (unstripped) text for its site
+        with self.connection:
+            self._observe(url, text)
+
+    def _observe(self, url, text):
+        hashes = {line_hash(line) for line in (text or "").split("\n")}
+        hashes.discard(None)
+        hashes = array("q", sorted(hashes))
+        page_hash = _hash(hashes.tobytes())
+        row = self.connection.execute("SELECT domain, page_hash FROM site_urls WHERE url = ?", (url,)).fetchone()
+        if row is not None and row[1] == page_hash:
+            return
+        domain = registrable_domain(url)
+        if row is not None:
+            self._remove_page(*row)
+            self.cache.pop(row[0], None)
+        self._add_page(domain, page_hash, hashes)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO site_urls (url, domain, page_hash) VALUES (?, ?, ?)",
+            (url, domain, page_hash),
+        )
+        self.cache.pop(domain, None)
+
+    def boilerplate(self, domain):
+        # Hashes of the lines that are boilerplate on domain
+        lines = self.cache.get(domain)
+        if lines is None:
+            threshold = max(self.min_pages, math.ceil(self.min_share * self._counted_pages(domain)))
+            lines = self.cache[domain] = frozenset(row[0] for row in self.connection.execute(
+                "SELECT line_hash FROM site_lines WHERE domain = ? AND pages >= ?", (domain, threshold)
+            ))
+        return lines
+
+    def strip(self, url, text):
+        # text without the lines that are boilerplate on url's site: short
+        # ones anywhere, long ones in the runs at the top and bottom. Blank
+        # lines go with the runs they are in.
+        lines = self.boilerplate(registrable_domain(url))
+        if not lines or not text:
+            return text
+        split = text.split("\n")
+        hashes = [line_hash(line) for line in split]
+        body = [i for i, h in enumerate(hashes) if h is not None and h not in lines]
+        if not body:
+            return text
+        first, last = body[0], body[-1]
+        stripped = "\n".join(
+            line for i, (line, h) in enumerate(zip(split, hashes))
+            if first <= i <= last and (h not in lines or len(line.strip()) > MAX_LINE_CHARS)
+        )
+        if len(stripped) < MIN_KEPT * len(text):
+            return text
+        return stripped
+
+    def ingest(self, url, text):
+        # Counts a newly crawled page, then strips it
+        self.observe(url, text)
+        return self.strip(url, text)
+
+    def ingest_many(self, pages):
+        # ingest() for a batch of (url, text) pairs in one transaction, so a
+        # crawl commits once per batch; returns the stripped texts in order
+        try:
+            with self.connection:
+                stripped = []
+                for url, text in pages:
+                    self._observe(url, text)
+                    stripped.append(self.strip(url, text))
+        except Exception:
+            # Boilerplate and page counts cached from counts that were
+            # rolled back
+            self.cache.clear()
+            self.pages.clear()
+            raise
+        return stripped
+
+    def strip_many(self, pages):
+        # Bulk pass over (url, text) pairs: pages not counted yet are counted
+        # first, so pages stored before their site's boilerplate was known
+        # are stripped too. Yields (url, stripped text) in order.
+        pages = list(pages)
+        for url, text in pages:
+            if not self.is_observed(url):
+                self.observe(url, text)
+        for url, text in pages:
+            yield url, self.strip(url, text)
+
+    def stats(self):
+        # (sites, pages, boilerplate lines) across all sites
+        domains = [row[0] for row in self.connection.execute("SELECT DISTINCT domain FROM site_pages")]
+        (pages,) = self.connection.execute("SELECT COUNT(*) FROM site_urls").fetchone()
+        return len(domains), pages, sum(len(self.boilerplate(domain)) for domain in domains)
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    # python -m tosppcrawler.site_boilerplate records.json [output.json] [state db] [shards]
+    # Strips cross-page boilerplate from a JSON export of {url, text}
+    # records (a feed export or output.json) in bulk before analysis. The
+    # line counts live in the state db (the crawl database by default,
+    # spread over SQLITE_SHARDS files when the crawl was sharded), so the
+    # pages the crawl already counted are not counted twice.
+    import sys
+
+    source = sys.argv[1] if len(sys.argv) > 1 else "output.json"
+    output = sys.argv[2] if len(sys.argv) > 2 else source
+    shard_count = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    store = ShardedStore(
+        sys.argv[3] if len(sys.argv) > 3 else "tospp_data.db", shard_count, SiteBoilerplate, lambda page: page[0]
+    )
+    with open(source, "r", encoding="utf-8") as f:
+        records = json.load(f)
+
+    before = sum(len(record.get("text") or "") for record in records)
+    shards = {}
+    for record in records:
+        shards.setdefault(shard_index(record["url"], shard_count), []).append(record)
+    for index, group in shards.items():
+        pages = [(record["url"], record.get("text") or "") for record in group]
+        for record, (_, text) in zip(group, store.shards[index].strip_many(pages)):
+            record["text"] = text
+    after = sum(len(record["text"]) for record in records)
+    sites, counted, lines = (sum(values) for values in zip(*(shard.stats() for shard in store.shards)))
+    store.close()
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    print(f"{len(records)} records written to {output}: {before - after} of {before} characters were lines "
+          f"repeated across a site ({lines} boilerplate lines over {sites} sites, {counted} pages counted)")
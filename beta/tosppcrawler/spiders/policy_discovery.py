@@ -0,0 +1,108 @@
+import re
+from urllib.parse import urlparse
+
+import scrapy
+
+from tosppcrawler.spiders.tos_spider import TosSpiderSpider
+from tosppcrawler.url_feed import StartUrlFeed
+
+# (pattern, weight) pairs scored against the anchor text and the link URL
+TEXT_FEATURES = [
+    (re.compile(r"privacy", re.I), 5),
+    (re.compile(r"terms|conditions", re.I), 5),
+    (re.compile(r"\blegal\b", re.I), 3),
+    (re.compile(r"polic(y|ies)", re.I), 2),
+    (re.compile(r"cookie", re.I), 1),
+]
+URL_FEATURES = [
+    (re.compile(r"privacy", re.I), 4),
+    (re.compile(r"terms|\btos\b|conditions", re.I), 4),
+    (re.compile(r"legal", re.I), 2),
+    (re.compile(r"polic(y|ies)", re.I), 2),
+]
+FOOTER_XPATH = (
+    "boolean(ancestor::footer or ancestor::*[contains(@id, 'footer') "
+    "or contains(@class, 'footer') or @role = 'contentinfo'])"
+)
+
+
+class PolicyDiscoverySpider(TosSpiderSpider):
+    # Finds ToS/privacy pages starting from bare domains instead of a fixed
+    # list of policy URLs. Every homepage link is scored on its text, URL
+    # and whether it sits in the footer, and only the best few links per
+    # domain are followed, so a domain costs at most 1 + max_policy_pages
+    # requests. Policy pages are parsed exactly like TosSpiderSpider does.
+    #
+    #   scrapy crawl policy_discovery -a domains=duckduckgo.com,mozilla.org
+    #   scrapy crawl policy_discovery -a domains_file=domains.txt
+    #   scrapy crawl policy_discovery -a domains_db=seeds.db -a urls_table=domains -a urls_column=domain
+
+    name = "policy_discovery"
+    allowed_domains = []
+    start_urls = []
+    custom_settings = {"DEPTH_LIMIT": 1}
+
+    max_policy_pages = 3
+    min_link_score = 5
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # -a arguments arrive as strings
+        self.max_policy_pages = int(self.max_policy_pages)
+        self.min_link_score = int(self.min_link_score)
+
+    def start_requests(self):
+        for domain in getattr(self, "domains", "").split(","):
+            if domain.strip():
+                yield self.homepage_request(domain.strip().lower())
+
+        # Large domain lists are streamed with a resumable cursor
+        feed = StartUrlFeed.from_spider(self, path_arg="domains_file", db_arg="domains_db")
+        if feed is not None:
+            for position, domain in feed:
+                yield feed.request(self.homepage_request(domain.lower()), position)
+
+    def homepage_request(self, domain):
+        return scrapy.Request(
+            f"https://{domain}/",
+            callback=self.parse_homepage,
+            cb_kwargs={"domain": domain},
+        )
+
+    def parse_homepage(self, response, domain):
+        candidates = self.score_links(response)
+        budget = self.max_policy_pages
+        for score, url in candidates[:budget]:
+            self.logger.debug("Following %s for %s (score %d)", url, domain, score)
+            yield scrapy.Request(url, callback=self.parse)
+        self.crawler.stats.inc_value("policy_discovery/domains")
+        self.crawler.stats.inc_value("policy_discovery/candidates_followed", min(len(candidates), budget))
+        if not candidates:
+            self.crawler.stats.inc_value("policy_discovery/domains_without_candidates")
+
+    def score_links(self, response):
+        # Returns (score, url) pairs above min_link_score, best first, one
+        # entry per URL.
+        anchors = response.xpath("//a[@href]")
+        best = {}
+        for position, anchor in enumerate(anchors):
+            href = anchor.attrib["href"].strip()
+            if href.startswith(("#", "mailto:", "javascript:", "tel:")):
+                continue
+            url = response.urljoin(href).split("#", 1)[0]
+            if urlparse(url).scheme not in ("http", "https"):
+                continue
+
+            text = " ".join(anchor.xpath(".//text() | @title | @aria-label").getall())
+            score = sum(weight for pattern, weight in TEXT_FEATURES if pattern.search(text))
+            score += sum(weight for pattern, weight in URL_FEATURES if pattern.search(url))
+            if not score:
+                continue
+            if anchor.xpath(FOOTER_XPATH).get() == "1":
+                score += 3
+            # Legal links live near the end of the page, nav links near the top
+            score += 2 * position // max(len(anchors), 1)
+
+            if score >= self.min_link_score and score > best.get(url, 0):
+                best[url] = score
+        return sorted(((score, url) for url, score in best.items()), reverse=True)
@@ -0,0 +1,154 @@
+# Latency-aware per-domain crawl-rate controller
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
+
+import logging
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveThrottleMiddleware:
+    # AIMD controller for each download slot (one slot per host). A healthy
+    # response first shortens the host's delay and then adds one to its
+    # concurrency; a slow response, a throttling status or a download error
+    # halves the concurrency, and doubles the delay once concurrency is
+    # already down to one. Concurrency only grows while the sum over all
+    # hosts is under the global budget, so the capacity a slow host gives
+    # back is picked up by the fast ones. A host is backed off at most once
+    # per round trip, so one burst of slow responses counts as one signal.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_THROTTLE_ENABLED"):
+            raise NotConfigured
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.budget = settings.getint("ADAPTIVE_THROTTLE_BUDGET") or settings.getint("CONCURRENT_REQUESTS")
+        self.max_concurrency = settings.getint("ADAPTIVE_THROTTLE_MAX_CONCURRENCY", 8)
+        self.target_latency = settings.getfloat("ADAPTIVE_THROTTLE_TARGET_LATENCY", 2.0)
+        self.min_delay = settings.getfloat("DOWNLOAD_DELAY")
+        self.max_delay = settings.getfloat("ADAPTIVE_THROTTLE_MAX_DELAY", 60.0)
+        self.backoff_codes = set(int(code) for code in settings.getlist("ADAPTIVE_THROTTLE_BACKOFF_HTTP_CODES", [429, 503]))
+        self.debug = settings.getbool("ADAPTIVE_THROTTLE_DEBUG")
+
+        # slot key -> [latency moving average, concurrency, delay, last backoff]
+        self.domains = {}
+        self.allocated = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_response(self, request, response, spider):
+        latency = request.meta.get("download_latency")
+        if latency is None or request.meta.get("dont_throttle"):
+            return response
+
+        if response.status in self.backoff_codes:
+            self.stats.inc_value("adaptive_throttle/backoff_status", spider=spider)
+            self._decrease(request, spider, latency)
+        elif self._record_latency(request, latency) > self.target_latency:
+            self._decrease(request, spider, latency)
+        else:
+            self._increase(request, spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not request.meta.get("dont_throttle"):
+            self.stats.inc_value("adaptive_throttle/errors", spider=spider)
+            self._decrease(request, spider, self.target_latency)
+        return None
+
+    def spider_closed(self, spider):
+        self.stats.set_value("adaptive_throttle/domains", len(self.domains), spider=spider)
+        self.stats.set_value("adaptive_throttle/allocated_concurrency", self.allocated, spider=spider)
+
+    def _slot(self, request):
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return key, None, None
+
+        state = self.domains.get(key)
+        if state is None:
+            state = self.domains[key] = [0.0, slot.concurrency, slot.delay, 0.0]
+            self.allocated += slot.concurrency
+        elif (slot.concurrency, slot.delay) != (state[1], state[2]):
+            # The downloader drops idle slots and recreates them with the
+            # default settings, so reapply what we had learned for the host.
+            slot.concurrency, slot.delay = state[1], state[2]
+        return key, slot, state
+
+    def _has_budget(self):
+        if self.allocated < self.budget:
+            return True
+        # Hosts we are done with still count against the budget until their
+        # idle slots are collected, so recount over the live slots only.
+        slots = self.crawler.engine.downloader.slots
+        self.allocated = sum(state[1] for key, state in self.domains.items() if key in slots)
+        return self.allocated < self.budget
+
+    def _record_latency(self, request, latency):
+        key, slot, state = self._slot(request)
+        if state is None:
+            return latency
+        state[0] = latency if not state[0] else 0.7 * state[0] + 0.3 * latency
+        return state[0]
+
+    def _increase(self, request, spider):
+        key, slot, state = self._slot(request)
+        if slot is None:
+            return
+
+        if state[2] > self.min_delay:
+            state[2] = max(self.min_delay, state[2] * 0.5)
+            if state[2] < 0.05:
+                state[2] = self.min_delay
+        elif state[1] < self.max_concurrency and self._has_budget():
+            state[1] += 1
+            self.allocated += 1
+        else:
+            return
+
+        slot.concurrency, slot.delay = state[1], state[2]
+        self.stats.inc_value("adaptive_throttle/increase", spider=spider)
+        self.stats.max_value("adaptive_throttle/max_domain_concurrency", state[1], spider=spider)
+        self._log(key, state, "increase", spider)
+
+    def _decrease(self, request, spider, latency):
+        key, slot, state = self._slot(request)
+        if slot is None:
+            return
+
+        now = time.monotonic()
+        if now - state[3] < max(state[0], latency):
+            return
+        state[3] = now
+
+        if state[1] > 1:
+            halved = max(1, state[1] // 2)
+            self.allocated -= state[1] - halved
+            state[1] = halved
+        else:
+            state[2] = min(self.max_delay, max(state[2] * 2, latency, 0.1))
+
+        slot.concurrency, slot.delay = state[1], state[2]
+        self.stats.inc_value("adaptive_throttle/decrease", spider=spider)
+        self.stats.max_value("adaptive_throttle/max_domain_delay", state[2], spider=spider)
+        self._log(key, state, "decrease", spider)
+
+    def _log(self, key, state, decision, spider):
+        if self.debug:
+            logger.info(
+                "%s %s: latency %.3fs, concurrency %d, delay %.2fs, allocated %d/%d",
+                decision, key, state[0], state[1], state[2], self.allocated, self.budget,
+                extra={"spider": spider},
+            )
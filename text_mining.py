@@ -5,7 +5,11 @@ from collections import Counter
 def load_text():
     conn = sqlite3.connect("tosppcrawler/tospp_data.db")
     cursor = conn.cursor()
-    cursor.execute("SELECT text FROM tos_data")
+    try:
+        # tos_texts reads texts back from the deduplicated blob store
+        cursor.execute("SELECT text FROM tos_texts")
+    except sqlite3.OperationalError:
+        cursor.execute("SELECT text FROM tos_data")
     text_data = cursor.fetchall()
     conn.close()
     return ' '.join([row[0] for row in text_data])
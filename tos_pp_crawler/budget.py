@@ -0,0 +1,198 @@
+# Response byte budgets: per response, per domain and for the whole crawl
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
+
+import logging
+import re
+import sqlite3
+import time
+import weakref
+
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured, StopDownload
+from scrapy.http import TextResponse
+from scrapy.utils.httpobj import urlparse_cached
+
+from tos_pp_crawler.writer import BatchedWriter, writer_options
+
+logger = logging.getLogger(__name__)
+
+# Closing tags a truncated page may be cut after without splitting a block
+BLOCK_END = re.compile(
+    rb"</(?:p|div|li|ul|ol|dl|dd|section|article|table|tr|h[1-6]|blockquote|pre|main)\s*>",
+    re.I,
+)
+
+
+class ByteBudgetMiddleware:
+    # Bounds how many body bytes a single response, a single domain and the
+    # whole crawl may download. Bytes are counted as they arrive, and the
+    # download is stopped as soon as a limit is passed, so an oversized SPA
+    # shell is never fetched, buffered and decoded in full.
+    #
+    # With BYTE_BUDGET_TRUNCATE (the default) a response over its limit is
+    # kept up to the last block-level closing tag received and flagged
+    # "truncated": its download stops with the chunk that passes the limit.
+    # Otherwise it is dropped, and a Content-Length over the limit stops it
+    # before the first body byte. Once a domain has spent its budget its
+    # remaining requests are ignored, and once the crawl has spent the
+    # global budget the spider is closed. Every URL that hit a limit is
+    # recorded in the byte_budget_hits table, written in batches by a
+    # BatchedWriter thread (see writer.py) and, with SQLITE_SHARDS above
+    # one, in the shard file of the URL's site.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.response_limit = settings.getint("BYTE_BUDGET_RESPONSE")
+        self.domain_limit = settings.getint("BYTE_BUDGET_DOMAIN")
+        self.total_limit = settings.getint("BYTE_BUDGET_TOTAL")
+        if not (self.response_limit or self.domain_limit or self.total_limit):
+            raise NotConfigured
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.truncate = settings.getbool("BYTE_BUDGET_TRUNCATE", True)
+        self.db_path = settings.get("BYTE_BUDGET_DB", "tos_pp.db")
+        self.writer_options = writer_options(settings)
+        if settings.get("ARCHIVE_MODE") == "replay":
+            # Limits still apply to replayed bodies, but the hits are not
+            # mixed into those of real crawls
+            self.db_path = ":memory:"
+            self.writer_options["shard_count"] = 1
+        self.received = weakref.WeakKeyDictionary()
+        self.domains = {}
+        self.total = 0
+        self.closing = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(s.bytes_received, signal=signals.bytes_received)
+        return s
+
+    @staticmethod
+    def _connect(db_path):
+        conn = sqlite3.connect(db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS byte_budget_hits (
+                url TEXT,
+                domain TEXT,
+                limit_hit TEXT,
+                bytes INTEGER,
+                action TEXT,
+                recorded_at REAL
+            )
+        ''')
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _write(conn, rows):
+        with conn:
+            conn.executemany(
+                "INSERT INTO byte_budget_hits (url, domain, limit_hit, bytes, action, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def spider_opened(self, spider):
+        self.writer = BatchedWriter(
+            self.db_path,
+            self._connect,
+            self._write,
+            lambda conn: conn.close(),
+            name="byte-budget-writer",
+            **self.writer_options,
+        )
+        return self.writer.start()
+
+    def spider_closed(self, spider):
+        self.stats.set_value("byte_budget/total_bytes", self.total, spider=spider)
+        return self.writer.close()
+
+    def process_request(self, request, spider):
+        domain = urlparse_cached(request).hostname
+        if self.domain_limit and self.domains.get(domain, 0) >= self.domain_limit:
+            self.stats.inc_value("byte_budget/domain_exhausted_ignored", spider=spider)
+            raise IgnoreRequest(f"Byte budget for {domain} is spent: {request.url}")
+        return None
+
+    def headers_received(self, headers, body_length, request, spider):
+        # Content-Length is known up front: no need to download a body that
+        # would be dropped anyway. A body to be truncated is downloaded up to
+        # the limit and stopped in bytes_received.
+        limit = self._response_limit(request)
+        if limit and not self.truncate and body_length > limit:
+            self._record(request, "response", body_length, "aborted")
+            raise StopDownload(fail=True)
+
+    def bytes_received(self, data, request, spider):
+        size = self.received.get(request, 0) + len(data)
+        self.received[request] = size
+        domain = urlparse_cached(request).hostname
+        self.domains[domain] = self.domains.get(domain, 0) + len(data)
+        self.total += len(data)
+
+        limit = self._response_limit(request)
+        if limit and size > limit:
+            hit = "response"
+        elif self.domain_limit and self.domains[domain] > self.domain_limit:
+            hit = "domain"
+        elif self.total_limit and self.total > self.total_limit:
+            hit = "total"
+            self._close_spider(spider)
+        else:
+            return
+
+        self._record(request, hit, size, "truncated" if self.truncate else "aborted")
+        raise StopDownload(fail=not self.truncate)
+
+    def process_response(self, request, response, spider):
+        # Scrapy delivers a stopped download with the bytes received so far;
+        # cut it back to the last complete block so the parser never sees
+        # half a paragraph. Runs after HttpCompressionMiddleware, so the body
+        # is already decoded, and a small gzip body that inflated past the
+        # limit is cut here too.
+        if not isinstance(response, TextResponse):
+            return response
+        body = response.body
+        if "download_stopped" not in response.flags:
+            limit = self._response_limit(request)
+            if not limit or len(body) <= limit:
+                return response
+            self._record(request, "response", len(body), "truncated" if self.truncate else "aborted")
+            if not self.truncate:
+                raise IgnoreRequest(f"Decoded body over the byte budget: {request.url}")
+            body = body[:limit]
+
+        end = None
+        for end in BLOCK_END.finditer(body):
+            pass
+        self.stats.inc_value("byte_budget/truncated", spider=spider)
+        if end is not None:
+            body = body[:end.end()]
+        return response.replace(body=body, flags=response.flags + ["truncated"])
+
+    def _response_limit(self, request):
+        # A request can raise or lower its own limit with meta["byte_budget"]
+        return request.meta.get("byte_budget", self.response_limit)
+
+    def _record(self, request, hit, size, action):
+        logger.warning("%s hit the %s byte budget after %d bytes (%s)", request.url, hit, size, action)
+        self.stats.inc_value(f"byte_budget/{hit}_limit_hits")
+        d = self.writer.submit(
+            request.url,
+            (request.url, urlparse_cached(request).hostname, hit, size, action, time.time()),
+        )
+        d.addErrback(lambda failure: logger.error(
+            "Could not record the byte budget hit of %s: %s", request.url, failure.getErrorMessage()
+        ))
+
+    def _close_spider(self, spider):
+        if not self.closing:
+            self.closing = True
+            self.crawler.engine.close_spider(spider, "byte_budget_exhausted")
@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from twisted.internet import defer, reactor
+
+from tos_pp_crawler.language import english_or_unknown
+from tos_pp_crawler.text_utils import get_sentiment
+from tos_pp_crawler.writer import EnginePause
+
+
+def enrich_texts(texts, english=None):
+    # Runs in a worker process: text statistics and TextBlob sentiment for a
+    # batch of documents. TextBlob only knows English, so texts flagged as
+    # not English in `english` get no sentiment scores.
+    results = []
+    for index, text in enumerate(texts):
+        result = {'word_count': len(text.split()), 'char_count': len(text), 'polarity': None, 'subjectivity': None}
+        if english is None or english[index]:
+            sentiment = get_sentiment(text)
+            result['polarity'] = sentiment['polarity']  # Sentiment between -1 (negative) and 1 (positive)
+            result['subjectivity'] = sentiment['subjectivity']  # 0 (objective) to 1 (subjective)
+        results.append(result)
+    return results
+
+
+class EnrichmentPipeline:
+    # Computes word/char counts and sentiment in a process pool instead of
+    # on the reactor thread, so scoring a long policy never stalls the
+    # downloads in flight. Items are sent to the pool in batches of
+    # ENRICHMENT_BATCH_SIZE (or whatever arrived within ENRICHMENT_MAX_WAIT
+    # seconds) and process_item returns a Deferred that fires once its batch
+    # is scored. When more batches are queued than the workers can keep up
+    # with, the engine is paused until the pool catches up; the pause is
+    # shared with the database writers through EnginePause.
+
+    def __init__(self, crawler, workers, batch_size, max_wait):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.buffer = []
+        self.flush_call = None
+        self.in_flight = 0
+        self.paused = False
+        self.idle = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler,
+            settings.getint('ENRICHMENT_WORKERS') or os.cpu_count() or 1,
+            settings.getint('ENRICHMENT_BATCH_SIZE', 16),
+            settings.getfloat('ENRICHMENT_MAX_WAIT', 0.5),
+        )
+
+    def open_spider(self, spider):
+        # spawn rather than fork: the crawler process is multi-threaded.
+        # Workers re-import __main__, so scripts driving a CrawlerProcess
+        # need an `if __name__ == "__main__":` guard (`scrapy crawl` has one).
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def process_item(self, item, spider):
+        d = defer.Deferred()
+        self.buffer.append((item, d))
+        if len(self.buffer) >= self.batch_size:
+            self._flush()
+        elif self.flush_call is None:
+            self.flush_call = reactor.callLater(self.max_wait, self._flush)
+        return d
+
+    def _flush(self):
+        if self.flush_call is not None and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        if not self.buffer:
+            return
+
+        batch, self.buffer = self.buffer, []
+        texts = [item.get('full_text', item.get('text')) or '' for item, _ in batch]
+        # Items tagged by LanguagePipeline as not English skip sentiment
+        english = [english_or_unknown(item.get('language')) for item, _ in batch]
+        future = self.pool.submit(enrich_texts, texts, english)
+        self.in_flight += 1
+        self.stats.inc_value('enrichment/batches')
+        future.add_done_callback(lambda f: reactor.callFromThread(self._scored, batch, f))
+
+        if not self.paused and self.in_flight > 2 * self.workers:
+            self.paused = True
+            self.stats.inc_value('enrichment/backpressure_pauses')
+            EnginePause.of(self.crawler).hold(self)
+
+    def _scored(self, batch, future):
+        self.in_flight -= 1
+        if self.paused and self.in_flight <= self.workers:
+            self.paused = False
+            EnginePause.of(self.crawler).release(self)
+
+        error = future.exception()
+        if error is not None:
+            for _, d in batch:
+                d.errback(error)
+        else:
+            for (item, d), result in zip(batch, future.result()):
+                item.update(result)
+                d.callback(item)
+            self.stats.inc_value('enrichment/items', len(batch))
+
+        if not self.in_flight and not self.buffer:
+            idle, self.idle = self.idle, []
+            for d in idle:
+                d.callback(None)
+
+    def close_spider(self, spider):
+        # Score whatever is still buffered and wait for the pool to drain
+        self._flush()
+        if self.in_flight:
+            d = defer.Deferred()
+            self.idle.append(d)
+            d.addBoth(lambda _: self.pool.shutdown())
+            return d
+        self.pool.shutdown()
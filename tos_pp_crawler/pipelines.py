@@ -1,28 +1,263 @@
-import sqlite3
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+
+from tos_pp_crawler.fingerprints import FingerprintStore, UnchangedContent, content_fingerprint
+from tos_pp_crawler.language import UNDETERMINED, detect_language
+from tos_pp_crawler.site_boilerplate import MIN_PAGES, MIN_SHARE, SiteBoilerplate
+from tos_pp_crawler.sharding import ShardedStore
+from tos_pp_crawler.storage import PolicyStore
+from tos_pp_crawler.writer import BatchedWriter, writer_options
+
+
+def open_store(db_path='tos_pp.db', shard_count=1):
+    # Read/write access to every stored policy, across shards
+    return ShardedStore(db_path, shard_count, PolicyStore, lambda item: item['url'])
+
 
 class SQLitePipeline:
+    # Stores every policy with its compressed full text (see storage.py).
+    # Items are buffered and written in one transaction once
+    # SQLITE_BATCH_SIZE of them are waiting or SQLITE_FLUSH_INTERVAL seconds
+    # after the first arrived. Compression and writes run on a
+    # BatchedWriter thread (see writer.py), so disk latency never stalls
+    # the reactor.
+    #
+    # process_item returns a Deferred that fires once the item is committed
+    # and fails with the database error otherwise. When more than
+    # SQLITE_WRITER_QUEUE batches are waiting for the writer the engine is
+    # paused until it has caught up. close_spider waits for everything
+    # buffered to be written.
+    #
+    # With SQLITE_SHARDS above one, policies are spread by registrable
+    # domain over that many database files (see sharding.py), each with its
+    # own writer thread; open_store() reads them back as one store.
+
+    def __init__(self, db_path='tos_pp.db', batch_size=100, flush_interval=1.0, queue_size=4, crawler=None,
+                 shard_count=1):
+        self.db_path = db_path
+        self.shard_count = shard_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get('SQLITE_DB', 'tos_pp.db'),
+            settings.getint('SQLITE_BATCH_SIZE', 100),
+            settings.getfloat('SQLITE_FLUSH_INTERVAL', 1.0),
+            settings.getint('SQLITE_WRITER_QUEUE', 4),
+            crawler,
+            settings.getint('SQLITE_SHARDS', 1),
+        )
+
+    def open_spider(self, spider):
+        # One writer thread per shard file, so shards are written in parallel
+        self.writer = BatchedWriter(
+            self.db_path,
+            PolicyStore,
+            lambda store, items: store.save_many(items),
+            lambda store: store.close(),
+            shard_count=self.shard_count,
+            batch_size=self.batch_size,
+            flush_interval=self.flush_interval,
+            queue_size=self.queue_size,
+            name='policy-writer',
+            crawler=self.crawler,
+            stats_prefix='sqlite',
+        )
+        return self.writer.start()
+
+    def close_spider(self, spider):
+        return self.writer.close()
+
+    def pending(self):
+        # Batches the most loaded writer still has to write
+        return self.writer.pending()
+
+    def process_item(self, item, spider):
+        return self.writer.submit(item['url'], item)
+
+    def flush(self):
+        self.writer.flush()
+
+
+class ContentFingerprintPipeline:
+    # Drops items whose normalized text is identical to what was crawled
+    # from the same URL last time, before any later pipeline rewrites them.
+    # A new fingerprint is only recorded once its item has made it through
+    # every pipeline (item_scraped): an item whose storage failed is
+    # processed again on the next crawl instead of being dropped as
+    # unchanged for good. Not used when replaying the response archive, so
+    # every archived page goes through the pipelines again.
+    #
+    # Lookups run on the reactor; new fingerprints are written in batches
+    # by a BatchedWriter thread (see writer.py), and close_spider waits for
+    # them. With SQLITE_SHARDS above one, fingerprints are kept in the
+    # shard file of their URL's site, next to its items.
+
+    def __init__(self, db_path, stats, writer_options=None):
+        self.db_path = db_path
+        self.stats = stats
+        self.writer_options = writer_options or {}
+        # URL -> fingerprint of items still in the later pipelines
+        self.pending = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.get('ARCHIVE_MODE') == 'replay':
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('FINGERPRINT_DB', 'tos_pp.db'),
+            crawler.stats,
+            writer_options(crawler.settings),
+        )
+        crawler.signals.connect(pipeline.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(pipeline.item_failed, signal=signals.item_dropped)
+        crawler.signals.connect(pipeline.item_failed, signal=signals.item_error)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.store = ShardedStore(
+            self.db_path, self.writer_options.get('shard_count', 1), FingerprintStore, lambda row: row[0]
+        )
+        self.writer = BatchedWriter(
+            self.db_path,
+            FingerprintStore,
+            lambda store, rows: store.update_many(rows),
+            lambda store: store.close(),
+            name='fingerprint-writer',
+            **self.writer_options,
+        )
+        return self.writer.start()
+
+    def close_spider(self, spider):
+        d = self.writer.close()
+        d.addBoth(lambda _: self.store.close())
+        return d
+
+    def process_item(self, item, spider):
+        fingerprint = item.get('fingerprint') or content_fingerprint(item.get('full_text', item.get('text')))
+        if self.store.shard(item['url']).is_unchanged(item['url'], fingerprint):
+            self.stats.inc_value('fingerprint/unchanged', spider=spider)
+            raise UnchangedContent(f"Content unchanged since last crawl: {item['url']}")
+        self.pending[item['url']] = fingerprint
+        self.stats.inc_value('fingerprint/changed', spider=spider)
+        return item
+
+    def item_scraped(self, item, response, spider):
+        fingerprint = self.pending.pop(item.get('url'), None)
+        if fingerprint is not None:
+            d = self.writer.submit(item['url'], (item['url'], fingerprint))
+            d.addErrback(self._not_written, item['url'], spider)
+
+    def item_failed(self, item, response, spider, **kwargs):
+        self.pending.pop(item.get('url'), None)
+
+    def _not_written(self, failure, url, spider):
+        # The page is only processed again next time
+        spider.logger.error("Could not record the fingerprint of %s: %s", url, failure.getErrorMessage())
+
+
+class SiteBoilerplatePipeline:
+    # Strips the lines a page shares with most other pages of its site
+    # (see site_boilerplate.py). Runs after ContentFingerprintPipeline, so
+    # fingerprints stay those of the page as crawled, and the line counts
+    # are kept from the unstripped text.
+    #
+    # Counting a page is a write, so pages are counted and stripped in
+    # batches on a BatchedWriter thread: process_item returns a Deferred
+    # that fires with the stripped item once its batch is committed.
+    # Replayed pages are stripped on the reactor with the counts from
+    # crawling and not counted again. With SQLITE_SHARDS above one, the
+    # counts of a site are kept in the shard file of its registrable domain.
+
+    def __init__(self, db_path, stats, min_pages=MIN_PAGES, min_share=MIN_SHARE, persist=True,
+                 writer_options=None):
+        self.db_path = db_path
+        self.stats = stats
+        self.min_pages = min_pages
+        self.min_share = min_share
+        self.persist = persist
+        self.writer_options = writer_options or {}
+        self.site_lines = None
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get('SITE_BOILERPLATE_DB', 'tos_pp.db'),
+            crawler.stats,
+            settings.getint('SITE_BOILERPLATE_MIN_PAGES', MIN_PAGES),
+            settings.getfloat('SITE_BOILERPLATE_MIN_SHARE', MIN_SHARE),
+            persist=settings.get('ARCHIVE_MODE') != 'replay',
+            writer_options=writer_options(settings),
+        )
+
+    def _open(self, path):
+        return SiteBoilerplate(path, self.min_pages, self.min_share)
+
     def open_spider(self, spider):
-        self.conn = sqlite3.connect('tos_pp.db')
-        self.cur = self.conn.cursor()
-        self.cur.execute('''
-            CREATE TABLE IF NOT EXISTS policies(
-                url TEXT PRIMARY KEY,
-                text TEXT,
-                word_count INTEGER,
-                char_count INTEGER,
-                polarity REAL,
-                subjectivity REAL
+        if not self.persist:
+            self.site_lines = ShardedStore(
+                self.db_path, self.writer_options.get('shard_count', 1), self._open, lambda page: page[0]
             )
-        ''')
-        self.conn.commit()
+            return None
+        self.writer = BatchedWriter(
+            self.db_path,
+            self._open,
+            lambda site_lines, pages: site_lines.ingest_many(pages),
+            lambda site_lines: site_lines.close(),
+            name='site-lines-writer',
+            **self.writer_options,
+        )
+        return self.writer.start()
 
     def close_spider(self, spider):
-        self.conn.close()
+        if self.writer is not None:
+            return self.writer.close()
+        self.site_lines.close()
+        return None
+
+    def process_item(self, item, spider):
+        full_text = item.get('full_text')
+        if not full_text:
+            return item
+        if self.writer is None:
+            stripped = self.site_lines.shard(item['url']).strip(item['url'], full_text)
+            return self._stripped(stripped, item, full_text, spider)
+        d = self.writer.submit(item['url'], (item['url'], full_text))
+        d.addCallback(self._stripped, item, full_text, spider)
+        return d
+
+    def _stripped(self, stripped, item, full_text, spider):
+        item['full_text'] = stripped
+        # The stored excerpt is cut from the stripped text
+        item['text'] = stripped[:len(item.get('text') or '')]
+        self.stats.inc_value('site_boilerplate/chars_removed', len(full_text) - len(stripped), spider=spider)
+        return item
+
+
+class LanguagePipeline:
+    # Tags every item with the language of its text (see language.py), so
+    # later stages can route it. With LANGUAGE_FILTER set, items detected in
+    # any other language are dropped; text too short to tell is kept.
+
+    def __init__(self, stats, languages=()):
+        self.stats = stats
+        self.languages = frozenset(languages)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats, crawler.settings.getlist('LANGUAGE_FILTER'))
 
     def process_item(self, item, spider):
-        self.cur.execute('''
-            INSERT OR REPLACE INTO policies (url, text, word_count, char_count)
-            VALUES (?, ?, ?, ?)
-        ''', (item['url'], item['text'], item['word_count'], item['char_count']))
-        self.conn.commit()
-        return item
\ No newline at end of file
+        language = detect_language(item.get('full_text', item.get('text')) or '')
+        item['language'] = language
+        self.stats.inc_value(f'language/{language}', spider=spider)
+        if self.languages and language != UNDETERMINED and language not in self.languages:
+            raise DropItem(f"Text in {language}, not in LANGUAGE_FILTER: {item['url']}")
+        return item
@@ -13,14 +13,23 @@ SPIDER_MODULES = ["tos_pp_crawler.spiders"]
 NEWSPIDER_MODULE = "tos_pp_crawler.spiders"
 
 
+# Start URLs passed as -a urls_file=... or -a urls_db=... are read lazily in
+# batches of this size, with the resume cursor kept in FEED_CURSOR_DB
+FEED_BATCH_SIZE = 1000
+FEED_CURSOR_DB = "tos_pp.db"
+
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 #USER_AGENT = "tos_pp_crawler (+http://www.yourdomain.com)"
 
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
-# Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+# Configure maximum concurrent requests performed by Scrapy (default: 16).
+# This is also the global budget the adaptive throttle shares between hosts.
+CONCURRENT_REQUESTS = 64
+# Concurrency every new host starts at; the adaptive throttle raises or
+# lowers it per host from there
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -50,9 +59,16 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "tos_pp_crawler.middlewares.TosPpCrawlerDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "tos_pp_crawler.middlewares.TosPpCrawlerDownloaderMiddleware": 543,
+    "tos_pp_crawler.throttle.AdaptiveThrottleMiddleware": 560,
+    "tos_pp_crawler.budget.ByteBudgetMiddleware": 570,
+    "tos_pp_crawler.archive.ArchiveRecorderMiddleware": 950,
+}
+
+# SQLite file holding the ETag/Last-Modified validators used for conditional
+# GETs on recrawl. Pages answering 304 Not Modified are not parsed again.
+VALIDATOR_CACHE_DB = "tos_pp.db"
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -79,6 +95,32 @@ ROBOTSTXT_OBEY = True
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
+# Per-domain AIMD crawl-rate controller (see throttle.py), used instead of
+# AutoThrottle. Hosts grow from CONCURRENT_REQUESTS_PER_DOMAIN up to the max
+# concurrency while their average latency stays under the target, and back
+# off on slow responses, errors and the status codes below.
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 8
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 2.0
+ADAPTIVE_THROTTLE_MAX_DELAY = 60
+ADAPTIVE_THROTTLE_BACKOFF_HTTP_CODES = [429, 503]
+#ADAPTIVE_THROTTLE_DEBUG = False
+# Hand out requests for the least busy hosts first, so a backed-off host's
+# queue cannot fill the global budget
+SCHEDULER_PRIORITY_QUEUE = "scrapy.pqueues.DownloaderAwarePriorityQueue"
+
+# Byte budgets (see budget.py). A response's download stops once it passes
+# BYTE_BUDGET_RESPONSE bytes and the page is cut at the last complete block
+# (dropped instead when BYTE_BUDGET_TRUNCATE is False, before the download
+# when Content-Length is over the limit); a domain stops being crawled after
+# BYTE_BUDGET_DOMAIN bytes and the whole crawl after BYTE_BUDGET_TOTAL. 0
+# disables a limit. URLs that hit a limit are listed in BYTE_BUDGET_DB.
+BYTE_BUDGET_RESPONSE = 2 * 1024 * 1024
+BYTE_BUDGET_DOMAIN = 64 * 1024 * 1024
+BYTE_BUDGET_TOTAL = 0
+BYTE_BUDGET_TRUNCATE = True
+BYTE_BUDGET_DB = "tos_pp.db"
+
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 #HTTPCACHE_ENABLED = True
@@ -87,9 +129,95 @@ ROBOTSTXT_OBEY = True
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Remember fetched requests across runs in mmap'd Bloom filters (see
+# dupefilter.py). A URL is fetched again once DUPEFILTER_TTL seconds have
+# passed; DUPEFILTER_MEMORY_MB is split over the rotating generations and
+# sized for DUPEFILTER_CAPACITY fingerprints per TTL window. Static start
+# URLs are never filtered. Start URLs from a URL feed are fetched once per
+# run and again once DUPEFILTER_SEED_TTL seconds have passed, so a URL
+# repeated in a feed costs one request while a daily recrawl still reaches
+# the validator cache and the content fingerprints; their filters are sized
+# by DUPEFILTER_SEED_MEMORY_MB and DUPEFILTER_SEED_CAPACITY.
+DUPEFILTER_CLASS = "tos_pp_crawler.dupefilter.PersistentDupeFilter"
+DUPEFILTER_DIR = "dupefilter"
+DUPEFILTER_TTL = 7 * 24 * 3600
+DUPEFILTER_GENERATIONS = 4
+DUPEFILTER_MEMORY_MB = 64
+DUPEFILTER_CAPACITY = 50_000_000
+DUPEFILTER_SEED_TTL = 12 * 3600
+DUPEFILTER_SEED_MEMORY_MB = 16
+DUPEFILTER_SEED_CAPACITY = 10_000_000
+
+# Record-and-replay response archive (see archive.py). Crawl once with
+# -s ARCHIVE_MODE=record to store every raw response under ARCHIVE_DIR, then
+# use -s ARCHIVE_MODE=replay to re-run parse() and the pipelines over the
+# archive with no network access. A replay leaves the state of real crawls
+# alone: no dupefilter, validators, fingerprints or feed cursors are read or
+# written, site line counts are only read and byte budget hits not kept.
+ARCHIVE_MODE = None
+ARCHIVE_DIR = "archive"
+DOWNLOAD_HANDLERS = {
+    "http": "tos_pp_crawler.archive.ArchiveDownloadHandler",
+    "https": "tos_pp_crawler.archive.ArchiveDownloadHandler",
+}
+
+# Keep only the main content of each page (see extraction.py): blocks are
+# scored by text and link density, and navigation, cookie banners, footers
+# and link lists are dropped before the text reaches the pipelines.
+BOILERPLATE_REMOVAL = True
+
 # Set settings whose default value is deprecated to a future-proof value
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
 ITEM_PIPELINES = {
+   'tos_pp_crawler.pipelines.ContentFingerprintPipeline': 200,
+   'tos_pp_crawler.pipelines.SiteBoilerplatePipeline': 220,
+   'tos_pp_crawler.pipelines.LanguagePipeline': 230,
+   'tos_pp_crawler.enrichment.EnrichmentPipeline': 250,
    'tos_pp_crawler.pipelines.SQLitePipeline': 300,
-}
\ No newline at end of file
+}
+
+# SQLite file holding the last content fingerprint of every crawled URL.
+# Unchanged policies are skipped before sentiment scoring and storage.
+FINGERPRINT_DB = 'tos_pp.db'
+
+# Lines repeated across the pages of a site (headers, footers, cookie
+# notices) are stripped on ingest by SiteBoilerplatePipeline (see
+# site_boilerplate.py): a line is dropped once it is on at least
+# SITE_BOILERPLATE_MIN_PAGES of its site's pages and on at least
+# SITE_BOILERPLATE_MIN_SHARE of them. Near-duplicate pages (locale
+# variants of one policy) are counted once, long lines are only dropped at
+# the top or bottom of a page, and a page that would lose most of its text
+# is kept whole. Line counts per site are kept in SITE_BOILERPLATE_DB.
+SITE_BOILERPLATE_DB = 'tos_pp.db'
+SITE_BOILERPLATE_MIN_PAGES = 3
+SITE_BOILERPLATE_MIN_SHARE = 0.5
+
+# Every item is tagged with the language of its text by LanguagePipeline
+# (see language.py). Items detected in a language missing from
+# LANGUAGE_FILTER are dropped; an empty list keeps them all.
+LANGUAGE_FILTER = []
+
+# SQLitePipeline writes items in batches of SQLITE_BATCH_SIZE, one
+# transaction each, or SQLITE_FLUSH_INTERVAL seconds after the first item of
+# a partial batch arrived. The writes run on a background thread; the crawl
+# is paused while more than SQLITE_WRITER_QUEUE batches wait for it. New
+# fingerprints, validators, site line counts and archive records are
+# batched the same way, each on a writer thread of its own.
+SQLITE_DB = 'tos_pp.db'
+SQLITE_BATCH_SIZE = 100
+SQLITE_FLUSH_INTERVAL = 1.0
+SQLITE_WRITER_QUEUE = 4
+# Spread rows over this many database files by registrable domain, so
+# crawler processes working on different sites never wait on one write lock.
+# Read them back with open_store(SQLITE_DB, SQLITE_SHARDS). Fingerprints,
+# validators, site line counts and byte budget hits are sharded the same
+# way, and feed cursors by feed name; the response archive is not.
+SQLITE_SHARDS = 1
+
+# Sentiment and text statistics run in a pool of ENRICHMENT_WORKERS processes
+# (default: one per CPU) in batches of ENRICHMENT_BATCH_SIZE items. A partial
+# batch is sent after ENRICHMENT_MAX_WAIT seconds.
+#ENRICHMENT_WORKERS = 4
+ENRICHMENT_BATCH_SIZE = 16
+ENRICHMENT_MAX_WAIT = 0.5
@@ -0,0 +1,81 @@
+import heapq
+import os
+import zlib
+from urllib.parse import urlparse
+
+import tldextract
+
+# Bundled public suffix list only: routing must not depend on the network
+_extract = tldextract.TLDExtract(suffix_list_urls=())
+
+
+def registrable_domain(url):
+    # "privacy.microsoft.com" -> "microsoft.com"; IP addresses and local
+    # hosts are returned as they are
+    parts = _extract(url)
+    if parts.domain and parts.suffix:
+        return f"{parts.domain}.{parts.suffix}"
+    return urlparse(url).hostname or ""
+
+
+def shard_index(url, shard_count):
+    # Stable across processes and runs, unlike hash()
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(registrable_domain(url).encode("utf-8")) % shard_count
+
+
+def shard_paths(db_path, shard_count):
+    # One shard keeps the plain db_path; more give tos_pp.shard0-of-4.db,
+    # tos_pp.shard1-of-4.db, ...
+    if shard_count <= 1:
+        return [db_path]
+    base, ext = os.path.splitext(db_path)
+    return [f"{base}.shard{i}-of-{shard_count}{ext}" for i in range(shard_count)]
+
+
+class ShardedStore:
+    # Spreads a store over shard_count SQLite files by registrable domain,
+    # so every page of a site lands in the same file and crawler processes
+    # working on different sites write to different files instead of
+    # queueing on one database lock. open_store(path) opens the store for a
+    # shard and url_of(row) gives the URL of a row handed to save_many().
+    #
+    # URL lookups go straight to the owning shard; search() asks every
+    # shard and merges their results by score. FTS5 scores each shard with
+    # its own term statistics, so the merged order is a close approximation
+    # of searching one combined index.
+
+    def __init__(self, db_path, shard_count, open_store, url_of):
+        self.shard_count = shard_count
+        self.url_of = url_of
+        self.shards = [open_store(path) for path in shard_paths(db_path, shard_count)]
+
+    def shard(self, url):
+        return self.shards[shard_index(url, self.shard_count)]
+
+    def save_many(self, rows):
+        # One transaction per shard touched
+        groups = {}
+        for row in rows:
+            groups.setdefault(shard_index(self.url_of(row), self.shard_count), []).append(row)
+        for index, group in groups.items():
+            self.shards[index].save_many(group)
+
+    def get_full_text(self, url):
+        return self.shard(url).get_full_text(url)
+
+    def versions(self, url):
+        return self.shard(url).versions(url)
+
+    def get_version(self, url, version):
+        return self.shard(url).get_version(url, version)
+
+    def search(self, query, limit=10):
+        # Rows end with their score, lower is better
+        results = (shard.search(query, limit) for shard in self.shards)
+        return heapq.nsmallest(limit, (row for rows in results for row in rows), key=lambda row: row[-1])
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
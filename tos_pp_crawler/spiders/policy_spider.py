@@ -1,5 +1,7 @@
 import scrapy
-from tos_pp_crawler.text_utils import get_sentiment
+from tos_pp_crawler.extraction import extract_page_text
+from tos_pp_crawler.fingerprints import content_fingerprint
+from tos_pp_crawler.url_feed import StartUrlFeed
 
 class PolicySpider(scrapy.Spider):
     name = "policy_spider"
@@ -9,18 +11,30 @@ class PolicySpider(scrapy.Spider):
         "https://privacy.microsoft.com/"
     ]
 
+    def start_requests(self):
+        # Stream seeds from -a urls_file=... / -a urls_db=... when given,
+        # otherwise crawl the static start_urls above
+        feed = StartUrlFeed.from_spider(self)
+        if feed is None:
+            yield from super().start_requests()
+            return
+        for position, url in feed:
+            yield feed.request(scrapy.Request(url, callback=self.parse), position)
+
     def parse(self, response):
-        # Extract all text from the page
-        full_text = " ".join(response.css("body::text").getall()).strip()
-        
-        # Calculate text statistics and sentiment
-        sentiment = get_sentiment(full_text)
-        
+        # Extract all visible text from the page, skipping scripts and styles
+        # (or the embedded JSON text if the page is rendered by JavaScript),
+        # and only its main content with BOILERPLATE_REMOVAL on
+        full_text = extract_page_text(
+            response, main_content=self.settings.getbool("BOILERPLATE_REMOVAL"),
+        )
+
+        # Text statistics and sentiment are added by EnrichmentPipeline in a
+        # worker process, after ContentFingerprintPipeline has dropped
+        # policies that did not change since the last crawl
         yield {
             'url': response.url,
             'text': full_text[:500],  # First 500 characters
-            'word_count': len(full_text.split()),
-            'char_count': len(full_text),
-            'polarity': sentiment['polarity'],  # Sentiment between -1 (negative) and 1 (positive)
-            'subjectivity': sentiment['subjectivity']  # 0 (objective) to 1 (subjective)
+            'full_text': full_text,
+            'fingerprint': content_fingerprint(full_text)  # Of the full text, not the stored excerpt
         }
\ No newline at end of file
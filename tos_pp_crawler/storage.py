@@ -0,0 +1,277 @@
+import re
+import sqlite3
+import sys
+import time
+import zlib
+from collections import Counter
+
+from tos_pp_crawler.versions import VersionHistory
+
+# zlib looks back at most 32 KiB, so a longer preset dictionary is wasted
+DICTIONARY_SIZE = 32 * 1024
+_SENTENCE = re.compile(r"[^.!?\n]+[.!?]?")
+
+
+def compress_text(text, dictionary=None):
+    # zlib at the highest level; policies are written once and read rarely
+    if dictionary:
+        compressor = zlib.compressobj(9, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(9)
+    return compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+def decompress_text(blob, dictionary=None):
+    if dictionary:
+        decompressor = zlib.decompressobj(zdict=dictionary)
+    else:
+        decompressor = zlib.decompressobj()
+    return (decompressor.decompress(blob) + decompressor.flush()).decode("utf-8")
+
+
+def train_dictionary(texts, size=DICTIONARY_SIZE):
+    # Builds a zlib preset dictionary out of the sentences that recur across
+    # documents ("We may share your information with...", "These Terms are
+    # governed by..."). Sentences are ranked by how many bytes they would
+    # save over the sample and the best ones go last, closest to the data,
+    # where zlib encodes matches most cheaply.
+    document_frequency = Counter()
+    for text in texts:
+        sentences = set(match.strip() for match in _SENTENCE.findall(text))
+        document_frequency.update(s for s in sentences if len(s) >= 20)
+
+    ranked = sorted(
+        (count * len(sentence), sentence)
+        for sentence, count in document_frequency.items() if count > 1
+    )
+    chosen = []
+    total = 0
+    for _, sentence in reversed(ranked):
+        encoded = sentence.encode("utf-8") + b" "
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(chosen))
+
+
+class PolicyStore:
+    # Access to the policies table. The whole extracted text of a policy is
+    # kept zlib-compressed in the full_text BLOB (text only holds the first
+    # 500 characters for quick inspection); get_full_text and
+    # iter_full_texts decompress it transparently. A preset dictionary
+    # trained on the stored corpus can be added with train_dictionary();
+    # rows remember which dictionary compressed them, so older rows stay
+    # readable after retraining.
+    #
+    # Only the latest version of a policy is stored in full. When a recrawl
+    # brings a different text, the one it replaces goes to VersionHistory
+    # as a reverse delta; versions() lists them and get_version() rebuilds
+    # any of them.
+
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL only syncs at checkpoints and stays crash-safe
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS policies(
+                url TEXT PRIMARY KEY,
+                text TEXT,
+                word_count INTEGER,
+                char_count INTEGER,
+                polarity REAL,
+                subjectivity REAL
+            )
+        ''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS compression_dictionaries (
+                id INTEGER PRIMARY KEY,
+                dictionary BLOB,
+                created_at REAL
+            )
+        ''')
+        # Databases created before full texts were stored lack the columns
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(policies)")]
+        if "full_text" not in columns:
+            self.connection.execute("ALTER TABLE policies ADD COLUMN full_text BLOB")
+            self.connection.execute("ALTER TABLE policies ADD COLUMN dictionary_id INTEGER")
+        if "crawled_at" not in columns:
+            self.connection.execute("ALTER TABLE policies ADD COLUMN crawled_at REAL")
+        if "language" not in columns:
+            self.connection.execute("ALTER TABLE policies ADD COLUMN language TEXT")
+        self.history = VersionHistory(self.connection)
+        self.connection.commit()
+
+        self.dictionaries = dict(self.connection.execute("SELECT id, dictionary FROM compression_dictionaries"))
+        self.dictionary_id = max(self.dictionaries) if self.dictionaries else None
+        self._create_search_index()
+
+    def _create_search_index(self):
+        # External-content FTS5 index over the full policy texts. Its content
+        # table is the policy_texts view, which decompresses full_text through
+        # the policy_text() SQL function, so no text is stored twice and
+        # snippets come from the whole document (or the excerpt, for rows
+        # stored before full texts were kept). save_many() updates the
+        # index in the transaction that writes the policy.
+        self.connection.create_function("policy_text", 2, self._decompress, deterministic=True)
+        exists = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'policies_fts'"
+        ).fetchone()
+        self.connection.executescript('''
+            CREATE VIEW IF NOT EXISTS policy_texts AS
+                SELECT rowid, url, COALESCE(policy_text(full_text, dictionary_id), text) AS text FROM policies;
+            CREATE VIRTUAL TABLE IF NOT EXISTS policies_fts USING fts5(
+                url, text, content='policy_texts', content_rowid='rowid'
+            );
+        ''')
+        if not exists:
+            # Index the policies stored before the index existed
+            self.connection.execute("INSERT INTO policies_fts (policies_fts) VALUES ('rebuild')")
+            self.connection.commit()
+
+    def _row(self, item, crawled_at):
+        full_text = item.get("full_text", item["text"])
+        return (
+            item["url"],
+            item["text"],
+            item["word_count"],
+            item["char_count"],
+            item.get("polarity"),
+            item.get("subjectivity"),
+            compress_text(full_text, self.dictionaries.get(self.dictionary_id)),
+            self.dictionary_id,
+            crawled_at,
+            item.get("language"),
+        )
+
+    def save_many(self, items):
+        # All items in one transaction: a single sync to disk for the batch,
+        # and nothing written if any of them fails
+        crawled_at = time.time()
+        with self.connection:
+            for item in items:
+                full_text = item.get("full_text", item["text"])
+                previous = self.connection.execute(
+                    "SELECT rowid, text, full_text, dictionary_id, crawled_at FROM policies WHERE url = ?",
+                    (item["url"],),
+                ).fetchone()
+                if previous is not None:
+                    rowid, excerpt, blob, dictionary_id, previous_crawled_at = previous
+                    previous_text = self._decompress(blob, dictionary_id)
+                    if previous_text is not None and previous_text != full_text:
+                        self.history.record(item["url"], previous_text, previous_crawled_at, full_text)
+                    # An external-content index needs the old values to drop a row
+                    self.connection.execute(
+                        "INSERT INTO policies_fts (policies_fts, rowid, url, text) VALUES ('delete', ?, ?, ?)",
+                        (rowid, item["url"], previous_text if previous_text is not None else excerpt),
+                    )
+                cursor = self.connection.execute('''
+                    INSERT OR REPLACE INTO policies
+                        (url, text, word_count, char_count, polarity, subjectivity, full_text, dictionary_id, crawled_at,
+                         language)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', self._row(item, crawled_at))
+                self.connection.execute(
+                    "INSERT INTO policies_fts (rowid, url, text) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, item["url"], full_text),
+                )
+
+    def save(self, item):
+        self.save_many([item])
+
+    def _decompress(self, blob, dictionary_id):
+        if blob is None:
+            return None
+        return decompress_text(blob, self.dictionaries.get(dictionary_id))
+
+    def get_full_text(self, url):
+        # Whole policy text for url; None when it is not stored
+        row = self.connection.execute(
+            "SELECT full_text, dictionary_id FROM policies WHERE url = ?", (url,)
+        ).fetchone()
+        return self._decompress(*row) if row else None
+
+    def iter_full_texts(self):
+        # (url, full text) for every policy stored with its full text
+        rows = self.connection.execute(
+            "SELECT url, full_text, dictionary_id FROM policies WHERE full_text IS NOT NULL"
+        )
+        for url, blob, dictionary_id in rows:
+            yield url, self._decompress(blob, dictionary_id)
+
+    def search(self, query, limit=10):
+        # Best matches for an FTS5 query ('cookies', 'third NEAR/5 party',
+        # '"personal data" AND sell', ...) over the full policy texts, as
+        # (url, snippet, score) tuples; a lower score is a better match
+        return self.connection.execute('''
+            SELECT url, snippet(policies_fts, 1, '[', ']', '...', 16), bm25(policies_fts, 5.0, 1.0) AS score
+            FROM policies_fts
+            WHERE policies_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+        ''', (query, limit)).fetchall()
+
+    def versions(self, url):
+        # (version, crawled at) of the archived versions of url, oldest
+        # first; the stored full text is version len(versions) + 1
+        return self.history.versions(url)
+
+    def get_version(self, url, version):
+        # Full text of any version of url; None when there is no such version
+        latest = self.get_full_text(url)
+        if latest is None:
+            return None
+        if version == len(self.history.versions(url)) + 1:
+            return latest
+        return self.history.rebuild(url, version, latest)
+
+    def train_dictionary(self, recompress=True):
+        # Trains a dictionary on the stored policies and makes it the one new
+        # rows are compressed with. Existing rows are recompressed with it
+        # unless recompress is False.
+        texts = dict(self.iter_full_texts())
+        dictionary = train_dictionary(texts.values())
+        if not dictionary:
+            return None
+        cursor = self.connection.execute(
+            "INSERT INTO compression_dictionaries (dictionary, created_at) VALUES (?, ?)",
+            (dictionary, time.time()),
+        )
+        self.dictionary_id = cursor.lastrowid
+        self.dictionaries[self.dictionary_id] = dictionary
+        if recompress:
+            self.connection.executemany(
+                "UPDATE policies SET full_text = ?, dictionary_id = ? WHERE url = ?",
+                ((compress_text(text, dictionary), self.dictionary_id, url) for url, text in texts.items()),
+            )
+        self.connection.commit()
+        return self.dictionary_id
+
+    def storage_stats(self):
+        # Stored (compressed) and original bytes of all full texts
+        compressed = original = 0
+        for blob, dictionary_id in self.connection.execute(
+            "SELECT full_text, dictionary_id FROM policies WHERE full_text IS NOT NULL"
+        ):
+            compressed += len(blob)
+            original += len(self._decompress(blob, dictionary_id).encode("utf-8"))
+        return compressed, original
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    # python -m tos_pp_crawler.storage [tos_pp.db]
+    # Trains a compression dictionary on the stored policies and reports the
+    # resulting storage savings
+    store = PolicyStore(sys.argv[1] if len(sys.argv) > 1 else "tos_pp.db")
+    before = store.storage_stats()
+    if store.train_dictionary() is None:
+        print("No sentences recur across the stored policies; nothing to train on")
+    else:
+        after = store.storage_stats()
+        print(f"{after[1]} bytes of text stored in {before[0]} bytes before, {after[0]} bytes with the dictionary "
+              f"({after[1] / after[0]:.1f}x)")
+    store.close()
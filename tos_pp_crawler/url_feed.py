@@ -0,0 +1,227 @@
+import logging
+import sqlite3
+import zlib
+from collections import OrderedDict
+
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.log import failure_to_exc_info
+
+from tos_pp_crawler.sharding import shard_paths
+
+logger = logging.getLogger(__name__)
+
+
+class StartUrlFeed:
+    # Lazy, resumable source of start URLs for crawls too big for a Python
+    # list. URLs are read from a text file (one per line) or a SQLite table
+    # in batches of FEED_BATCH_SIZE, only when the engine asks for more.
+    #
+    # A persistent cursor records how far the crawl got. It only moves past
+    # a batch once every request from that batch has finished (answered,
+    # failed or filtered), so a crawl that is stopped and started again
+    # resumes at the first unfinished batch instead of at the top, and never
+    # skips a URL that was queued but not yet fetched. Once every URL of the
+    # feed has finished the cursor goes back to the top, so running the same
+    # feed again crawls it again.
+    #
+    # When replaying the response archive the cursor is neither read nor
+    # saved: the feed is read from the top every time. With SQLITE_SHARDS
+    # above one, the cursor of a feed is kept in the shard file its name
+    # hashes to; it is written once per finished batch.
+    #
+    #   scrapy crawl policy_spider -a urls_file=urls.txt
+    #   scrapy crawl policy_spider -a urls_db=seeds.db -a urls_table=start_urls
+
+    def __init__(self, name, cursor_db, path=None, db_path=None, table="start_urls",
+                 column="url", batch_size=1000, persist=True):
+        self.name = name
+        self.path = path
+        self.db_path = db_path
+        self.table = table
+        self.column = column
+        self.batch_size = batch_size
+
+        # Without persistence the cursor lives in a throwaway database
+        self.connection = sqlite3.connect(cursor_db if persist else ":memory:")
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS feed_cursors (
+                name TEXT PRIMARY KEY,
+                position INTEGER
+            )
+        ''')
+        self.connection.commit()
+        row = self.connection.execute(
+            "SELECT position FROM feed_cursors WHERE name = ?", (name,)
+        ).fetchone()
+        self.cursor = row[0] if row else 0
+
+        # batch end position -> positions of that batch still in flight
+        self.pending = OrderedDict()
+        self.exhausted = False
+        self.spider = None
+
+    @classmethod
+    def from_spider(cls, spider, path_arg="urls_file", db_arg="urls_db"):
+        # Builds the feed from the spider's -a arguments, or returns None
+        # when the spider should fall back to its static start_urls.
+        path = getattr(spider, path_arg, None)
+        db_path = getattr(spider, db_arg, None)
+        if not path and not db_path:
+            return None
+
+        settings = spider.crawler.settings
+        table = getattr(spider, "urls_table", "start_urls")
+        name = f"{spider.name}:{path or db_path + '/' + table}"
+        cursor_dbs = shard_paths(
+            settings.get("FEED_CURSOR_DB", "tos_pp.db"), settings.getint("SQLITE_SHARDS", 1)
+        )
+        feed = cls(
+            name,
+            cursor_dbs[zlib.crc32(name.encode("utf-8")) % len(cursor_dbs)],
+            path=path,
+            db_path=db_path,
+            table=table,
+            column=getattr(spider, "urls_column", "url"),
+            batch_size=settings.getint("FEED_BATCH_SIZE", 1000),
+            persist=settings.get("ARCHIVE_MODE") != "replay",
+        )
+        if getattr(spider, "restart_feed", None):
+            feed.reset()
+        feed.spider = spider
+        spider.crawler.signals.connect(feed.response_received, signal=signals.response_received)
+        spider.crawler.signals.connect(feed.request_dropped, signal=signals.request_dropped)
+        spider.crawler.signals.connect(feed.spider_closed, signal=signals.spider_closed)
+        spider.logger.info("Reading start URLs from %s at position %d", feed.name, feed.cursor)
+        return feed
+
+    def __iter__(self):
+        # Yields (position, url) pairs from the cursor onwards
+        position = self.cursor
+        batch = self._read_batch(position)
+        if not batch and position:
+            # A cursor past the end of the source: finished by a crawl that
+            # did not go back to the top, or the source was replaced
+            logger.info("Nothing left in start URL feed %s at position %d, starting from the top",
+                        self.name, position)
+            self.reset()
+            position = 0
+            batch = self._read_batch(position)
+        while batch:
+            end = batch[-1][2]
+            self.pending[end] = set(start for start, _, _ in batch)
+            for start, url, _ in batch:
+                yield start, url
+            position = end
+            batch = self._read_batch(position)
+        self.exhausted = True
+        self._advance()
+
+    def _read_batch(self, position):
+        # Returns (position, url, next position) triples
+        batch = []
+        if self.path:
+            with open(self.path, "rb") as f:
+                f.seek(position)
+                while len(batch) < self.batch_size:
+                    line = f.readline()
+                    if not line:
+                        break
+                    start, position = position, f.tell()
+                    url = line.decode("utf-8").strip()
+                    if url and not url.startswith("#"):
+                        batch.append((start, url, position))
+            if batch and batch[-1][2] != position:
+                # Trailing comment/blank lines still count as read
+                batch[-1] = batch[-1][:2] + (position,)
+        else:
+            source = sqlite3.connect(self.db_path)
+            try:
+                # Rows with no URL are skipped; a batch of nothing but blank
+                # rows must not end the feed
+                while not batch:
+                    rows = source.execute(
+                        f"SELECT rowid, {self.column} FROM {self.table} WHERE rowid >= ? ORDER BY rowid LIMIT ?",
+                        (position, self.batch_size),
+                    ).fetchall()
+                    if not rows:
+                        break
+                    position = rows[-1][0] + 1
+                    batch = [
+                        (rowid, url.strip(), rowid + 1) for rowid, url in rows if isinstance(url, str) and url.strip()
+                    ]
+            finally:
+                source.close()
+            if batch:
+                batch[-1] = batch[-1][:2] + (position,)
+        return batch
+
+    def request(self, request, position):
+        # Tags a request so its completion moves the cursor. Seeds go
+        # through the dupefilter as seeds: a URL the feed repeats is fetched
+        # once, while a recrawl of the feed after DUPEFILTER_SEED_TTL
+        # reaches the validator cache and the fingerprint check instead of
+        # waiting for DUPEFILTER_TTL (see dupefilter.py). A filtered seed is
+        # dropped, which finishes it for the cursor.
+        request.meta["feed_position"] = position
+        request.meta["dupefilter_seed"] = True
+        request.errback = self.request_failed
+        return request
+
+    def done(self, request):
+        position = request.meta.get("feed_position")
+        if position is None:
+            return
+        for outstanding in self.pending.values():
+            if position in outstanding:
+                outstanding.discard(position)
+                break
+        self._advance()
+
+    def _advance(self):
+        moved = False
+        while self.pending:
+            end, outstanding = next(iter(self.pending.items()))
+            if outstanding:
+                break
+            self.pending.popitem(last=False)
+            self.cursor = end
+            moved = True
+        if self.exhausted and not self.pending and self.cursor:
+            logger.info("Finished start URL feed %s, the next crawl starts from the top", self.name)
+            self.cursor = 0
+            moved = True
+        if moved:
+            self._save()
+
+    def _save(self):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO feed_cursors (name, position) VALUES (?, ?)",
+            (self.name, self.cursor),
+        )
+        self.connection.commit()
+
+    def reset(self):
+        self.cursor = 0
+        self.pending.clear()
+        self.exhausted = False
+        self._save()
+
+    def response_received(self, response, request, spider):
+        self.done(request)
+
+    def request_dropped(self, request, spider):
+        self.done(request)
+
+    def request_failed(self, failure):
+        self.done(failure.request)
+        if not failure.check(IgnoreRequest):
+            # The errback takes over Scrapy's own download error logging
+            logger.error(
+                "Error downloading %s", failure.request,
+                exc_info=failure_to_exc_info(failure), extra={"spider": self.spider},
+            )
+
+    def spider_closed(self, spider):
+        self._save()
+        self.connection.close()
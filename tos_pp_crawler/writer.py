@@ -0,0 +1,275 @@
+import logging
+import queue
+import threading
+import weakref
+from collections import deque
+
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from tos_pp_crawler.sharding import shard_index, shard_paths
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def writer_options(settings, sharded=True):
+    # BatchedWriter arguments from the SQLite settings, so the state a crawl
+    # keeps next to its items is batched, and spread over SQLITE_SHARDS
+    # files by registrable domain, the way SQLitePipeline stores the items
+    options = {
+        "batch_size": settings.getint("SQLITE_BATCH_SIZE", 100),
+        "flush_interval": settings.getfloat("SQLITE_FLUSH_INTERVAL", 1.0),
+        "queue_size": settings.getint("SQLITE_WRITER_QUEUE", 4),
+    }
+    if sharded:
+        options["shard_count"] = settings.getint("SQLITE_SHARDS", 1)
+    return options
+
+
+class EnginePause:
+    # The engine has a single paused flag, so every component that holds a
+    # crawl back while it catches up (the writers, the enrichment pool)
+    # pauses it through the one EnginePause of its crawler. The engine is
+    # paused by the first holder and unpaused only when the last one lets
+    # go, so one backlog draining never resumes a crawl that another still
+    # holds back. A pause already on when the first holder came, such as an
+    # operator's from the telnet console, is left on.
+
+    _pauses = weakref.WeakKeyDictionary()
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.holders = set()
+        self.external = False
+
+    @classmethod
+    def of(cls, crawler):
+        pause = cls._pauses.get(crawler)
+        if pause is None or pause.engine is not crawler.engine:
+            pause = cls._pauses[crawler] = cls(crawler.engine)
+        return pause
+
+    def hold(self, holder):
+        if holder in self.holders:
+            return
+        if not self.holders:
+            self.external = self.engine.paused
+            self.engine.pause()
+        self.holders.add(holder)
+
+    def release(self, holder):
+        if holder not in self.holders:
+            return
+        self.holders.discard(holder)
+        if not self.holders and not self.external:
+            self.engine.unpause()
+
+
+class BackgroundWriter:
+    # Runs all writes to one database on a dedicated thread, so commits and
+    # fsyncs never block the reactor. The thread opens its own connection
+    # with open_db(), calls write(db, batch) for each submitted batch and
+    # close_db(db) on shutdown.
+    #
+    # Batches are handed over through a queue of at most queue_size
+    # batches. Further batches wait on the reactor side until the thread
+    # catches up; pending() tells callers how far behind it is so they can
+    # slow the crawl down. submit() returns a Deferred that fires once its
+    # batch is committed, or errbacks with the exception that made it fail.
+    # Every method except the thread's own loop is called from the reactor.
+
+    def __init__(self, open_db, write, close_db=None, queue_size=4, name="db-writer"):
+        self.open_db = open_db
+        self.write = write
+        self.close_db = close_db
+        self.queue = queue.Queue(queue_size)
+        self.backlog = deque()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.opened = None
+        self.stopping = False
+        self.stopped = False
+        self.failed = False
+        self.close_waiters = []
+
+    def start(self):
+        # Fires once the thread has opened the database
+        self.opened = defer.Deferred()
+        self.thread.start()
+        return self.opened
+
+    def submit(self, batch):
+        d = defer.Deferred()
+        self.backlog.append((batch, d))
+        self._feed()
+        return d
+
+    def pending(self):
+        # Batches submitted but not yet written
+        return len(self.backlog) + self.queue.qsize()
+
+    def close(self):
+        # Writes everything still pending, then closes the database and
+        # stops the thread. The returned Deferred fires when it is done;
+        # closing again returns one that fires at the same time.
+        if self.stopped or self.failed or self.opened is None:
+            # Already closed, never started, or the database failed to open
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.close_waiters.append(d)
+        if len(self.close_waiters) == 1:
+            self.stopping = True
+            self._feed()
+        return d
+
+    def _feed(self):
+        while self.backlog and not self.queue.full():
+            self.queue.put_nowait(self.backlog.popleft())
+        if self.stopping and not self.backlog and not self.queue.full():
+            self.queue.put_nowait(_STOP)
+            self.stopping = False
+
+    def _done(self, d, result):
+        self._feed()
+        if isinstance(result, Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+    def _closed(self):
+        self.stopped = True
+        waiters, self.close_waiters = self.close_waiters, []
+        for d in waiters:
+            d.callback(None)
+
+    def _run(self):
+        try:
+            db = self.open_db()
+        except Exception:
+            self.failed = True
+            reactor.callFromThread(self.opened.errback, Failure())
+            return
+        reactor.callFromThread(self.opened.callback, None)
+
+        while True:
+            entry = self.queue.get()
+            if entry is _STOP:
+                break
+            batch, d = entry
+            try:
+                result = self.write(db, batch)
+            except Exception:
+                result = Failure()
+            reactor.callFromThread(self._done, d, result)
+
+        try:
+            if self.close_db is not None:
+                self.close_db(db)
+        except Exception:
+            logger.exception("Error closing the database in %s", self.thread.name)
+        reactor.callFromThread(self._closed)
+
+
+class BatchedWriter:
+    # Buffers single writes on the reactor and hands them to BackgroundWriter
+    # threads in batches, once batch_size entries are waiting or
+    # flush_interval seconds after the first of them arrived, so a crawl
+    # commits once per batch instead of once per item. Entries are routed by
+    # the registrable domain of their URL over shard_count database files
+    # (see sharding.py), each with its own writer thread.
+    #
+    # open_db(path), write(db, entries) and close_db(db) run on the writer
+    # threads; write() may return one result per entry. submit() returns a
+    # Deferred that fires with the entry's result (the entry itself when
+    # write() returns None) once its batch is committed, or fails with the
+    # error that rolled it back. With a crawler, the engine is paused (see
+    # EnginePause) while the busiest writer has more than queue_size
+    # batches waiting, and batches, rows and failed rows are counted under
+    # stats_prefix.
+
+    def __init__(self, db_path, open_db, write, close_db=None, shard_count=1, batch_size=100,
+                 flush_interval=1.0, queue_size=4, name="db-writer", crawler=None, stats_prefix=None):
+        self.shard_count = shard_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.crawler = crawler
+        self.stats = crawler.stats if crawler is not None and stats_prefix else None
+        self.stats_prefix = stats_prefix
+        self.writers = [
+            BackgroundWriter(
+                lambda path=path: open_db(path),
+                write,
+                close_db,
+                queue_size=queue_size,
+                name=f"{name}-{index}",
+            )
+            for index, path in enumerate(shard_paths(db_path, shard_count))
+        ]
+        self.buffer = []
+        self.flush_call = None
+        self.paused = False
+
+    def start(self):
+        # Fires once every shard's database is open
+        return defer.DeferredList(
+            [writer.start() for writer in self.writers], fireOnOneErrback=True, consumeErrors=True
+        )
+
+    def submit(self, url, entry):
+        d = defer.Deferred()
+        self.buffer.append((shard_index(url or "", self.shard_count), entry, d))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        elif self.flush_call is None:
+            self.flush_call = reactor.callLater(self.flush_interval, self.flush)
+        return d
+
+    def pending(self):
+        # Batches the most loaded writer still has to write
+        return max(writer.pending() for writer in self.writers)
+
+    def flush(self):
+        if self.flush_call is not None and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        if not self.buffer:
+            return
+
+        shards = {}
+        for index, entry, d in self.buffer:
+            shards.setdefault(index, []).append((entry, d))
+        self.buffer = []
+        for index, batch in shards.items():
+            written = self.writers[index].submit([entry for entry, _ in batch])
+            written.addBoth(self._written, batch)
+
+        if not self.paused and self.crawler is not None and self.pending() > self.queue_size:
+            self.paused = True
+            if self.stats is not None:
+                self.stats.inc_value(f"{self.stats_prefix}/backpressure_pauses")
+            EnginePause.of(self.crawler).hold(self)
+
+    def close(self):
+        # Writes everything buffered, then closes every shard's writer
+        self.flush()
+        return defer.DeferredList([writer.close() for writer in self.writers])
+
+    def _written(self, result, batch):
+        if self.paused and self.pending() <= self.queue_size // 2:
+            self.paused = False
+            EnginePause.of(self.crawler).release(self)
+
+        if isinstance(result, Failure):
+            if self.stats is not None:
+                self.stats.inc_value(f"{self.stats_prefix}/failed_rows", len(batch))
+            for _, d in batch:
+                d.errback(result)
+            return
+        if self.stats is not None:
+            self.stats.inc_value(f"{self.stats_prefix}/batches")
+            self.stats.inc_value(f"{self.stats_prefix}/rows", len(batch))
+        results = result if result is not None else [entry for entry, _ in batch]
+        for (_, d), value in zip(batch, results):
+            d.callback(value)
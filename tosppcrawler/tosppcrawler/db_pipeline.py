@@ -1,10 +1,32 @@
 import sqlite3
+import time
 
-class SQLitePipeline:
-    def open_spider(self, spider):
-        self.connection = sqlite3.connect("tospp_data.db")
-        self.cursor = self.connection.cursor()
-        self.cursor.execute('''
+from tosppcrawler.blobs import TextBlobStore
+from tosppcrawler.sharding import ShardedStore
+from tosppcrawler.versions import VersionHistory
+from tosppcrawler.writer import BatchedWriter
+
+
+class TosDataStore:
+    # The tos_data table holds the latest title and text of every URL, one
+    # row per URL; each earlier text is kept as a compact reverse delta in
+    # VersionHistory and can be rebuilt with get_version(). Rows stored
+    # before versioning may repeat a URL; the newest of them is updated.
+    #
+    # Texts live in a TextBlobStore: a row keeps the hash and length of its
+    # text, so identical pages and truncated copies of a page share one
+    # stored text. The tos_texts view reads rows back with their text.
+    #
+    # language is the ISO 639-1 code the pipeline detected for the text
+    # ("und" when undetermined), as the policies table of tos_pp_crawler
+    # keeps it; rows stored before it was recorded have NULL.
+
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL only syncs at checkpoints and stays crash-safe
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute('''
             CREATE TABLE IF NOT EXISTS tos_data (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 title TEXT,
@@ -12,14 +34,256 @@ class SQLitePipeline:
                 text TEXT
             )
         ''')
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(tos_data)")]
+        for column, kind in (
+            ("crawled_at", "REAL"), ("text_hash", "TEXT"), ("text_length", "INTEGER"), ("language", "TEXT")
+        ):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE tos_data ADD COLUMN {column} {kind}")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tos_data_url ON tos_data (url)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tos_data_text_hash ON tos_data (text_hash)")
+        self.blobs = TextBlobStore(self.connection, [("tos_data", "text_hash")])
+        # A view made before language was stored is replaced
+        view = self.connection.execute("SELECT sql FROM sqlite_master WHERE name = 'tos_texts'").fetchone()
+        if view and "d.language" not in view[0]:
+            self.connection.execute("DROP VIEW tos_texts")
+        self.connection.execute('''
+            CREATE VIEW IF NOT EXISTS tos_texts AS
+            SELECT d.id, d.title, d.url, COALESCE(d.text, substr(b.text, 1, d.text_length)) AS text,
+                   d.text_hash, d.crawled_at, d.language
+            FROM tos_data d LEFT JOIN text_blobs b ON b.hash = d.text_hash
+        ''')
+        self._create_search_index()
+        self._move_texts_to_blobs()
+        self.history = VersionHistory(self.connection)
         self.connection.commit()
 
-    def close_spider(self, spider):
+    def _move_texts_to_blobs(self):
+        # Rows written before the blob store kept their text inline; the
+        # text they read back is unchanged, so the search index stays valid
+        legacy = self.connection.execute(
+            "SELECT id, text FROM tos_data WHERE text_hash IS NULL AND text IS NOT NULL"
+        ).fetchall()
+        for row_id, text in legacy:
+            digest, length = self.blobs.put(text)
+            self.connection.execute(
+                "UPDATE tos_data SET text = NULL, text_hash = ?, text_length = ? WHERE id = ?",
+                (digest, length, row_id),
+            )
+
+    def _create_search_index(self):
+        # External-content FTS5 index over tos_texts: it stores only the
+        # index and reads title/url/text back from the view for snippets.
+        # save_many() keeps it in step; an index made when it still read
+        # tos_data through triggers is replaced.
+        self.connection.executescript('''
+            DROP TRIGGER IF EXISTS tos_data_fts_insert;
+            DROP TRIGGER IF EXISTS tos_data_fts_delete;
+            DROP TRIGGER IF EXISTS tos_data_fts_update;
+        ''')
+        existing = self.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'tos_data_fts'"
+        ).fetchone()
+        if existing and "'tos_texts'" in existing[0]:
+            return
+        if existing:
+            self.connection.execute("DROP TABLE tos_data_fts")
+        self.connection.execute('''
+            CREATE VIRTUAL TABLE tos_data_fts USING fts5(
+                title, url, text, content='tos_texts', content_rowid='id'
+            )
+        ''')
+        # Index the rows stored before the index existed
+        self.connection.execute("INSERT INTO tos_data_fts (tos_data_fts) VALUES ('rebuild')")
+
+    def _latest(self, url):
+        return self.connection.execute(
+            "SELECT id, title, text, crawled_at, text_hash FROM tos_texts WHERE url = ? ORDER BY id DESC LIMIT 1",
+            (url,),
+        ).fetchone()
+
+    def save_many(self, rows):
+        # (title, url, text, language) rows, all in one transaction; rows
+        # without a language store NULL
+        crawled_at = time.time()
+        with self.connection:  # rolled back if a row fails
+            for row in rows:
+                title, url, text = row[:3]
+                language = row[3] if len(row) > 3 else None
+                latest = self._latest(url)
+                if latest is not None:
+                    row_id, previous_title, previous_text, previous_crawled_at, previous_hash = latest
+                    if previous_text is not None and text is not None and previous_text != text:
+                        self.history.record(url, previous_text, previous_crawled_at, text)
+                    self.connection.execute(
+                        "INSERT INTO tos_data_fts (tos_data_fts, rowid, title, url, text) VALUES ('delete', ?, ?, ?, ?)",
+                        (row_id, previous_title, url, previous_text),
+                    )
+                    # Released before the new text is stored, so a text that
+                    # extends the old one takes over its blob's references
+                    if previous_hash is not None:
+                        self.blobs.release(previous_hash)
+
+                digest = length = None
+                inline_text = text
+                if isinstance(text, str):
+                    digest, length = self.blobs.put(text)
+                    inline_text = None
+
+                if latest is None:
+                    row_id = self.connection.execute(
+                        "INSERT INTO tos_data (title, url, text, text_hash, text_length, crawled_at, language) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (title, url, inline_text, digest, length, crawled_at, language),
+                    ).lastrowid
+                else:
+                    self.connection.execute(
+                        "UPDATE tos_data SET title = ?, text = ?, text_hash = ?, text_length = ?, crawled_at = ?, "
+                        "language = ? WHERE id = ?",
+                        (title, inline_text, digest, length, crawled_at, language, row_id),
+                    )
+                self.connection.execute(
+                    "INSERT INTO tos_data_fts (rowid, title, url, text) VALUES (?, ?, ?, ?)",
+                    (row_id, title, url, text),
+                )
+            self.blobs.collect_garbage()
+
+    def get_text(self, url):
+        latest = self._latest(url)
+        return latest[2] if latest else None
+
+    def get_language(self, url):
+        row = self.connection.execute(
+            "SELECT language FROM tos_data WHERE url = ? ORDER BY id DESC LIMIT 1", (url,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def unique_texts(self):
+        # (text, rows) for every distinct text stored, so an analysis can
+        # run once per text and weigh its result by the number of rows
+        return self.connection.execute('''
+            SELECT text, COUNT(*) FROM tos_texts
+            WHERE text IS NOT NULL
+            GROUP BY COALESCE(text_hash || ':' || length(text), text)
+        ''')
+
+    def storage_stats(self):
+        # (rows, distinct stored texts, characters of text in rows,
+        # characters actually stored)
+        rows, referenced = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length(text)), 0) FROM tos_texts"
+        ).fetchone()
+        blobs, stored = self.blobs.size()
+        return rows, blobs, referenced, stored
+
+    def search(self, query, limit=10):
+        # Best matches for an FTS5 query ('cookies', 'third NEAR/5 party',
+        # '"personal data" AND sell', ...) as (url, title, snippet, score)
+        # tuples. Title hits weigh most, then URL, then body text; a lower
+        # score is a better match.
+        return self.connection.execute('''
+            SELECT tos_texts.url, tos_texts.title,
+                   snippet(tos_data_fts, 2, '[', ']', '...', 16),
+                   bm25(tos_data_fts, 10.0, 5.0, 1.0) AS score
+            FROM tos_data_fts JOIN tos_texts ON tos_texts.id = tos_data_fts.rowid
+            WHERE tos_data_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+        ''', (query, limit)).fetchall()
+
+    def versions(self, url):
+        # (version, crawled at) of the archived versions of url, oldest
+        # first; the current text is version len(versions) + 1
+        return self.history.versions(url)
+
+    def get_version(self, url, version):
+        latest = self._latest(url)
+        if latest is None:
+            return None
+        if version == len(self.history.versions(url)) + 1:
+            return latest[2]
+        return self.history.rebuild(url, version, latest[2])
+
+    def close(self):
         self.connection.close()
 
+
+def open_store(db_path="tospp_data.db", shard_count=1):
+    # Read/write access to everything the pipeline stored, across shards
+    return ShardedStore(db_path, shard_count, TosDataStore, lambda row: row[1])
+
+
+class SQLitePipeline:
+    # Buffers items and writes them with one executemany per transaction,
+    # once SQLITE_BATCH_SIZE items are waiting or SQLITE_FLUSH_INTERVAL
+    # seconds after the first of them arrived. The writes run on a
+    # BatchedWriter thread (see writer.py), so disk latency never stalls
+    # the reactor.
+    # The database runs in WAL mode, so the other tables sharing the file
+    # can be read while a batch is written. See TosDataStore for how
+    # recrawled pages are versioned.
+    #
+    # process_item returns a Deferred that fires once the item is committed
+    # and fails with the database error otherwise, so Scrapy reports the
+    # failure for the item and spider. When more than SQLITE_WRITER_QUEUE
+    # batches are waiting for the writer the engine is paused until it has
+    # caught up. close_spider waits for everything buffered to be written.
+    #
+    # With SQLITE_SHARDS above one, rows are spread by registrable domain
+    # over that many database files (see sharding.py), each with its own
+    # writer thread; open_store() reads them back as one store.
+
+    def __init__(self, db_path="tospp_data.db", batch_size=100, flush_interval=1.0,
+                 queue_size=4, crawler=None, shard_count=1):
+        self.db_path = db_path
+        self.shard_count = shard_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get("SQLITE_DB", "tospp_data.db"),
+            settings.getint("SQLITE_BATCH_SIZE", 100),
+            settings.getfloat("SQLITE_FLUSH_INTERVAL", 1.0),
+            settings.getint("SQLITE_WRITER_QUEUE", 4),
+            crawler,
+            settings.getint("SQLITE_SHARDS", 1),
+        )
+
+    def open_spider(self, spider):
+        # One writer thread per shard file, so shards are written in parallel
+        self.writer = BatchedWriter(
+            self.db_path,
+            TosDataStore,
+            lambda store, rows: store.save_many(rows),
+            lambda store: store.close(),
+            shard_count=self.shard_count,
+            batch_size=self.batch_size,
+            flush_interval=self.flush_interval,
+            queue_size=self.queue_size,
+            name="sqlite-writer",
+            crawler=self.crawler,
+            stats_prefix="sqlite",
+        )
+        return self.writer.start()
+
+    def close_spider(self, spider):
+        return self.writer.close()
+
+    def pending(self):
+        # Batches the most loaded writer still has to write
+        return self.writer.pending()
+
     def process_item(self, item, spider):
-        self.cursor.execute('''
-            INSERT INTO tos_data (title, url, text) VALUES (?, ?, ?)
-        ''', (item.get('title'), item.get('url'), item.get('text')))
-        self.connection.commit()
-        return item
+        d = self.writer.submit(item.get('url'), (
+            item.get('title'), item.get('url'), item.get('text'), item.get('language')
+        ))
+        d.addCallback(lambda _: item)
+        return d
+
+    def flush(self):
+        self.writer.flush()
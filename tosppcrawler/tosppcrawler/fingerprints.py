@@ -0,0 +1,62 @@
+import hashlib
+import re
+import sqlite3
+
+from scrapy.exceptions import DropItem
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def content_fingerprint(text):
+    # Whitespace-insensitive SHA-1 of the extracted page text. Re-indented
+    # markup or reflowed lines do not count as a change to the policy.
+    normalized = _WHITESPACE.sub(" ", text or "").strip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class UnchangedContent(DropItem):
+    # Raised for an item whose text is what was stored for its URL last time
+    pass
+
+
+class FingerprintStore:
+    # Last-seen content fingerprint per URL, kept in its own table next to
+    # the crawled data so it survives between runs. In WAL mode lookups are
+    # not blocked while a writer thread commits new fingerprints.
+
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS content_fingerprints (
+                url TEXT PRIMARY KEY,
+                fingerprint TEXT
+            )
+        ''')
+        self.connection.commit()
+
+    def get(self, url):
+        row = self.connection.execute(
+            "SELECT fingerprint FROM content_fingerprints WHERE url = ?", (url,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def is_unchanged(self, url, fingerprint):
+        return self.get(url) == fingerprint
+
+    def update(self, url, fingerprint):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO content_fingerprints (url, fingerprint) VALUES (?, ?)",
+            (url, fingerprint),
+        )
+        self.connection.commit()
+
+    def update_many(self, rows):
+        # (url, fingerprint) rows in one transaction
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO content_fingerprints (url, fingerprint) VALUES (?, ?)", rows
+            )
+
+    def close(self):
+        self.connection.close()
@@ -6,8 +6,193 @@
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+
+from tosppcrawler.fingerprints import FingerprintStore, UnchangedContent, content_fingerprint
+from tosppcrawler.language import UNDETERMINED, detect_language
+from tosppcrawler.sharding import ShardedStore
+from tosppcrawler.site_boilerplate import MIN_PAGES, MIN_SHARE, SiteBoilerplate
+from tosppcrawler.writer import BatchedWriter, writer_options
 
 
 class TosppcrawlerPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class ContentFingerprintPipeline:
+    # Drops items whose normalized text is identical to what was crawled
+    # from the same URL last time, before any later pipeline rewrites them.
+    # A new fingerprint is only recorded once its item has made it through
+    # every pipeline (item_scraped): an item whose storage failed is
+    # processed again on the next crawl instead of being dropped as
+    # unchanged for good. Not used when replaying the response archive, so
+    # every archived page goes through the pipelines again.
+    #
+    # Lookups run on the reactor; new fingerprints are written in batches
+    # by a BatchedWriter thread (see writer.py), and close_spider waits for
+    # them. With SQLITE_SHARDS above one, fingerprints are kept in the
+    # shard file of their URL's site, next to its items.
+
+    def __init__(self, db_path, stats, writer_options=None):
+        self.db_path = db_path
+        self.stats = stats
+        self.writer_options = writer_options or {}
+        # URL -> fingerprint of items still in the later pipelines
+        self.pending = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.get('ARCHIVE_MODE') == 'replay':
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('FINGERPRINT_DB', 'tospp_data.db'),
+            crawler.stats,
+            writer_options(crawler.settings),
+        )
+        crawler.signals.connect(pipeline.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(pipeline.item_failed, signal=signals.item_dropped)
+        crawler.signals.connect(pipeline.item_failed, signal=signals.item_error)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.store = ShardedStore(
+            self.db_path, self.writer_options.get('shard_count', 1), FingerprintStore, lambda row: row[0]
+        )
+        self.writer = BatchedWriter(
+            self.db_path,
+            FingerprintStore,
+            lambda store, rows: store.update_many(rows),
+            lambda store: store.close(),
+            name='fingerprint-writer',
+            **self.writer_options,
+        )
+        return self.writer.start()
+
+    def close_spider(self, spider):
+        d = self.writer.close()
+        d.addBoth(lambda _: self.store.close())
+        return d
+
+    def process_item(self, item, spider):
+        fingerprint = item.get('fingerprint') or content_fingerprint(item.get('text'))
+        if self.store.shard(item['url']).is_unchanged(item['url'], fingerprint):
+            self.stats.inc_value('fingerprint/unchanged', spider=spider)
+            raise UnchangedContent(f"Content unchanged since last crawl: {item['url']}")
+        self.pending[item['url']] = fingerprint
+        self.stats.inc_value('fingerprint/changed', spider=spider)
+        return item
+
+    def item_scraped(self, item, response, spider):
+        fingerprint = self.pending.pop(item.get('url'), None)
+        if fingerprint is not None:
+            d = self.writer.submit(item['url'], (item['url'], fingerprint))
+            d.addErrback(self._not_written, item['url'], spider)
+
+    def item_failed(self, item, response, spider, **kwargs):
+        self.pending.pop(item.get('url'), None)
+
+    def _not_written(self, failure, url, spider):
+        # The page is only processed again next time
+        spider.logger.error("Could not record the fingerprint of %s: %s", url, failure.getErrorMessage())
+
+
+class SiteBoilerplatePipeline:
+    # Strips the lines a page shares with most other pages of its site
+    # (see site_boilerplate.py). Runs after ContentFingerprintPipeline, so
+    # fingerprints stay those of the page as crawled, and the line counts
+    # are kept from the unstripped text.
+    #
+    # Counting a page is a write, so pages are counted and stripped in
+    # batches on a BatchedWriter thread: process_item returns a Deferred
+    # that fires with the stripped item once its batch is committed.
+    # Replayed pages are stripped on the reactor with the counts from
+    # crawling and not counted again. With SQLITE_SHARDS above one, the
+    # counts of a site are kept in the shard file of its registrable domain.
+
+    def __init__(self, db_path, stats, min_pages=MIN_PAGES, min_share=MIN_SHARE, persist=True,
+                 writer_options=None):
+        self.db_path = db_path
+        self.stats = stats
+        self.min_pages = min_pages
+        self.min_share = min_share
+        self.persist = persist
+        self.writer_options = writer_options or {}
+        self.site_lines = None
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get('SITE_BOILERPLATE_DB', 'tospp_data.db'),
+            crawler.stats,
+            settings.getint('SITE_BOILERPLATE_MIN_PAGES', MIN_PAGES),
+            settings.getfloat('SITE_BOILERPLATE_MIN_SHARE', MIN_SHARE),
+            persist=settings.get('ARCHIVE_MODE') != 'replay',
+            writer_options=writer_options(settings),
+        )
+
+    def _open(self, path):
+        return SiteBoilerplate(path, self.min_pages, self.min_share)
+
+    def open_spider(self, spider):
+        if not self.persist:
+            self.site_lines = ShardedStore(
+                self.db_path, self.writer_options.get('shard_count', 1), self._open, lambda page: page[0]
+            )
+            return None
+        self.writer = BatchedWriter(
+            self.db_path,
+            self._open,
+            lambda site_lines, pages: site_lines.ingest_many(pages),
+            lambda site_lines: site_lines.close(),
+            name='site-lines-writer',
+            **self.writer_options,
+        )
+        return self.writer.start()
+
+    def close_spider(self, spider):
+        if self.writer is not None:
+            return self.writer.close()
+        self.site_lines.close()
+        return None
+
+    def process_item(self, item, spider):
+        text = item.get('text')
+        if not text:
+            return item
+        if self.writer is None:
+            stripped = self.site_lines.shard(item['url']).strip(item['url'], text)
+            return self._stripped(stripped, item, text, spider)
+        d = self.writer.submit(item['url'], (item['url'], text))
+        d.addCallback(self._stripped, item, text, spider)
+        return d
+
+    def _stripped(self, stripped, item, text, spider):
+        item['text'] = stripped
+        self.stats.inc_value('site_boilerplate/chars_removed', len(text) - len(stripped), spider=spider)
+        return item
+
+
+class LanguagePipeline:
+    # Tags every item with the language of its text (see language.py), so
+    # later stages can route it. With LANGUAGE_FILTER set, items detected in
+    # any other language are dropped; text too short to tell is kept.
+
+    def __init__(self, stats, languages=()):
+        self.stats = stats
+        self.languages = frozenset(languages)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats, crawler.settings.getlist('LANGUAGE_FILTER'))
+
+    def process_item(self, item, spider):
+        language = detect_language(item.get('full_text', item.get('text')) or '')
+        item['language'] = language
+        self.stats.inc_value(f'language/{language}', spider=spider)
+        if self.languages and language != UNDETERMINED and language not in self.languages:
+            raise DropItem(f"Text in {language}, not in LANGUAGE_FILTER: {item['url']}")
+        return item
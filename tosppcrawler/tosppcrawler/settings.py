@@ -13,14 +13,23 @@ SPIDER_MODULES = ["tosppcrawler.spiders"]
 NEWSPIDER_MODULE = "tosppcrawler.spiders"
 
 
+# Start URLs passed as -a urls_file=... or -a urls_db=... are read lazily in
+# batches of this size, with the resume cursor kept in FEED_CURSOR_DB
+FEED_BATCH_SIZE = 1000
+FEED_CURSOR_DB = "tospp_data.db"
+
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 #USER_AGENT = "tosppcrawler (+http://www.yourdomain.com)"
 
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
-# Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+# Configure maximum concurrent requests performed by Scrapy (default: 16).
+# This is also the global budget the adaptive throttle shares between hosts.
+CONCURRENT_REQUESTS = 64
+# Concurrency every new host starts at; the adaptive throttle raises or
+# lowers it per host from there
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -50,9 +59,16 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "tosppcrawler.middlewares.TosppcrawlerDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "tosppcrawler.middlewares.TosppcrawlerDownloaderMiddleware": 543,
+    "tosppcrawler.throttle.AdaptiveThrottleMiddleware": 560,
+    "tosppcrawler.budget.ByteBudgetMiddleware": 570,
+    "tosppcrawler.archive.ArchiveRecorderMiddleware": 950,
+}
+
+# SQLite file holding the ETag/Last-Modified validators used for conditional
+# GETs on recrawl. Pages answering 304 Not Modified are not parsed again.
+VALIDATOR_CACHE_DB = "tospp_data.db"
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -63,9 +79,50 @@ ROBOTSTXT_OBEY = True
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
+    "tosppcrawler.pipelines.ContentFingerprintPipeline": 200,
+    "tosppcrawler.pipelines.SiteBoilerplatePipeline": 250,
+    "tosppcrawler.pipelines.LanguagePipeline": 260,
     "tosppcrawler.db_pipeline.SQLitePipeline": 300,
 }
 
+# SQLite file holding the last content fingerprint of every crawled URL.
+# Items whose text has not changed are dropped before they are stored again.
+FINGERPRINT_DB = "tospp_data.db"
+
+# Lines repeated across the pages of a site (headers, footers, cookie
+# notices) are stripped on ingest by SiteBoilerplatePipeline (see
+# site_boilerplate.py): a line is dropped once it is on at least
+# SITE_BOILERPLATE_MIN_PAGES of its site's pages and on at least
+# SITE_BOILERPLATE_MIN_SHARE of them. Near-duplicate pages (locale
+# variants of one policy) are counted once, long lines are only dropped at
+# the top or bottom of a page, and a page that would lose most of its text
+# is kept whole. Line counts per site are kept in SITE_BOILERPLATE_DB.
+SITE_BOILERPLATE_DB = "tospp_data.db"
+SITE_BOILERPLATE_MIN_PAGES = 3
+SITE_BOILERPLATE_MIN_SHARE = 0.5
+
+# Every item is tagged with the language of its text by LanguagePipeline
+# (see language.py). Items detected in a language missing from
+# LANGUAGE_FILTER are dropped; an empty list keeps them all.
+LANGUAGE_FILTER = []
+
+# SQLitePipeline writes items in batches of SQLITE_BATCH_SIZE, one
+# transaction each, or SQLITE_FLUSH_INTERVAL seconds after the first item of
+# a partial batch arrived. The writes run on a background thread; the crawl
+# is paused while more than SQLITE_WRITER_QUEUE batches wait for it. New
+# fingerprints, validators, site line counts and archive records are
+# batched the same way, each on a writer thread of its own.
+SQLITE_DB = "tospp_data.db"
+SQLITE_BATCH_SIZE = 100
+SQLITE_FLUSH_INTERVAL = 1.0
+SQLITE_WRITER_QUEUE = 4
+# Spread rows over this many database files by registrable domain, so
+# crawler processes working on different sites never wait on one write lock.
+# Read them back with open_store(SQLITE_DB, SQLITE_SHARDS). Fingerprints,
+# validators, site line counts and byte budget hits are sharded the same
+# way, and feed cursors by feed name; the response archive is not.
+SQLITE_SHARDS = 1
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -79,6 +136,32 @@ ITEM_PIPELINES = {
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
+# Per-domain AIMD crawl-rate controller (see throttle.py), used instead of
+# AutoThrottle. Hosts grow from CONCURRENT_REQUESTS_PER_DOMAIN up to the max
+# concurrency while their average latency stays under the target, and back
+# off on slow responses, errors and the status codes below.
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 8
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 2.0
+ADAPTIVE_THROTTLE_MAX_DELAY = 60
+ADAPTIVE_THROTTLE_BACKOFF_HTTP_CODES = [429, 503]
+#ADAPTIVE_THROTTLE_DEBUG = False
+# Hand out requests for the least busy hosts first, so a backed-off host's
+# queue cannot fill the global budget
+SCHEDULER_PRIORITY_QUEUE = "scrapy.pqueues.DownloaderAwarePriorityQueue"
+
+# Byte budgets (see budget.py). A response's download stops once it passes
+# BYTE_BUDGET_RESPONSE bytes and the page is cut at the last complete block
+# (dropped instead when BYTE_BUDGET_TRUNCATE is False, before the download
+# when Content-Length is over the limit); a domain stops being crawled after
+# BYTE_BUDGET_DOMAIN bytes and the whole crawl after BYTE_BUDGET_TOTAL. 0
+# disables a limit. URLs that hit a limit are listed in BYTE_BUDGET_DB.
+BYTE_BUDGET_RESPONSE = 2 * 1024 * 1024
+BYTE_BUDGET_DOMAIN = 64 * 1024 * 1024
+BYTE_BUDGET_TOTAL = 0
+BYTE_BUDGET_TRUNCATE = True
+BYTE_BUDGET_DB = "tospp_data.db"
+
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 #HTTPCACHE_ENABLED = True
@@ -87,6 +170,43 @@ ITEM_PIPELINES = {
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Remember fetched requests across runs in mmap'd Bloom filters (see
+# dupefilter.py). A URL is fetched again once DUPEFILTER_TTL seconds have
+# passed; DUPEFILTER_MEMORY_MB is split over the rotating generations and
+# sized for DUPEFILTER_CAPACITY fingerprints per TTL window. Static start
+# URLs are never filtered. Start URLs from a URL feed are fetched once per
+# run and again once DUPEFILTER_SEED_TTL seconds have passed, so a URL
+# repeated in a feed costs one request while a daily recrawl still reaches
+# the validator cache and the content fingerprints; their filters are sized
+# by DUPEFILTER_SEED_MEMORY_MB and DUPEFILTER_SEED_CAPACITY.
+DUPEFILTER_CLASS = "tosppcrawler.dupefilter.PersistentDupeFilter"
+DUPEFILTER_DIR = "dupefilter"
+DUPEFILTER_TTL = 7 * 24 * 3600
+DUPEFILTER_GENERATIONS = 4
+DUPEFILTER_MEMORY_MB = 64
+DUPEFILTER_CAPACITY = 50_000_000
+DUPEFILTER_SEED_TTL = 12 * 3600
+DUPEFILTER_SEED_MEMORY_MB = 16
+DUPEFILTER_SEED_CAPACITY = 10_000_000
+
+# Record-and-replay response archive (see archive.py). Crawl once with
+# -s ARCHIVE_MODE=record to store every raw response under ARCHIVE_DIR, then
+# use -s ARCHIVE_MODE=replay to re-run parse() and the pipelines over the
+# archive with no network access. A replay leaves the state of real crawls
+# alone: no dupefilter, validators, fingerprints or feed cursors are read or
+# written, site line counts are only read and byte budget hits not kept.
+ARCHIVE_MODE = None
+ARCHIVE_DIR = "archive"
+DOWNLOAD_HANDLERS = {
+    "http": "tosppcrawler.archive.ArchiveDownloadHandler",
+    "https": "tosppcrawler.archive.ArchiveDownloadHandler",
+}
+
+# Keep only the main content of each page (see extraction.py): blocks are
+# scored by text and link density, and navigation, cookie banners, footers
+# and link lists are dropped before the text reaches the pipelines.
+BOILERPLATE_REMOVAL = True
+
 # Set settings whose default value is deprecated to a future-proof value
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
@@ -1,5 +1,8 @@
 import scrapy
 
+from tosppcrawler.extraction import extract_page_text
+from tosppcrawler.url_feed import StartUrlFeed
+
 
 class TosSpiderSpider(scrapy.Spider):
     name = "tos_spider"
@@ -9,11 +12,31 @@ class TosSpiderSpider(scrapy.Spider):
     "https://www.mozilla.org/en-US/privacy/"
      ]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if getattr(self, "urls_file", None) or getattr(self, "urls_db", None):
+            # Seeds from a URL feed can be on any site
+            self.allowed_domains = []
+
+    def start_requests(self):
+        # Stream seeds from -a urls_file=... / -a urls_db=... when given,
+        # otherwise crawl the static start_urls above
+        feed = StartUrlFeed.from_spider(self)
+        if feed is None:
+            yield from super().start_requests()
+            return
+        for position, url in feed:
+            yield feed.request(scrapy.Request(url, callback=self.parse), position)
+
 
     def parse(self, response):
         title = response.css('title::text').get()
-        content = response.css('body *::text').getall()
-        cleaned_content = ' '.join([line.strip() for line in content if line.strip()])
+        # One DOM walk that skips script/style/JSON payloads entirely; JS
+        # shells fall back to the policy text inside those payloads. Menus,
+        # banners and footers are dropped with BOILERPLATE_REMOVAL on.
+        cleaned_content = extract_page_text(
+            response, main_content=self.settings.getbool("BOILERPLATE_REMOVAL"),
+        )
 
         yield {
             "title": title,
@@ -0,0 +1,98 @@
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+
+# Splits text after every sentence end and line break. Joining the pieces
+# gives back the exact original, whitespace included.
+_UNIT = re.compile(r"(?<=[.!?\n])")
+
+
+def split_units(text):
+    return _UNIT.split(text)
+
+
+def make_delta(source, target):
+    # Compressed edit script that rebuilds target from source, sentence by
+    # sentence: [start, end] copies source units, a string is inserted as is.
+    # Unchanged stretches cost a few bytes whatever their length.
+    a = split_units(source)
+    b = split_units(target)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(b[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def apply_delta(source, delta):
+    units = split_units(source)
+    parts = []
+    for op in json.loads(zlib.decompress(delta)):
+        parts.append(op if isinstance(op, str) else "".join(units[op[0]:op[1]]))
+    return "".join(parts)
+
+
+class VersionHistory:
+    # Older versions of each document as reverse deltas. The caller keeps
+    # the latest text in full; whenever it changes, record() stores the
+    # delta from the new text back to the one it replaces, so a document
+    # that changed N times costs its latest copy plus N small diffs.
+    # Version numbers start at 1 per URL and the latest version is
+    # len(versions(url)) + 1. It writes through the caller's connection and
+    # leaves committing to the caller, so a version is stored in the same
+    # transaction as the text that replaced it.
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS document_versions (
+                url TEXT,
+                version INTEGER,
+                crawled_at REAL,
+                delta BLOB,
+                PRIMARY KEY (url, version)
+            )
+        ''')
+
+    def record(self, url, previous_text, previous_crawled_at, latest_text):
+        # Archives previous_text, which latest_text is replacing
+        row = self.connection.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM document_versions WHERE url = ?", (url,)
+        ).fetchone()
+        self.connection.execute(
+            "INSERT INTO document_versions (url, version, crawled_at, delta) VALUES (?, ?, ?, ?)",
+            (url, row[0] + 1, previous_crawled_at, make_delta(latest_text, previous_text)),
+        )
+
+    def versions(self, url):
+        # (version, crawled at) of every archived version, oldest first
+        return self.connection.execute(
+            "SELECT version, crawled_at FROM document_versions WHERE url = ? ORDER BY version", (url,)
+        ).fetchall()
+
+    def rebuild(self, url, version, latest_text):
+        # Text of an archived version, walking back from the latest text one
+        # delta at a time; None if there is no such version
+        rows = self.connection.execute(
+            "SELECT version, delta FROM document_versions WHERE url = ? AND version >= ? ORDER BY version DESC",
+            (url, version),
+        ).fetchall()
+        if not rows or rows[-1][0] != version:
+            return None
+        text = latest_text
+        for _, delta in rows:
+            text = apply_delta(text, delta)
+        return text
+
+    def size(self, url=None):
+        # Bytes of deltas stored, for one URL or all of them
+        if url is None:
+            row = self.connection.execute("SELECT COALESCE(SUM(LENGTH(delta)), 0) FROM document_versions").fetchone()
+        else:
+            row = self.connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(delta)), 0) FROM document_versions WHERE url = ?", (url,)
+            ).fetchone()
+        return row[0]